@@ -16,4 +16,11 @@ from .phi_matrix import phi_matrix
 from .std_chol_svd import std_chol_svd
 from .local_std_trick import local_std_trick
 from .proj import proj
+from .jit import jit
+from .function_backend import function_backend
+from .micro_batch import micro_batch
+from .numpy_backend import numpy_backend
+from .graph_cache import graph_cache
+from .sparse import sparse
+from .chunk_beta import chunk_beta
 from .cnn import cnn
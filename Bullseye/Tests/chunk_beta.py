@@ -0,0 +1,71 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","chunk_beta.data")
+
+def chunk_beta(recompute = False):
+    """
+    Check that the μ reached when the βᵢ of the chunks are kept in each
+    chunk_beta_form is the one reached summing the chunks, with a full and a
+    diagonal covariance, in which case only the diagonals of the βᵢ are kept.
+    """
+    forms = {"sum" : {"chunk_as_sum" : True},
+             "full" : {"chunk_as_sum" : False, "chunk_beta_form" : "full"},
+             "packed" : {"chunk_as_sum" : False, "chunk_beta_form" : "packed"},
+             #all the eigenvalues are kept : βᵢ is exact
+             "low_rank" : {"chunk_as_sum" : False,
+                           "chunk_beta_form" : "low_rank"}}
+    if recompute:
+        d, n, k, m = (4, 2000, 3, 500)
+        p = d*k
+        n_iter = 5
+
+        rows = []
+        with tempfile.TemporaryDirectory() as directory:
+            csv_filename = os.path.join(directory, "chunk_beta.csv")
+            Bullseye.generate_multilogit(d = d, n = n, k = k,
+                                         file = csv_filename)
+            for diag_cov in [False, True]:
+                mus = {}
+                for (form, options) in forms.items():
+                    bull = Bullseye.Graph()
+                    bull.feed_with(file = csv_filename, k = k, m = m,
+                                   to_one_hot = True)
+                    bull.set_predefined_model("multilogit")
+                    bull.set_predefined_prior("normal_iid")
+                    bull.init_with(mu_0 = 0, cov_0 = 1)
+                    bull.set_options(s = 20, seed = 0, diag_cov = diag_cov,
+                                     chunk_beta_rank = p, **options)
+                    bull.build()
+                    run_id = 'chunk_beta_{}_{}'.format(form, int(diag_cov))
+                    mus[form] = bull.run(n_iter = n_iter,
+                                         run_id = run_id)["mu"]
+                    bull.close()
+                for form in forms:
+                    difference = np.max(np.abs(mus[form] - mus["sum"]))
+                    assert np.allclose(mus[form], mus["sum"], rtol = 1e-3,
+                                       atol = 1e-3),\
+                        "{} (diag_cov={}) : μ differs".format(form, diag_cov)
+                    rows.append({'form' : form, 'diag_cov' : diag_cov,
+                                 'difference' : difference})
+
+        df = pd.DataFrame(rows)
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        sns.set()
+        sns.barplot(x="form", y="difference", hue="diag_cov", data=df)
+        handle_fig("chunk_beta")
+    else:
+        raise FileNotFoundError
@@ -0,0 +1,97 @@
+import time
+import os
+import numpy as np
+import pandas as pd
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","function_backend.data")
+
+def function_backend(recompute = False):
+    """
+    Check that the "function" backend gives the same μ, Σ and ELBO as the
+    "session" backend, the samples being drawn with the same seed, the data
+    being given to ``feed_with``, to ``run`` instead of the one given to
+    ``feed_with``, or only to ``run``.
+    """
+    configurations = [("LM", True, "feed_with"),
+                      ("multilogit", True, "feed_with"),
+                      ("multilogit", False, "feed_with"),
+                      ("multilogit", True, "run"),
+                      ("multilogit", True, "run_only")]
+    if recompute:
+        df = pd.DataFrame(columns=["configuration","quantity","difference"])
+        
+        n_iter = 5
+        
+        backends = ["session", "function"]
+        
+        d, n, k = (5, 500, 3)
+        
+        for (model, use_projections, data) in configurations:
+            if model == "multilogit":
+                generate = lambda : \
+                    Bullseye.generate_multilogit(d = d, n = n, k = k)
+            else:
+                generate = lambda : Bullseye.generate_lm(d = d, n = n)
+            theta_0, x_array, y_array = generate()
+            #data given to feed_with and replaced by the one given to run
+            theta_1, x_other, y_other = generate()
+            configuration = "{} {}".format(model, "proj" if use_projections
+                                                  else "without_proj")
+            if data != "feed_with":
+                configuration += " " + data
+            
+            results = {}
+            for backend in backends:
+                bull = Bullseye.Graph()
+                if data == "feed_with":
+                    bull.feed_with(X = x_array, Y = y_array)
+                elif data == "run":
+                    bull.feed_with(X = x_other, Y = y_other)
+                else:
+                    bull.feed_with(d = x_array.shape[1], k = y_array.shape[1])
+                bull.set_predefined_model(model,
+                                          use_projections = use_projections)
+                bull.set_predefined_prior("normal_iid")
+                bull.init_with(mu_0 = 0, cov_0 = 1)
+                bull.set_options(backend = backend, s = 20, seed = 0)
+                bull.build()
+                run_id = '{} {}'.format(configuration, backend)
+                run_data = {} if data == "feed_with" else {"X" : x_array,
+                                                           "Y" : y_array}
+                results[backend] = bull.run(n_iter = n_iter, run_id = run_id,
+                                            **run_data)
+            
+            #largest absolute difference between the two backends
+            differences = {name : np.max(np.abs(
+                                    np.asarray(results["session"][name])
+                                    - np.asarray(results["function"][name])))
+                           for name in ["mu", "cov", "elbo"]}
+            for name in differences:
+                assert np.allclose(results["session"][name],
+                                   results["function"][name],
+                                   rtol = 1e-3, atol = 1e-3),\
+                    "{} : the backends differ on {}".format(configuration,
+                                                            name)
+            df_ = pd.DataFrame({'configuration' : 3*[configuration],
+                                'quantity' : list(differences),
+                                'difference' : list(differences.values())})
+            df = df.append(df_, sort=False)
+                
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+        
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        sns.set()
+        sns.barplot(x="configuration", y="difference", hue="quantity",
+                    data=df)
+        handle_fig("function_backend")
+    else:
+        raise FileNotFoundError
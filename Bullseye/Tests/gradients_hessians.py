@@ -1,5 +1,6 @@
 import time
 import os
+import numpy as np
 import pandas as pd
 from .utils import *
 
@@ -10,18 +11,119 @@ import Bullseye
 from Bullseye import generate_multilogit
 from Bullseye.visual import *
 from Bullseye.profilers import trace_results
+from Bullseye.lazy_import import tf
+from Bullseye.autodiff import autodiff_modes, hessian, batched_hessians,\
+    weighted_hessian
+from Bullseye.predefined_functions import Psi_multilogit,\
+    Psi_multilogit_batched, hess_Psi_multilogit_batched,\
+    weighted_hess_Psi_multilogit
 
 cwd = os.path.dirname(os.path.realpath(__file__))
 result_filename = os.path.join(cwd,"data","gradients_hessians.data")
+autodiff_filename = os.path.join(cwd,"data","gradients_hessians_autodiff.data")
+scaling_filename = os.path.join(cwd,"data","gradients_hessians_scaling.data")
 
 class Option:
     def __init__(self, focus, opt):
         self.focus = focus
         self.opt = opt
 
+def autodiff_differences(d = 5, n = 200, k = 3, s = 10):
+    """
+    Largest absolute difference between the hessians of the multilogit ψ
+    computed by each mode of ``autodiff`` and the user-given ones, for a
+    single θ at a time within map_fn, as in ``compute_psis``, and for a
+    batched ψ, as well as ∑ⱼ wⱼ·Hψ(θⱼ) built from hessian-vector products
+    by blocks of coordinates, the last block of 4 being incomplete.
+    """
+    p = d*k
+    theta_0, x_array, y_array = generate_multilogit(d = d, n = n, k = k)
+    thetas_array = np.random.normal(size = [s,p])
+    weights_array = np.random.uniform(size = [s])
+    
+    rows = []
+    with tf.Graph().as_default():
+        X = tf.constant(x_array, dtype = tf.float32)
+        Y = tf.constant(y_array, dtype = tf.float32)
+        thetas = tf.constant(thetas_array, dtype = tf.float32)
+        weights = tf.constant(weights_array, dtype = tf.float32)
+        
+        user = hess_Psi_multilogit_batched(X, Y, thetas)
+        user_weighted = weighted_hess_Psi_multilogit(X, Y, thetas, weights)
+        weighted = {"hvp {}".format(block_size) :
+                    weighted_hessian(lambda t : Psi_multilogit_batched(X,Y,t),
+                                     thetas, weights, block_size = block_size)
+                    for block_size in [1, 4, 16]}
+        hessians = {}
+        for mode in autodiff_modes:
+            hessians[("single", mode)] = tf.map_fn(
+                lambda t : hessian(mode, lambda t_ : Psi_multilogit(X,Y,t_),
+                                   t),
+                thetas, dtype = tf.float32)
+            hessians[("batched", mode)] = batched_hessians(mode,
+                lambda t : Psi_multilogit_batched(X,Y,t), thetas)
+        
+        with tf.Session() as sess:
+            user_, hessians_, user_weighted_, weighted_ = \
+                sess.run([user, hessians, user_weighted, weighted])
+    
+    compared = [(key, hess, user_) for (key, hess) in hessians_.items()]
+    compared += [(("weighted", mode), hess, user_weighted_)
+                 for (mode, hess) in weighted_.items()]
+    for (psi, mode), hess, reference in compared:
+        difference = np.max(np.abs(hess - reference))
+        assert np.allclose(hess, reference, rtol = 1e-3, atol = 1e-3),\
+            "{} {} : {}".format(psi, mode, difference)
+        rows.append({'psi' : psi, 'mode' : mode, 'difference' : difference})
+    return pd.DataFrame(rows)
+
+def weighted_scaling(ds = [5, 20, 50], n = 1000, k = 3, s = 50, n_runs = 5):
+    """
+    Time of ∑ⱼ wⱼ·Hψ(θⱼ) for the multilogit ψ as p grows, from the hessians
+    of ``batched_hessians`` or from hessian-vector products, one coordinate
+    at a time ("hvp 1") or by blocks ("hvp 16", "hvp 64").
+    """
+    rows = []
+    for d in ds:
+        p = d*k
+        theta_0, x_array, y_array = generate_multilogit(d = d, n = n, k = k)
+        with tf.Graph().as_default():
+            X = tf.constant(x_array, dtype = tf.float32)
+            Y = tf.constant(y_array, dtype = tf.float32)
+            #fed, so that β is not constant folded
+            thetas = tf.placeholder(tf.float32, [s,p])
+            weights = tf.placeholder(tf.float32, [s])
+            feed_dict = {thetas : np.random.normal(size = [s,p]),
+                         weights : np.random.uniform(size = [s])}
+            f = lambda t : Psi_multilogit_batched(X,Y,t)
+            betas = {mode : tf.einsum('s,spq->pq', weights,
+                                      batched_hessians(mode, f, thetas))
+                     for mode in ["tf", "pfor"]}
+            for block_size in [1, 16, 64]:
+                betas["hvp {}".format(block_size)] = weighted_hessian(
+                    f, thetas, weights, block_size = block_size)
+            with tf.Session() as sess:
+                for (mode, beta) in betas.items():
+                    #the first run is a warm up
+                    sess.run(beta, feed_dict = feed_dict)
+                    for run in range(n_runs):
+                        start_time = time.time()
+                        sess.run(beta, feed_dict = feed_dict)
+                        rows.append({'p' : p, 'mode' : mode,
+                                     'time' : time.time() - start_time})
+    return pd.DataFrame(rows)
+
 def gradients_hessians(recompute = False):
     if recompute:
         
+        #the automatic hessians first agree with the user-given ones
+        df_autodiff = autodiff_differences()
+        df_autodiff.to_csv(autodiff_filename)
+        
+        #cost of β as p grows
+        df_scaling = weighted_scaling()
+        df_scaling.to_csv(scaling_filename)
+        
         n_iter = 10
         num_of_loops = 10
         k=3
@@ -33,10 +135,12 @@ def gradients_hessians(recompute = False):
                    Option("grad","tf"),
                    Option("grad","act"),
                    Option("hess","tf"),
+                   Option("hess","pfor"),
+                   Option("hess","hvp"),
                    Option("hess","grad"),
                    Option("hess","act")]
                           
-        df = pd.DataFrame(columns=["focus","opt","time","elbo"])
+        df = pd.DataFrame(columns=["focus","opt","time","elbo","build_time"])
         
         for loop in range(num_of_loops):
             theta_0, x_array, y_array= generate_multilogit(d = d, n = n, k = k)
@@ -59,10 +163,18 @@ def gradients_hessians(recompute = False):
                 bull.set_predefined_prior("normal_iid")
                 bull.init_with(mu_0 = 0, cov_0 = 1)
                 bull.set_options(**opts)
+                start_time = time.time()
                 bull.build()
+                build_time = time.time() - start_time
                 
                 run_id = 'gradients_hessians_{}_{}'.format(option.focus, option.opt)
-                res = bull.run(n_iter = n_iter, run_id = run_id)
+                #the approximated hessians may lead to a singular covariance
+                try:
+                    res = bull.run(n_iter = n_iter, run_id = run_id)
+                except tf.errors.InvalidArgumentError:
+                    warn("{} {} diverged in loop {}".format(option.focus,
+                                                            option.opt, loop))
+                    continue
                 
                 times = res["times"]
                 #mus,covs,elbos = trace_results(run_id)
@@ -74,7 +186,8 @@ def gradients_hessians(recompute = False):
                                     'opt' : [option.opt]*n_iter,
                                     'time' : times,
                                     'elbo' : elbos,
-                                    'iter' : list(range(n_iter))
+                                    'iter' : list(range(n_iter)),
+                                    'build_time' : [build_time]*n_iter
                                     })
                 
                 df = df.append(df_, sort = False)
@@ -107,5 +220,26 @@ def gradients_hessians(recompute = False):
         sns.set()
         sns.lineplot(x="iter", y="elbo",hue="opt",data=df_hess)
         handle_fig("hessians_prec")
+        
+        #building the graph, automatic hessians included
+        if "build_time" in df_hess:
+            sns.set()
+            sns.boxplot(x="opt", y="build_time",data=df_hess)
+            handle_fig("hessians_build_time")
+        
+        #agreement of the automatic hessians
+        if os.path.isfile(autodiff_filename):
+            df_autodiff = pd.read_csv(autodiff_filename)
+            sns.set()
+            sns.barplot(x="mode", y="difference", hue="psi",
+                        data=df_autodiff)
+            handle_fig("hessians_autodiff")
+        
+        #cost of β as p grows
+        if os.path.isfile(scaling_filename):
+            df_scaling = pd.read_csv(scaling_filename)
+            sns.set()
+            sns.lineplot(x="p", y="time", hue="mode", data=df_scaling)
+            handle_fig("hessians_scaling")
     else:
         raise FileNotFoundError
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from Bullseye.graph_cache import graph_signature, names_suffix
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","graph_cache.data")
+
+#builds a configuration in a new process and prints its signature, whether
+#the cached graph was loaded and the time taken by ``build``
+build_script = """
+import sys, os, json, time
+import numpy as np
+import Bullseye
+from Bullseye.graph_cache import graph_signature, names_suffix
+from Bullseye.predefined_functions import Psi_multilogit_batched
+
+data, cache, configuration = sys.argv[1:]
+x_array, y_array = np.load(data + "_X.npy"), np.load(data + "_Y.npy")
+d, k = x_array.shape[1], y_array.shape[1]
+
+bull = Bullseye.Graph()
+bull.feed_with(X = x_array, Y = y_array)
+#the hessian of ψ is computed by automatic differentiation
+if configuration == "predefined":
+    bull.set_predefined_model("multilogit", psi_option = "without_hess")
+else:
+    bull.set_model(Psi = Psi_multilogit_batched, batched_Psi = True, p = d*k)
+bull.set_predefined_prior("normal_iid")
+bull.init_with(mu_0 = 0, cov_0 = 1)
+bull.set_options(compute_hess = "pfor", graph_cache = cache)
+
+cached = set(os.listdir(cache))
+start_time = time.time()
+bull.build()
+build_time = time.time() - start_time
+signature = graph_signature(bull)
+print(json.dumps({"signature" : signature,
+                  "loaded" : signature + names_suffix in cached,
+                  "build_time" : build_time}))
+"""
+
+#ψ of a batched user model, defined through exec
+psi_source = """
+import tensorflow.compat.v1 as tf
+def Psi(X, Y, thetas):
+    d = X.get_shape().as_list()[1]
+    A = tf.matmul(X, tf.reshape(thetas, [-1,d]), transpose_b = True)
+    return tf.reduce_sum(tf.square(A) {} tf.reduce_sum(Y), axis = 0)
+"""
+
+def build_in_process(data, cache, configuration):
+    output = subprocess.run([sys.executable, "-c", build_script, data, cache,
+                             configuration], stdout = subprocess.PIPE,
+                            check = True, universal_newlines = True,
+                            env = {**os.environ, "PYTHONPATH" :
+                                   os.path.dirname(os.path.dirname(cwd))})
+    return json.loads(output.stdout.splitlines()[-1])
+
+def round_trip(cache, x_array, y_array, use_projections):
+    """
+    Build a configuration, then build it again from the cache, and check
+    that both graphs give the same μ, Σ and ELBO, the samples being drawn
+    with the same seed.
+    """
+    results = []
+    for process in ["build", "load"]:
+        bull = Bullseye.Graph()
+        bull.feed_with(X = x_array, Y = y_array)
+        bull.set_predefined_model("multilogit",
+                                  use_projections = use_projections)
+        bull.set_predefined_prior("normal_iid")
+        bull.init_with(mu_0 = 0, cov_0 = 1)
+        bull.set_options(s = 20, seed = 0, graph_cache = cache)
+        cached = set(os.listdir(cache))
+        bull.build()
+        signature = graph_signature(bull)
+        assert (signature + names_suffix in cached) == (process == "load")
+        results.append(bull.run(n_iter = 5, run_id = "graph_cache_"+process))
+        bull.close()
+    for name in ["mu", "cov", "elbo"]:
+        assert np.allclose(results[0][name], results[1][name]),\
+            "the loaded graph differs on {}".format(name)
+    return signature
+
+def graph_cache(recompute = False):
+    """
+    Check that a configuration with automatic hessians built in a process is
+    loaded from the cache in another one, and that a loaded graph gives the
+    same results as the built one.
+    """
+    configurations = ["predefined", "user"]
+    if recompute:
+        df = pd.DataFrame(columns=["configuration","process","build_time"])
+
+        d, n, k = (5, 500, 3)
+
+        theta_0, x_array, y_array = \
+            Bullseye.generate_multilogit(d = d, n = n, k = k)
+
+        with tempfile.TemporaryDirectory() as cache:
+            #round trip, μ and Σ being variables read from the loaded graph
+            round_trip(cache, x_array, y_array, use_projections = False)
+
+            #sparse data of the same shape but with a different number of
+            #non zero entries cannot share a graph
+            x_sparse = scipy.sparse.random(n, d, density = 0.5,
+                                           format = 'csr', dtype = np.float32)
+            x_sparser = scipy.sparse.random(n, d, density = 0.3,
+                                            format = 'csr', dtype = np.float32)
+            signatures = [round_trip(cache, x, y_array, use_projections = True)
+                          for x in [x_sparse, x_sparser]]
+            assert signatures[0] != signatures[1]
+
+            #functions of the same name defined through exec, whose source
+            #cannot be read, do not share a graph
+            signatures = []
+            for operation in ["+", "*"]:
+                namespace = {}
+                exec(psi_source.format(operation), namespace)
+                bull = Bullseye.Graph()
+                bull.feed_with(X = x_array, Y = y_array)
+                bull.set_model(Psi = namespace["Psi"], batched_Psi = True,
+                               p = d*k)
+                bull.set_predefined_prior("normal_iid")
+                bull.set_options(compute_hess = "pfor")
+                signatures.append(graph_signature(bull))
+            assert signatures[0] != signatures[1]
+
+            #the same configuration built in two processes
+            data = os.path.join(cache, "data")
+            np.save(data + "_X.npy", x_array)
+            np.save(data + "_Y.npy", y_array)
+            for configuration in configurations:
+                first, second = [build_in_process(data, cache, configuration)
+                                 for _ in range(2)]
+                assert first["signature"] == second["signature"],\
+                    "{} : the signature changes".format(configuration)
+                assert not first["loaded"] and second["loaded"],\
+                    "{} : the cached graph is not loaded".format(configuration)
+                df_ = pd.DataFrame({'configuration' : 2*[configuration],
+                                    'process' : ["build", "load"],
+                                    'build_time' : [first["build_time"],
+                                                    second["build_time"]]})
+                df = df.append(df_, sort=False)
+
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        sns.set()
+        sns.barplot(x="configuration", y="build_time", hue="process",
+                    data=df)
+        handle_fig("graph_cache")
+    else:
+        raise FileNotFoundError
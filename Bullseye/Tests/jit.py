@@ -0,0 +1,65 @@
+import time
+import os
+import pandas as pd
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","jit.data")
+
+def jit(recompute = False):
+    models = ["multilogit", "LM"]
+    if recompute:
+        df = pd.DataFrame(columns=["method","time","status","model"])
+        
+        n_iter = 10
+        n_loops = 3
+        
+        methods = ["plain", "jit"]
+        
+        d, n, k = (10, 5000, 5)
+        
+        for model in models:
+            if model == "multilogit":
+                theta_0, x_array, y_array = \
+                    Bullseye.generate_multilogit(d = d, n = n, k = k)
+            else:
+                theta_0, x_array, y_array = Bullseye.generate_lm(d = d, n = n)
+            
+            for method in methods:
+                bull = Bullseye.Graph()
+                bull.feed_with(X = x_array, Y = y_array)
+                bull.set_predefined_model(model)
+                bull.set_predefined_prior("normal_iid")
+                bull.init_with(mu_0 = 0, cov_0 = 1)
+                bull.set_options(jit = (method == "jit"))
+                bull.build()
+                
+                for _ in range(n_loops):
+                    run_id = '{model} {method} run {n}'.format(model=model,
+                                                              method=method,
+                                                              n=_)
+                    d_ = bull.run(n_iter = n_iter, run_id = run_id)
+                    #the first iteration includes the compilation
+                    df_ = pd.DataFrame({'method' : (n_iter-1)*[method],
+                                        'time' : d_["times"][1:],
+                                        'status': d_["status"][1:],
+                                        'model' : (n_iter-1)*[model]})
+                    df = df.append(df_, sort=False)
+                
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+        
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        for (i, model) in enumerate(models):
+            sns.set()
+            sns.boxplot(x="method", y="time",data=df.loc[df["model"]==model],
+                        showfliers=False)
+            handle_fig("jit_{}".format(i))
+    else:
+        raise FileNotFoundError
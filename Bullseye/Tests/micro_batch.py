@@ -0,0 +1,164 @@
+import time
+import os
+import sys
+import json
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from Bullseye.lazy_import import tf
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","micro_batch.data")
+triplets_filename = os.path.join(cwd,"data","micro_batch_triplets.data")
+
+#runs a configuration in a new process, the peak resident memory being the
+#one of the whole process, and prints the times, the status and the peak
+#resident memory in megabytes
+run_script = """
+import sys, json, resource
+import numpy as np
+import Bullseye
+
+data, options, n_iter, n_loops = sys.argv[1:]
+x_array, y_array = np.load(data + "_X.npy"), np.load(data + "_Y.npy")
+
+bull = Bullseye.Graph()
+bull.feed_with(X = x_array, Y = y_array)
+bull.set_predefined_model("multilogit", use_projections = True)
+bull.set_predefined_prior("normal_iid")
+bull.init_with(mu_0 = 0, cov_0 = 1)
+bull.set_options(**json.loads(options))
+bull.build()
+
+times, status = [], []
+for n in range(int(n_loops)):
+    d_ = bull.run(n_iter = int(n_iter), run_id = "micro_batch_run_{}".format(n))
+    times += list(d_["times"])
+    status += list(d_["status"])
+
+#kilobytes on linux, bytes on macOS
+peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+peak_rss /= 2**20 if sys.platform == "darwin" else 2**10
+print(json.dumps({"times" : times, "status" : status,
+                  "peak_rss" : peak_rss}))
+"""
+
+def run_in_process(data, options, n_iter, n_loops):
+    output = subprocess.run([sys.executable, "-c", run_script, data,
+                             json.dumps(options), str(n_iter), str(n_loops)],
+                            stdout = subprocess.PIPE, check = True,
+                            universal_newlines = True,
+                            env = {**os.environ, "PYTHONPATH" :
+                                   os.path.dirname(os.path.dirname(cwd))})
+    return json.loads(output.stdout.splitlines()[-1])
+
+def triplet_differences(d = 10, n = 5000, k = 5):
+    """
+    Largest absolute differences between e, ρ and β computed in the session
+    backend at μ₀ and Σ₀ with and without micro-batching, the samples being
+    drawn with the same seed.
+    """
+    theta_0, x_array, y_array = \
+        Bullseye.generate_multilogit(d = d, n = n, k = k)
+    names = ["computed_e", "computed_rho", "computed_beta"]
+    #the last sub-batch of 777 rows is smaller
+    methods = {"None" : {}, "size 1000" : {"micro_batch_size" : 1000},
+               "size 777" : {"micro_batch_size" : 777},
+               "memory 4" : {"micro_batch_memory" : 4}}
+    triplets = {}
+    for (method, options) in methods.items():
+        bull = Bullseye.Graph()
+        bull.feed_with(X = x_array, Y = y_array)
+        bull.set_predefined_model("multilogit", use_projections = True)
+        bull.set_predefined_prior("normal_iid")
+        bull.init_with(mu_0 = 0, cov_0 = 1)
+        bull.set_options(seed = 0, **options)
+        bull.build()
+        #once initialized, the triplets are the ones of μ₀ and Σ₀
+        with tf.Session(graph = bull.graph) as sess:
+            sess.run(bull.in_graph["init"],
+                     feed_dict = {"X_init:0" : x_array, "Y_init:0" : y_array})
+            triplets[method] = sess.run([bull.in_graph[name]
+                                         for name in names])
+
+    rows = []
+    for method in methods:
+        for (name, value, reference) in zip(names, triplets[method],
+                                            triplets["None"]):
+            assert np.allclose(value, reference, rtol = 1e-4, atol = 1e-2),\
+                "{} : the triplets differ on {}".format(method, name)
+            rows.append({'method' : method, 'quantity' : name,
+                         'difference' : np.max(np.abs(value - reference))})
+    return pd.DataFrame(rows)
+
+def micro_batch(recompute = False):
+    if recompute:
+        #e, ρ and β do not depend on micro-batching
+        df_triplets = triplet_differences()
+        df_triplets.to_csv(triplets_filename)
+
+        df = pd.DataFrame(columns=["micro_batch_size","time","status",
+                                   "peak_rss"])
+
+        n_iter = 5
+        n_loops = 3
+
+        #None processes all the rows at once, "memory x" deduces the number
+        #of rows from a budget of x megabytes
+        methods = {"None" : {}}
+        for micro_batch_size in [20000, 5000, 1000]:
+            methods[str(micro_batch_size)] = \
+                {"micro_batch_size" : micro_batch_size}
+        for micro_batch_memory in [256, 64]:
+            methods["memory {}".format(micro_batch_memory)] = \
+                {"micro_batch_memory" : micro_batch_memory}
+
+        d, n, k = (10, 100000, 5)
+
+        theta_0, x_array, y_array = \
+                Bullseye.generate_multilogit(d = d, n = n, k = k)
+        with tempfile.TemporaryDirectory() as directory:
+            data = os.path.join(directory, "data")
+            np.save(data + "_X.npy", x_array)
+            np.save(data + "_Y.npy", y_array)
+            for (method, options) in methods.items():
+                d_ = run_in_process(data, options, n_iter, n_loops)
+                df_ = pd.DataFrame({'micro_batch_size' :
+                                        n_iter*n_loops*[method],
+                                    'time' : d_["times"],
+                                    'status': d_["status"],
+                                    'peak_rss' : n_iter*n_loops*[
+                                        d_["peak_rss"]]})
+                df = df.append(df_, sort=False)
+
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        sns.set()
+        sns.boxplot(x="micro_batch_size", y="time",data=df,showfliers=False)
+        handle_fig("micro_batch")
+
+        #peak resident memory of the process
+        sns.set()
+        sns.barplot(x="micro_batch_size", y="peak_rss",
+                    data=df.drop_duplicates("micro_batch_size"))
+        handle_fig("micro_batch_memory")
+
+        #agreement of the micro-batched triplets
+        if os.path.isfile(triplets_filename):
+            df_triplets = pd.read_csv(triplets_filename)
+            sns.set()
+            sns.barplot(x="method", y="difference", hue="quantity",
+                        data=df_triplets)
+            handle_fig("micro_batch_triplets")
+    else:
+        raise FileNotFoundError
@@ -1,12 +1,12 @@
 import Bullseye
-import tensorflow as tf
+import tensorflow.compat.v1 as tf
 import numpy as np
 import os
 import seaborn as sns
 import matplotlib.pyplot as plt
 import time
 import pandas as pd
-from tensorflow.initializers import constant as tic
+tic = tf.constant_initializer
 from .utils import *
 from Bullseye.visual import *
 from Bullseye.profilers import trace_results
@@ -0,0 +1,152 @@
+import time
+import os
+import numpy as np
+import pandas as pd
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","numpy_backend.data")
+agreement_filename = os.path.join(cwd,"data","numpy_backend_agreement.data")
+
+def agreement(d = 5, n = 500, k = 3, s = 500, n_iter = 20):
+    """
+    Largest differences between the μ, Σ and ELBO reached by the "numpy" and
+    "session" backends. Their samples are drawn by numpy and tensorflow
+    respectively : the differences are relative to the posterior standard
+    deviations for μ and Σ, and within the Monte Carlo error.
+    """
+    rows = []
+    for model in ["multilogit", "LM"]:
+        for use_projections in [True, False]:
+            if model == "multilogit":
+                theta_0, x_array, y_array = \
+                    Bullseye.generate_multilogit(d = d, n = n, k = k)
+            else:
+                theta_0, x_array, y_array = Bullseye.generate_lm(d = d, n = n)
+            configuration = "{} {}".format(model, "proj" if use_projections
+                                                  else "without_proj")
+            results = {}
+            for backend in ["session", "numpy"]:
+                bull = Bullseye.Graph()
+                bull.feed_with(X = x_array, Y = y_array)
+                bull.set_predefined_model(model,
+                                          use_projections = use_projections)
+                bull.set_predefined_prior("normal_iid")
+                bull.init_with(mu_0 = 0, cov_0 = 1)
+                bull.set_options(backend = backend, s = s)
+                bull.build()
+                run_id = '{} {} agreement'.format(configuration, backend)
+                results[backend] = bull.run(n_iter = n_iter, run_id = run_id)
+            
+            session, numpy = results["session"], results["numpy"]
+            std = np.sqrt(np.diag(session["cov"]))
+            differences = {
+                "mu" : np.max(np.abs(session["mu"] - numpy["mu"]) / std),
+                "cov" : np.max(np.abs(session["cov"] - numpy["cov"])
+                               / np.outer(std, std)),
+                "elbo" : np.abs(session["elbo"] - numpy["elbo"])}
+            tolerances = {"mu" : 0.5, "cov" : 0.05, "elbo" : 1.}
+            for name in differences:
+                assert differences[name] < tolerances[name],\
+                    "{} : the backends differ on {}".format(configuration,
+                                                            name)
+                rows.append({'configuration' : configuration,
+                             'quantity' : name,
+                             'difference' : differences[name]})
+    return pd.DataFrame(rows)
+
+def reproducibility(d = 5, n = 500, k = 3, n_iter = 5):
+    """
+    Check that two runs of the "numpy" backend with the same seed reach the
+    same μ, and that another seed does not.
+    """
+    theta_0, x_array, y_array = Bullseye.generate_multilogit(d = d, n = n,
+                                                             k = k)
+    mus = []
+    for seed in [0, 0, 1]:
+        bull = Bullseye.Graph()
+        bull.feed_with(X = x_array, Y = y_array)
+        bull.set_predefined_model("multilogit", use_projections = True)
+        bull.set_predefined_prior("normal_iid")
+        bull.init_with(mu_0 = 0, cov_0 = 1)
+        bull.set_options(backend = "numpy", seed = seed)
+        bull.build()
+        run_id = 'numpy reproducibility {}'.format(len(mus))
+        mus.append(bull.run(n_iter = n_iter, run_id = run_id)["mu"])
+    assert np.array_equal(mus[0], mus[1]), "same seed, different μ"
+    assert not np.array_equal(mus[0], mus[2]), "different seeds, same μ"
+
+def numpy_backend(recompute = False):
+    models = ["multilogit", "LM"]
+    if recompute:
+        #numpy runs are reproduced from the seed option
+        reproducibility()
+        #both backends first reach the same μ, Σ and ELBO
+        df_agreement = agreement()
+        df_agreement.to_csv(agreement_filename)
+        
+        df = pd.DataFrame(columns=["backend","time","status","model",
+                                   "build_time"])
+        
+        n_iter = 10
+        n_loops = 3
+        
+        backends = ["session", "numpy"]
+        
+        d, n, k = (10, 5000, 5)
+        
+        for model in models:
+            if model == "multilogit":
+                theta_0, x_array, y_array = \
+                    Bullseye.generate_multilogit(d = d, n = n, k = k)
+            else:
+                theta_0, x_array, y_array = Bullseye.generate_lm(d = d, n = n)
+            
+            for backend in backends:
+                bull = Bullseye.Graph()
+                bull.feed_with(X = x_array, Y = y_array)
+                bull.set_predefined_model(model, use_projections = True)
+                bull.set_predefined_prior("normal_iid")
+                bull.init_with(mu_0 = 0, cov_0 = 1)
+                bull.set_options(backend = backend)
+                start_time = time.time()
+                bull.build()
+                build_time = time.time() - start_time
+                
+                for _ in range(n_loops):
+                    run_id = '{model} {backend} run {n}'.format(model=model,
+                                                              backend=backend,
+                                                              n=_)
+                    d_ = bull.run(n_iter = n_iter, run_id = run_id)
+                    df_ = pd.DataFrame({'backend' : n_iter*[backend],
+                                        'time' : d_["times"],
+                                        'status': d_["status"],
+                                        'model' : n_iter*[model],
+                                        'build_time' : n_iter*[build_time]})
+                    df = df.append(df_, sort=False)
+                
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+        
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        for (i, model) in enumerate(models):
+            sns.set()
+            sns.boxplot(x="backend", y="time",data=df.loc[df["model"]==model],
+                        showfliers=False)
+            handle_fig("numpy_backend_{}".format(i))
+        
+        #agreement with the session backend
+        if os.path.isfile(agreement_filename):
+            df_agreement = pd.read_csv(agreement_filename)
+            sns.set()
+            sns.barplot(x="configuration", y="difference", hue="quantity",
+                        data=df_agreement)
+            handle_fig("numpy_backend_agreement")
+    else:
+        raise FileNotFoundError
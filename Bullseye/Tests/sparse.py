@@ -0,0 +1,131 @@
+import time
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+import seaborn as sns
+import matplotlib.pyplot as plt
+
+import Bullseye
+from Bullseye.lazy_import import tf
+from .utils import *
+
+cwd = os.path.dirname(os.path.realpath(__file__))
+result_filename = os.path.join(cwd,"data","sparse.data")
+triplets_filename = os.path.join(cwd,"data","sparse_triplets.data")
+
+def sparse_design(n, d, density, seed = 0):
+    """
+    Random sparse design matrix with an intercept, so that no row is empty.
+    """
+    x = scipy.sparse.random(n, d - 1, density = density, format = 'csr',
+                            dtype = np.float32, random_state = seed)
+    intercept = scipy.sparse.csr_matrix(np.ones([n,1], dtype = np.float32))
+    return scipy.sparse.hstack([intercept, x], format = 'csr')
+
+def triplets(x, y_array, options):
+    """
+    e, ρ and β computed in the session backend at μ₀ and Σ₀.
+    """
+    bull = Bullseye.Graph()
+    bull.feed_with(X = x, Y = y_array)
+    bull.set_predefined_model("multilogit",
+                              use_projections = options["use_projections"])
+    bull.set_predefined_prior("normal_iid")
+    bull.init_with(mu_0 = 0.1, cov_0 = 0.5)
+    bull.set_options(seed = 0, local_std_trick = options["local_std_trick"])
+    bull.build()
+    feed_dict = {"Y_init:0" : y_array}
+    if scipy.sparse.issparse(x):
+        x = x.tocoo()
+        feed_dict["X_indices_init:0"] = np.stack([x.row, x.col], 1)
+        feed_dict["X_values_init:0"] = x.data
+    else:
+        feed_dict["X_init:0"] = x
+    with tf.Session(graph = bull.graph) as sess:
+        sess.run(bull.in_graph["init"], feed_dict = feed_dict)
+        return sess.run([bull.in_graph[name] for name in
+                         ["computed_e", "computed_rho", "computed_beta"]])
+
+def triplet_differences(d = 8, n = 500, k = 3, density = 0.3):
+    """
+    Largest absolute differences between e, ρ and β computed from a sparse X
+    and from its dense copy, the samples being drawn with the same seed.
+    """
+    x_sparse = sparse_design(n, d, density)
+    y_array = np.eye(k, dtype = np.float32)[np.random.randint(k, size = n)]
+    configurations = {
+        "psi" : {"use_projections" : False, "local_std_trick" : True},
+        "proj" : {"use_projections" : True, "local_std_trick" : True},
+        "proj without trick" : {"use_projections" : True,
+                                "local_std_trick" : False}}
+    rows = []
+    for (configuration, options) in configurations.items():
+        sparse = triplets(x_sparse, y_array, options)
+        dense = triplets(x_sparse.toarray(), y_array, options)
+        for (name, value, reference) in zip(["e", "rho", "beta"], sparse,
+                                            dense):
+            assert np.allclose(value, reference, rtol = 1e-4, atol = 1e-4),\
+                "{} : sparse and dense differ on {}".format(configuration,
+                                                            name)
+            rows.append({'configuration' : configuration, 'quantity' : name,
+                         'difference' : np.max(np.abs(value - reference))})
+    return pd.DataFrame(rows)
+
+def sparse(recompute = False):
+    if recompute:
+        #a sparse X gives the triplets of its dense copy
+        df_triplets = triplet_differences()
+        df_triplets.to_csv(triplets_filename)
+
+        df = pd.DataFrame(columns=["density","X","time","status"])
+
+        n_iter = 5
+        n_loops = 3
+
+        d, n, k = (200, 20000, 3)
+        y_array = np.eye(k, dtype = np.float32)[np.random.randint(k, size = n)]
+
+        for density in [0.01, 0.05, 0.2]:
+            x_sparse = sparse_design(n, d, density)
+            for X in ["sparse", "dense"]:
+                bull = Bullseye.Graph()
+                bull.feed_with(X = x_sparse if X == "sparse"
+                                   else x_sparse.toarray(),
+                               Y = y_array)
+                bull.set_predefined_model("multilogit",
+                                          use_projections = True)
+                bull.set_predefined_prior("normal_iid")
+                bull.init_with(mu_0 = 0, cov_0 = 1)
+                bull.build()
+
+                for n_loop in range(n_loops):
+                    run_id = 'sparse_{}_{}_{}'.format(X, int(100*density),
+                                                      n_loop)
+                    d_ = bull.run(n_iter = n_iter, run_id = run_id)
+                    df_ = pd.DataFrame({'density' : n_iter*[density],
+                                        'X' : n_iter*[X],
+                                        'time' : d_["times"],
+                                        'status': d_["status"]})
+                    df = df.append(df_, sort=False)
+                bull.close()
+
+        with open(result_filename, "w", encoding = 'utf-8') as f:
+            df.to_csv(result_filename)
+
+    if os.path.isfile(result_filename):
+        df = pd.read_csv(result_filename)
+        sns.set()
+        sns.boxplot(x="density", y="time", hue="X", data=df, showfliers=False)
+        handle_fig("sparse")
+
+        #agreement of the sparse and dense triplets
+        if os.path.isfile(triplets_filename):
+            df_triplets = pd.read_csv(triplets_filename)
+            sns.set()
+            sns.barplot(x="configuration", y="difference", hue="quantity",
+                        data=df_triplets)
+            handle_fig("sparse_triplets")
+    else:
+        raise FileNotFoundError
@@ -30,11 +30,12 @@ def streaming_file(recompute = False):
         for m in ms:
             for method in methods:
                 bull = Bullseye.Graph()
-                bull.feed_with(file=csv_filename, k = k, m=m)
+                bull.feed_with(file=csv_filename, k = k, m=m, to_one_hot=True)
                 bull.set_predefined_model("multilogit")
                 bull.set_predefined_prior("normal_iid")
                 bull.init_with(mu_0 = 0, cov_0 = 1)
-                bull.set_options(tf_dataset=(method=="tf"),to_one_hot=True)
+                bull.set_options(tf_dataset=(method=="tf"), readers=4,
+                                 prefetch=2)
                 bull.build()
                 
                 for _ in range(n_loops):
@@ -4,8 +4,17 @@ __init__
 
 from .bullseye_graph import Graph
 from .utils import *
-from .Tests import *
 from .profilers import read_results, trace_results
-#
-from .predefined_functions_aux import *
-from .predefined_functions import *
+
+#the tests and the predefined tensorflow functions import tensorflow : they
+#are only loaded when first used, so that the numpy backend starts without it
+lazy_modules = [".predefined_functions", ".predefined_functions_aux", ".Tests"]
+
+def __getattr__(name):
+    import importlib
+    for module in lazy_modules:
+        module = importlib.import_module(module, __name__)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
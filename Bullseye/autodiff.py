@@ -0,0 +1,144 @@
+"""
+The ``autodiff`` module
+=======================
+
+Contains the automatic hessians used by ``Graph.set_model`` and
+``Graph.set_prior`` when Hψ or Hπ are not given. They are chosen with the
+``compute_hess`` option :
+    -"tf" : ``tf.hessians``, one backward pass per coordinate of θ and per
+     sampled θ,
+    -"pfor" : the rows of the hessians as hessian-vector products Hƒ(θ)•eᵢ,
+     vectorized with ``tf.vectorized_map`` over the coordinates of θ and,
+     for a batched ψ, computed for all the sampled θ's at once,
+    -"hvp" : as "pfor", except that for a batched ψ, β = ∑ⱼ wⱼ·Hψ(θⱼ) is
+     computed directly from hessian-vector products, hvp_block_size
+     coordinates at a time, see ``weighted_hessian`` : the hessian of each θⱼ
+     is never formed.
+"""
+
+from .lazy_import import tf
+
+#values of the compute_hess option relying on automatic differentiation
+autodiff_modes = ["tf", "pfor", "hvp"]
+
+def hessian(mode, f, theta):
+    """
+    Hessian of a function of a single θ.
+
+    Parameters
+    ----------
+    mode : str
+        One of ``autodiff_modes``.
+    f : function
+        ƒ, from tf.tensor [p] to tf.tensor [].
+    theta : tf.tensor [p]
+        θ
+
+    Returns
+    -------
+    tf.tensor [p,p]
+        Hƒ(θ)
+    """
+    if mode == "tf":
+        return tf.hessians(f(theta), theta)[0]
+    #mode in ["pfor", "hvp"]
+    grad = tf.gradients(f(theta), theta)[0]
+    p = theta.get_shape().as_list()[0]
+    return tf.vectorized_map(
+        lambda e : tf.gradients(tf.reduce_sum(grad*e), theta)[0], tf.eye(p))
+
+def batched_hessians(mode, f, thetas):
+    """
+    Hessians of a batched function for each of the sampled θ's, the value of
+    ƒ for one θ not depending on the others.
+
+    Parameters
+    ----------
+    mode : str
+        One of ``autodiff_modes``.
+    f : function
+        ƒ, from tf.tensor [s,p] to tf.tensor [s].
+    thetas : tf.tensor [s,p]
+        The sampled θ's.
+
+    Returns
+    -------
+    tf.tensor [s,p,p]
+        Hƒ(θⱼ) for each θⱼ
+    """
+    if mode == "tf":
+        one = lambda t : tf.hessians(f(tf.expand_dims(t,0))[0], t)[0]
+        return tf.map_fn(one, thetas, dtype=tf.float32)
+    #mode in ["pfor", "hvp"]
+    #grad[j] = ∇ƒ(θⱼ), ∑ⱼ ƒ(θⱼ) being separable           of size [s,p]
+    grad = tf.gradients(tf.reduce_sum(f(thetas)), thetas)[0]
+    #rows[i,j] = Hƒ(θⱼ)•eᵢ                               of size [p,s,p]
+    p = thetas.get_shape().as_list()[1]
+    rows = tf.vectorized_map(
+        lambda e : tf.gradients(tf.reduce_sum(grad*e), thetas)[0], tf.eye(p))
+    return tf.transpose(rows, [1,0,2])
+
+def hessian_vector_products(f, thetas, V, grad = None):
+    """
+    Hessian-vector products of a batched function for each of the sampled
+    θ's, by differentiating ∇ƒ•V : the hessians are not formed.
+
+    Parameters
+    ----------
+    f : function
+        ƒ, from tf.tensor [s,p] to tf.tensor [s].
+    thetas : tf.tensor [s,p]
+        The sampled θ's.
+    V : tf.tensor [s,p]
+        A vector for each θ.
+    grad : tf.tensor [s,p], optional
+        ∇ƒ(θⱼ) for each θⱼ, if already computed from ``thetas``.
+
+    Returns
+    -------
+    tf.tensor [s,p]
+        Hƒ(θⱼ)•Vⱼ for each θⱼ
+    """
+    if grad is None:
+        grad = tf.gradients(tf.reduce_sum(f(thetas)), thetas)[0]
+    return tf.gradients(tf.reduce_sum(grad * tf.stop_gradient(V)),
+                        thetas)[0]
+
+def weighted_hessian(f, thetas, weights, block_size = 16):
+    """
+    ∑ⱼ wⱼ·Hƒ(θⱼ) for a batched function, each row being a sum of
+    hessian-vector products. The coordinates are taken by blocks of
+    ``block_size``, vectorized with ``tf.vectorized_map`` within a block : only
+    [block_size,s,p] tensors are held at once, instead of the [s,p,p]
+    hessians, and the p rows take p/block_size sequential passes.
+
+    Parameters
+    ----------
+    f : function
+        ƒ, from tf.tensor [s,p] to tf.tensor [s].
+    thetas : tf.tensor [s,p]
+        The sampled θ's.
+    weights : tf.tensor [s]
+        The weights wⱼ.
+    block_size : int, optional
+        Number of coordinates whose rows are computed at once.
+
+    Returns
+    -------
+    tf.tensor [p,p]
+        ∑ⱼ wⱼ·Hƒ(θⱼ)
+    """
+    grad = tf.gradients(tf.reduce_sum(f(thetas)), thetas)[0]
+    p = thetas.get_shape().as_list()[1]
+    block_size = min(block_size, p)
+    n_blocks = -(-p // block_size)
+    #row[i] = ∑ⱼ Hƒ(θⱼ)•(wⱼ·eᵢ)
+    row = lambda e : tf.reduce_sum(hessian_vector_products(f, thetas,
+                            tf.einsum('s,p->sp', weights, e), grad = grad),
+                                   axis = 0)
+    #the last block is padded with null vectors       of size [n_blocks,b,p]
+    blocks = tf.reshape(tf.eye(n_blocks*block_size, p),
+                        [n_blocks, block_size, p])
+    rows = tf.map_fn(lambda E : tf.vectorized_map(row, E), blocks,
+                     dtype = tf.float32, parallel_iterations = 1)
+    return tf.reshape(rows, [-1,p])[:p]
@@ -7,21 +7,25 @@ graph with specific options and to launch the Bullseye algorithm.
 See the ``Graph`` class below for more details.
 """
 
-import tensorflow as tf
 import numpy as np
 import pandas as pd
+import scipy.sparse
 import os
 import re
 import time
 import math
 
-from .graph import construct_bullseye_graph
-from .predefined_functions import compute_ps,\
-    predefined_Phis, predefined_Psis,\
-    predefined_Projs, predefined_Pis,\
-    predefined_Predicts
-from tensorflow.initializers import constant as tic
+from .lazy_import import tf
+from .predefined_dimensions import compute_ps
+from .predefined_functions_numpy import numpy_Phis, numpy_Psis,\
+    numpy_Projs, numpy_Pis, numpy_weighted_hess_Psis
 from .profilers import RunSaver
+from .numpy_engine import NumpyEngine
+from .autodiff import autodiff_modes, hessian, batched_hessians
+from .streaming import open_binary_store, ChunkDecoder, Prefetcher,\
+    ChunkIndex, ChunkCache, parallel_map,\
+    libsvm_dimensions, read_libsvm_chunks,\
+    ShardedIndex, list_shards
 from .utils import *
 from .warning_handler import *
 from .visual import *
@@ -81,18 +85,34 @@ class Graph:
             "graph","in_graph",
             #data related
             "d","k","p","X","Y",
-            "file","m","M","to_one_hot",
+            "file","files","m","M","n_chunks","to_one_hot","store","index","chunk_cache",
+            "projection_cache","decoder",
+            "sparse","file_format",
             #init related
             "mu_0","cov_0",
             #φ's, ψ's and projections related
-            "Psi","grad_Psi","hess_Psi",
+            "Psi","grad_Psi","hess_Psi","batched_Psi","weighted_hess_Psi",
             "Phi","grad_Phi","hess_Phi","Proj",
             "use_projs",
+            #functions computed by automatic differentiation, by the name of
+            # the function they differentiate, see ``graph_cache``
+            "derived_functions",
+            #predefined model, resolved at build for the chosen backend
+            "predefined_model",
             #π's related
             "Pi","grad_Pi","hess_Pi",
             "prior_iid",
+            #predefined prior, resolved at build for the chosen backend
+            "predefined_prior",
             #saver related
-            "saver"
+            "saver",
+            #the session owned by the graph, see ``run``
+            "session",
+            #traces of the iterations run inside the graph
+            "loop_traces",
+            #the engine running the iterations when the backend option is
+            # "function" or "numpy"
+            "engine"
             ]
 
         #listing of all option attributes and their default values
@@ -108,6 +128,11 @@ class Graph:
                 "step_size"   : 0.5,
                 #number of sample to approximate expectations
                 "s"                         : 50,
+                #seed of the samples drawn by the backends, the same draws
+                # being made by the "session" and "function" backends. The
+                # "numpy" backend reseeds its generator at each new run.
+                # None for random draws
+                "seed"                      : None,
                 #we have s observations of the activations. make flatten
                 # activations to True in order to flatten the observations
                 # into a large unique observation.
@@ -115,12 +140,52 @@ class Graph:
                 #when computing the local variances, compute the square roots
                 # one by one
                 "local_std_trick"           : True,
+                #when using projections, number of rows of the data (or of
+                # the chunk) whose local parameters, activations, ϕ, ∇ϕ and
+                # Hϕ are held at once : e, ρ and β are accumulated over such
+                # sub-batches. None for all the rows at once
+                "micro_batch_size"          : None,
+                #if micro_batch_size is None, memory budget in megabytes of
+                # these intermediates, from which the number of rows of the
+                # sub-batches is deduced. None for no budget
+                "micro_batch_memory"        : None,
                 #when streaming a file, if chunk_as_sum is true, does not
                 # keep track of the different values of eᵢ,ρᵢ,βᵢ in order
                 # to save space
                 "chunk_as_sum"              : True,
+                #if chunk_as_sum is false, form in which the βᵢ are kept :
+                # "full" [p,p], "packed" upper triangle [p(p+1)/2] or
+                # "low_rank" eigendecomposition truncated to chunk_beta_rank
+                # eigenvalues [p+1,chunk_beta_rank]
+                "chunk_beta_form"           : "full",
+                "chunk_beta_rank"           : 1,
                 #when streaming through a file, use tensorflow dataset class
                 "tf_dataset"                : False,
+                #when streaming through a file, number of chunks decoded in
+                # advance on a worker thread (or by the tensorflow dataset)
+                "prefetch"                  : 0,
+                #when streaming through an indexed file, shards or with the
+                # tensorflow dataset, number of chunks read in parallel. With
+                # shards, also the number of shards indexed in parallel by
+                # ``feed_with``, if set before it
+                "readers"                   : 1,
+                #when streaming through a file, memory budget in megabytes
+                # of the decoded chunks kept from one epoch to another
+                "chunk_cache_size"          : 0,
+                #when streaming through a dense file with pandas, an index or
+                # the binary store and using projections, memory budget in
+                # megabytes of the projections Aᵢ of the chunks kept from one
+                # epoch to another, unused with implicit block projections
+                "projection_cache_size"     : 0,
+                #when streaming through a file with M smaller than the number
+                # of chunks, draw M random chunks at each iteration and rescale
+                # e, ρ and β accordingly. Iterations are then always accepted.
+                # Requires a chunk index, shards or the binary store, so that
+                # only the drawn chunks are read
+                "stochastic_chunks"         : False,
+                #in stochastic mode, the step size of iteration t is
+                # speed·(t+1)^(-step_size_decay)
+                "step_size_decay"           : 0.75,
                 #include timeliner in saved informations
                 "timeliner"                 : False,
                 #include tf profiler in saved informations,
@@ -135,10 +200,34 @@ class Graph:
                 "compute_gamma"             : False,
                 #autograd
                 "compute_grad"              : "tf",
-                #autohess
+                #autohess : "tf", "pfor" or "hvp" to differentiate ψ or π
+                # twice when their hessian is not given, see ``autodiff``,
+                # "grad" or "act" to approximate it
                 "compute_hess"              : "tf",
+                #with "hvp", number of coordinates of θ whose rows of
+                # ∑ⱼ wⱼ·Hψ(θⱼ) are computed at once
+                "hvp_block_size"            : 16,
                 #diag_cov
-                "diag_cov"                  : False
+                "diag_cov"                  : False,
+                #execution backend : "session" for the tensorflow graph run
+                # in a tf.Session, "function" for tf.Variable's and a
+                # tf.function, requiring eager execution (tensorflow 2) and
+                # data kept in memory, "numpy" for numpy and scipy only,
+                # without importing tensorflow, requiring data kept in memory
+                # and predefined model and prior
+                "backend"                   : "session",
+                #compile the candidate update and the triplets with XLA,
+                # the unsupported operations running as usual
+                "jit"                       : False,
+                #with data kept in memory, run all the iterations inside a
+                # tf.while_loop, in a single session run
+                "in_graph_loop"             : False,
+                #with in_graph_loop, also trace μ after each iteration
+                "trace_mu"                  : False,
+                #directory in which the built graphs are kept, so that an
+                # identical configuration is loaded instead of being built
+                # again, None to always build
+                "graph_cache"               : None
                 }
 
         #keep in mind the name of those options
@@ -149,6 +238,7 @@ class Graph:
             setattr(self, key, None)
         for key in self.option_list:
             setattr(self, key, options[key])
+        self.derived_functions = {}
 
         #attributes that ensure the correct construction of the graph
         self.feed_with_is_called = False
@@ -158,24 +248,38 @@ class Graph:
         self.build_is_called = False
 
     def feed_with(self, X = None, Y = None, d = None, k = None,
-        file = None, m = None, M = None, to_one_hot = False):
+        file = None, m = None, M = None, to_one_hot = False, cache = None,
+        index = False, file_format = "csv", files = None):
         """
         Feed the graph with data. There are multiple ways of doing so.
 
         Method 1: requires X and Y
-            Feed with a design matrix X and a response matrix Y.
+            Feed with a design matrix X and a response matrix Y. X may be a
+            scipy sparse matrix, in which case the graph works with sparse
+            tensors.
         Method 2: requires d and k
             In the case X and Y are not defined yet, you only need to specify
             there sizes with d and k. In this case, X and Y need to be specified
             when ``run`` is called.
         Method 3: requires file, chunksize and k
-            To stream a file.
+            To stream a file. If ``cache`` is set to "binary", the file is
+            converted once into a memory-mapped float32 store (see the
+            ``streaming`` module) from which the chunks are then served. If
+            ``index`` is set to True, the metadata of the file and the offsets
+            of its chunks are saved in a sidecar file, so that they are known
+            without reading the file again and chunks can be read directly.
+            Sparse files in the libsvm format are streamed setting
+            ``file_format`` to "libsvm".
+        Method 4: requires files and k
+            To stream a dataset split into several .csv files sharing the same
+            columns. Each shard is indexed once, as with ``index``, and the
+            chunks of all shards form a single dataset.
 
         →
 
         Parameters
         ----------
-        X : np.array [None,d]
+        X : np.array or scipy.sparse matrix [None,d]
             Design matrix.
         Y : np.array [None, k]
             Response matrix.
@@ -189,9 +293,20 @@ class Graph:
             Chunksize
         number_of_chunk_max : int
             Number of chunk to consider per iterations.
+        cache : str, optional
+            If "binary", stream the file from its binary chunk store instead
+            of parsing it at each epoch.
+        index : bool, optional
+            If True, use (and create if needed) the chunk index of the file.
+        file_format : str, optional
+            "csv" or "libsvm". In the libsvm format, feature indices start at
+            1, and d is deduced from the file if it is not given.
+        files : list of str, or str
+            Paths of the shards, or a glob pattern matching them.
         """
         
         self.to_one_hot = to_one_hot
+        self.sparse = False
         
         #method 1
         if X is not None or Y is not None:
@@ -201,7 +316,10 @@ class Graph:
             assert len(X.shape) in [1,2]
             assert len(Y.shape) in [1,2]
 
-            if len(X.shape)==1:
+            if scipy.sparse.issparse(X):
+                X = X.tocsr().astype(np.float32)
+                self.sparse = True
+            elif len(X.shape)==1:
                 X = np.expand_dims(X,1)
             if len(Y.shape)==1:
                 Y = np.expand_dims(Y,1)
@@ -213,7 +331,7 @@ class Graph:
             self.m = None
 
         #method 2
-        elif file is None:
+        elif file is None and files is None:
             assert d is not None
             assert k is not None
             assert type(d), type(k) == [int,int]
@@ -222,30 +340,72 @@ class Graph:
             self.k = k
             self.m = None
 
-        #method 3
+        #method 3 and 4
         else:
+            #with shards, ``file`` is the first shard
+            if files is not None:
+                files = list_shards(files)
+                file = files[0]
+                assert cache is None and file_format == "csv"
+            else:
+                files = [file]
+
             assert os.path.isfile(file)
             assert k is not None
             assert type(k) == int
 
+            assert cache in [None, "binary"]
+            assert file_format in ["csv", "libsvm"]
+
             #retrieve the parameters
             self.k = k
             self.file = file
+            self.files = files
+            self.file_format = file_format
+
+            self.store = None
+            self.index = None
+            self.chunk_cache = None
+            self.projection_cache = None
+
+            #libsvm : sparse rows, d is the largest feature index
+            if file_format == "libsvm":
+                assert cache is None and not index
+                self.sparse = True
+                n, d_ = libsvm_dimensions(file)
+                self.d = d if d is not None else d_
+
+            #binary cache : d and n are read from the header of the store
+            elif cache == "binary":
+                self.store = open_binary_store(file, k, to_one_hot)
+                self.d = self.store.d
+                n = self.store.n
+
+            #chunk index : d and n are read from the index
+            elif index or len(files)>1:
+                if len(files)>1:
+                    self.index = ShardedIndex(files, m, workers = self.readers)
+                else:
+                    self.index = ChunkIndex(file, m)
+                n_columns = self.index.n_columns
+                self.d = n_columns-1 if to_one_hot else n_columns-k
+                n = self.index.n
 
-            #deduce d
-            #→ not a perfect method to assert d
-            reader = pd.read_table(file, sep=",", chunksize = 1)
-            for chunk in reader:
-                data = list(chunk.shape)
-                break
-            if to_one_hot:
-                self.d = data[-1]-1
             else:
-                self.d = data[-1]-k
+                #deduce d
+                #→ not a perfect method to assert d
+                reader = pd.read_table(file, sep=",", chunksize = 1)
+                for chunk in reader:
+                    data = list(chunk.shape)
+                    break
+                if to_one_hot:
+                    self.d = data[-1]-1
+                else:
+                    self.d = data[-1]-k
 
-            #deduce n
-            #→ not a perfect method to assert n
-            n = sum(1 for line in open(file))
+                #deduce n
+                #→ not a perfect method to assert n
+                n = sum(1 for line in open(file))
 
             if m is not None:
                 assert type(m)==int
@@ -253,11 +413,23 @@ class Graph:
             else:
                 self.m = n
 
+            if self.index is not None:
+                self.index.prepare(self.m)
+
+            #deduce the number of chunks
+            if self.index is not None:
+                self.n_chunks = self.index.number_of_chunks(self.m)
+            elif self.store is not None or file_format == "libsvm":
+                self.n_chunks = math.ceil(n/self.m)
+            else:
+                #the first line is read as a header
+                self.n_chunks = math.ceil(max(n-1,1)/self.m)
+
             #deduce number_of_chunk_max
             if M is not None:
                 self.M = M
             else:
-                self.M = math.ceil(n/self.m)
+                self.M = self.n_chunks
 
         #remember this method is called to ensure consistency and prevent errors
         self.feed_with_is_called = True
@@ -277,6 +449,9 @@ class Graph:
         Method 2: use_projection is set to False
             Then the implicit computations will be using projections, and you
             can specify ``phi_option`` and ``proj_option``.
+        The functions themselves are chosen when the graph is built, among
+        the tensorflow ones or, with the numpy backend, the numpy ones of
+        the ``predefined_functions_numpy`` module.
 
         Parameters
         ----------
@@ -287,18 +462,51 @@ class Graph:
         proj_option : str, optional
             proj_option, e.g. "mapfn", see ``predefined_functions`` module.
         psi_option : str, optional
-            psi_option, e.g. "std", see ``predefined_functions`` module.
+            psi_option, e.g. "mapfn" to evaluate ψ one θ at a time instead
+            of all at once, see ``predefined_functions`` module.
         use_projections : bool, optional
             Assert whether we should use projections to simplify θ locally or
             not.
         """
         assert self.feed_with_is_called
-        
+
         #keep that in mind
         self.use_projs = use_projections
 
         #compute p
-        p = compute_ps[model](self.d, self.k, **specific_parameters)
+        self.p = compute_ps[model](self.d, self.k, **specific_parameters)
+        self.predefined_model = [model, phi_option, proj_option, psi_option,
+                                 specific_parameters]
+
+        #remember this method is called, to prevent errors
+        self.set_model_is_called = True
+
+    def __set_predefined_model(self):
+        """
+        Set the functions of the model given to ``set_predefined_model``,
+        for the chosen backend.
+        """
+        model, phi_option, proj_option, psi_option, specific_parameters = \
+            self.predefined_model
+        use_projections = self.use_projs
+        p = self.p
+        if self.backend == "numpy":
+            #the numpy functions have no options
+            options = {"phi_option" : phi_option, "proj_option" : proj_option,
+                       "psi_option" : psi_option}
+            for (name, option) in options.items():
+                if option is not None:
+                    warn_useless_parameter(name, 'backend = "numpy"',
+                                           "Graph.set_predefined_model()")
+            phi_option, proj_option, psi_option = None, None, None
+            predefined_Phis, predefined_Psis, predefined_Projs = \
+                numpy_Phis, numpy_Psis, numpy_Projs
+            predefined_weighted_hess_Psis = numpy_weighted_hess_Psis
+        else:
+            from .predefined_functions import predefined_Phis,\
+                predefined_Psis, predefined_Projs,\
+                predefined_weighted_hess_Psis
+
         #method 1
         if use_projections:
             #basic suffix specifying the model
@@ -346,7 +554,7 @@ class Graph:
                 suffix_psi += "_"+psi_option
 
             #get the Psis
-            Psi_, grad_Psi_, hess_Psi_ = \
+            Psi_, grad_Psi_, hess_Psi_, batched_Psi = \
                 predefined_Psis[suffix_psi]
 
             #be sure that the Psi function is not None
@@ -364,14 +572,27 @@ class Graph:
             if hess_Psi_ is not None:
                 hess_Psi = lambda X,Y,theta : \
                         hess_Psi_(X,Y,theta,**specific_parameters)
+            #∑ⱼ wⱼ·Hψ(θⱼ) directly, when available
+            weighted_hess_Psi = None
+            weighted_hess_Psi_ = predefined_weighted_hess_Psis.get(suffix_psi)
+            if weighted_hess_Psi_ is not None:
+                weighted_hess_Psi = lambda X,Y,thetas,weights : \
+                    weighted_hess_Psi_(X,Y,thetas,weights,
+                                       **specific_parameters)
             #use other method
-            self.set_model(Psi=Psi, grad_Psi=grad_Psi, hess_Psi=hess_Psi, p=p)
+            self.set_model(Psi=Psi, grad_Psi=grad_Psi, hess_Psi=hess_Psi, p=p,
+                           batched_Psi=batched_Psi,
+                           weighted_hess_Psi=weighted_hess_Psi)
+
+        #``set_model`` forgets the predefined model, see below
+        self.predefined_model = [model, phi_option, proj_option, psi_option,
+                                 specific_parameters]
 
     def set_model(self,
         Psi = None, grad_Psi = None, hess_Psi = None,
         Phi = None, grad_Phi = None, hess_Phi = None, Proj = None,
         prior_std = 1,
-        p = None):
+        p = None, batched_Psi = False, weighted_hess_Psi = None):
         """
         Specify to the graph a given model.
         There are multiple ways of doing so.
@@ -380,7 +601,15 @@ class Graph:
             Manually choose the function ψ. You can also specify ∇ψ and Hψ,
             if not, ∇ψ and Hψ will be automatically computed using tf methods.
             The given functions take as parameters an a design matrix X, a
-            response matrix Y, and the parameter θ.
+            response matrix Y, and the parameter θ. If ``batched_Psi`` is set,
+            they take instead all the sampled θ's at once, thetas of size
+            [s,p], and return ψ, ∇ψ and Hψ for each of them, of size [s], [s,p]
+            and [s,p,p], so that they are evaluated in a single pass.
+            A batched ψ may also come with ``weighted_hess_Psi``, taking
+            thetas and their weights w of size [s] and computing directly
+            ∑ⱼ wⱼ·Hψ(θⱼ) of size [p,p], e.g. as a sum of Kronecker products
+            for softmax-type models : Hψ(θ) is then never computed for each
+            θ, dividing the memory needed for β by s.
         Method 2: requires Phi, Proj and p
             Manually choose the function φ. You can also specify ∇φ and Hφ,
             if not, ∇φ and Hφ will be automatically computed using tf methods.
@@ -393,6 +622,8 @@ class Graph:
         
         #set p
         self.p = p
+        #the given functions replace the predefined ones
+        self.predefined_model = None
 
         #method 1
         if Psi is not None:
@@ -400,17 +631,30 @@ class Graph:
             assert Psi is not None
             #ψ
             self.Psi = Psi
+            self.batched_Psi = batched_Psi
+            self.weighted_hess_Psi = weighted_hess_Psi
+            assert weighted_hess_Psi is None or batched_Psi
             #∇ψ
             self.grad_Psi = grad_Psi
+            self.derived_functions.pop("grad_Psi", None)
             if grad_Psi is None and self.compute_grad=="tf":
                 self.grad_Psi = lambda X,Y,theta : \
                     tf.gradients(self.Psi(X,Y,theta),theta)[0]
+                self.derived_functions["grad_Psi"] = "Psi"
             #Hψ
             self.hess_Psi = hess_Psi
-            if hess_Psi is None and self.compute_hess=="tf":
-                #self.hess_Psi = lambda A:tf.gradients(grad_Psi(A[0],A[1],A[2]),A[2])[0]
-                self.hess_Psi = lambda X,Y,theta : \
-                    tf.hessians(self.Psi(X,Y,theta),theta)[0]
+            self.derived_functions.pop("hess_Psi", None)
+            if hess_Psi is None and self.compute_hess in autodiff_modes:
+                self.derived_functions["hess_Psi"] = "Psi"
+                #the mode is read when the graph is built, see ``autodiff``
+                if not batched_Psi:
+                    self.hess_Psi = lambda X,Y,theta : \
+                        hessian(self.compute_hess,
+                                lambda t : self.Psi(X,Y,t), theta)
+                else:
+                    self.hess_Psi = lambda X,Y,thetas : \
+                        batched_hessians(self.compute_hess,
+                                         lambda t : self.Psi(X,Y,t), thetas)
         #method 2
         else:
             self.use_projs = True
@@ -420,8 +664,10 @@ class Graph:
             self.Phi = Phi
             #∇ϕ
             self.grad_Phi = grad_Phi
+            self.derived_functions.pop("grad_Phi", None)
             if grad_Phi is None and self.compute_grad=="tf":
                 self.grad_Phi = lambda A, Y:tf.gradients(self.Phi(A,Y),A)[0]
+                self.derived_functions["grad_Phi"] = "Phi"
             #Hϕ
             #impossible to use tf hessians
             self.hess_Phi = hess_Phi
@@ -449,7 +695,27 @@ class Graph:
     def set_predefined_prior(self, prior, **specific_parameters):
         """
         →
+        The functions are chosen when the graph is built, see
+        ``set_predefined_model``.
+        """
+        #both modules define the same priors
+        self.prior_iid = numpy_Pis[prior][3]
+        self.predefined_prior = [prior, specific_parameters]
+
+        #remember this method is called, to prevent errors
+        self.set_prior_is_called = True
+
+    def __set_predefined_prior(self):
         """
+        Set the functions of the prior given to ``set_predefined_prior``,
+        for the chosen backend.
+        """
+        prior, specific_parameters = self.predefined_prior
+        if self.backend == "numpy":
+            predefined_Pis = numpy_Pis
+        else:
+            from .predefined_functions import predefined_Pis
+
         #get the π's
         Pi_, grad_Pi_, hess_Pi_, iid = \
             predefined_Pis[prior]
@@ -469,23 +735,32 @@ class Graph:
             hess_Pi = lambda theta : \
                     hess_Pi_(theta,**specific_parameters)
         
-        #use other method
+        #use other method, keeping the iid parameter, see ``set_options``
+        iid = self.prior_iid
         self.set_prior(Pi=Pi, grad_Pi=grad_Pi, hess_Pi=hess_Pi, iid = iid)
+        self.predefined_prior = [prior, specific_parameters]
 
     def set_prior(self,Pi, grad_Pi = None, hess_Pi = None, iid = False):
         """
         →
         """
+        #the given functions replace the predefined ones
+        self.predefined_prior = None
         #π
         self.Pi = Pi
         #∇π
         self.grad_Pi = grad_Pi
+        self.derived_functions.pop("grad_Pi", None)
         if grad_Pi is None and self.compute_grad=="tf":
             self.grad_Pi = lambda theta:tf.gradients(Pi(theta),theta)[0]
+            self.derived_functions["grad_Pi"] = "Pi"
         #Hπ
         self.hess_Pi = hess_Pi
-        if hess_Pi is None and self.compute_grad=="tf":
-            self.hess_Pi = lambda theta:tf.hessians(Pi(theta),theta)[0]
+        self.derived_functions.pop("hess_Pi", None)
+        if hess_Pi is None and self.compute_hess in autodiff_modes:
+            self.hess_Pi = lambda theta : \
+                hessian(self.compute_hess, Pi, theta)
+            self.derived_functions["hess_Pi"] = "Pi"
     
         #iid parameter
         self.prior_iid = iid
@@ -555,6 +830,11 @@ class Graph:
             if self.prior_iid == False:
                 #say to the user
                 self.prior_iid = True
+            #only the diagonals of the βᵢ are kept
+            if self.chunk_beta_form != "full" and ("chunk_beta_form" in kwargs
+                                                   or "diag_cov" in kwargs):
+                warn_useless_parameter("chunk_beta_form", "diag_cov",
+                                       "Bullseye_graph.set_options()")
 
     def build(self):
         """
@@ -568,18 +848,71 @@ class Graph:
         assert self.feed_with_is_called and self.set_model_is_called \
             and self.init_with_is_called and self.set_prior_is_called
 
-        #construct the graph
-        self.graph, self.in_graph = construct_bullseye_graph(self)
+        #the predefined functions depend on the backend
+        if self.predefined_model is not None:
+            self.__set_predefined_model()
+        if self.predefined_prior is not None:
+            self.__set_predefined_prior()
+
+        #random chunks cannot be drawn from a tensorflow dataset, and are
+        #only read directly with an index or the binary store, pandas having
+        #to parse the file up to the last drawn chunk
+        if self.stochastic_chunks:
+            assert not uses_tf_dataset(self)
+            assert self.file is None or self.index is not None\
+                or self.store is not None
+
+        #the session of a previous build is no longer valid
+        self.close()
+
+        #tf.function and numpy backends : no graph to build
+        if self.backend in ["function", "numpy"]:
+            assert not self.in_graph_loop
+            #the data must be kept in memory
+            if self.file is not None:
+                err_unsupported_backend(self.backend, "streamed and chunked "
+                                        "files are not supported, give X "
+                                        "and Y to feed_with or run instead")
+            if self.backend == "function":
+                from .function_backend import FunctionBackend
+                self.engine = FunctionBackend(self)
+            else:
+                self.engine = NumpyEngine(self)
+            self.graph, self.in_graph = None, None
+            self.build_is_called = True
+            return
+        self.engine = None
+
+        from .graph import construct_bullseye_graph
+        from .graph_cache import graph_signature, save_graph, load_graph
+
+        #load the graph if an identical one has already been built,
+        #construct it otherwise
+        loaded = None
+        if self.graph_cache is not None:
+            path = os.path.join(self.graph_cache, graph_signature(self))
+            loaded = load_graph(path)
+        if loaded is not None:
+            self.graph, self.in_graph = loaded
+            print("Graph loaded from {}.".format(path))
+        else:
+            self.graph, self.in_graph = construct_bullseye_graph(self)
+            if self.graph_cache is not None:
+                save_graph(path, self.graph, self.in_graph)
 
         #remember this method is called, to prevent errors
         self.build_is_called = True
 
     def run(self, n_iter = 10, run_id = None, X = None, Y = None,
-        debug_array = None):
+        debug_array = None, resume = False):
         """
         →debug
         Run the implicit tensorflow graph.
 
+        The session is owned by the graph : it is created and initialized at
+        the first run after ``build``, then kept open until ``close`` is
+        called or the graph is built again.
+
         Parameters
         ----------
         n_iter : int, optional
@@ -591,6 +924,9 @@ class Graph:
             Allows the end user to specify a X if it hasn't been yet
         Y : np.array [None, k], optional
             Allows the end user to specify a Y if it hasn't been yet
+        resume : bool, optional
+            If True, continue from the μ, Σ, β, ρ, ELBO and step size reached
+            by the previous run instead of starting again from μ₀ and Σ₀.
 
         Returns
         ------
@@ -600,10 +936,16 @@ class Graph:
 
         #to prevent errors, ensures the graph is already built
         assert self.build_is_called
+        #in-memory data given in argument is set at initialization
+        if resume and self.session is not None:
+            assert X is None or self.X is None
 
         #easy access to the tensorflow graph operations
         ops = self.in_graph
 
+        if self.engine is not None:
+            return self.__run_engine(n_iter, run_id, resume, X, Y)
+
         #handle run_id
         if run_id is None:
             run_id = time.strftime("%Y_%m_%d_%H_%M_%S", time.gmtime())
@@ -613,6 +955,8 @@ class Graph:
 
         #feeding dict that will be used
         d_computed = {}
+        #feeding dict of the initialization
+        d_init = self.__init_feed_dict(self.X, self.Y)
         #other run arguments
         run_kwargs = {}
 
@@ -621,66 +965,109 @@ class Graph:
             #note that e,rho and beta will in this case be computed directly
             #without changing parameters
             if X is not None and Y is not None:
-                d_computed['X:0'] = X
-                d_computed['Y:0'] = Y
+                #in-memory data, and the projections computed from it, are
+                #set at initialization
+                if self.X is not None:
+                    assert X.shape == self.X.shape and Y.shape == self.Y.shape
+                    d_init = self.__init_feed_dict(X, Y)
+                else:
+                    d_computed = self.__feed_dict(X, Y)
             else:
                 assert self.X is not None
                 assert self.Y is not None
 
+        #float32 buffers in which the chunks are decoded, enough of them for
+        #the prefetched chunks, the chunks read in parallel and the chunk
+        #being processed, see ``ChunkDecoder.live_chunks``
+        if self.file is not None:
+            self.decoder = ChunkDecoder(self.m, self.d, self.k,
+                                        self.to_one_hot, self.prefetch,
+                                        self.readers)
+
+        #decoded chunks are kept across epochs and runs
+        if self.file is not None and self.chunk_cache_size > 0:
+            budget = int(self.chunk_cache_size * 2**20)
+            if self.chunk_cache is None:
+                self.chunk_cache = ChunkCache(budget)
+            else:
+                self.chunk_cache.set_budget(budget)
+
+        #projections of the chunks are kept across epochs and runs
+        if self.file is not None and self.projection_cache_size > 0\
+                and self.use_projs and not self.sparse\
+                and self.in_graph["A_array"] is not None\
+                and not uses_tf_dataset(self):
+            budget = int(self.projection_cache_size * 2**20)
+            if self.projection_cache is None:
+                self.projection_cache = ChunkCache(budget)
+            else:
+                self.projection_cache.set_budget(budget)
+
         #for saving
         self.saver = RunSaver(self, run_id, run_kwargs, self.timeliner,
                         self.profiler, self.keep_track)
 
         print_title('beginning run "{}"'.format(run_id))
 
-        #start the session
-        with tf.Session(graph = self.graph) as sess:
-            #initialize the graph
-            sess.run(ops["init"],**run_kwargs)
-            #starting iterations
-            for epoch in range(n_iter):
-                print_subtitle("epoch number {}".format(epoch))
-                #---->start epoch
-                self.saver.start_epoch()
-                
-                #update new_mu, new_cov and optionaly more
-                self.__run(sess, ops["update_new_parameters"],
-                                    **run_kwargs)
-
-                if self.file is not None:
-                    #read chunks, and update partial es, rhos and betas
-                    # in consequence
-                    self.__set_partials_from_chunks(sess, run_kwargs=run_kwargs)
-                #debug array-----
-                if debug_array is not None:
-                    ans = self.__run(sess,[ops[op] for op in debug_array],
+        #start the session, or reuse the one of the previous run
+        initialize = self.session is None or not resume
+        if self.session is None:
+            self.session = tf.Session(graph = self.graph,
+                                      config = session_config(self))
+        sess = self.session
+        #initialize the graph
+        if initialize:
+            sess.run(ops["init"], feed_dict = d_init, **run_kwargs)
+        #all iterations at once
+        if self.in_graph_loop:
+            self.__run_loop(sess, n_iter, d_computed, run_kwargs)
+        #starting iterations
+        for epoch in range(0 if self.in_graph_loop else n_iter):
+            print_subtitle("epoch number {}".format(epoch))
+            #---->start epoch
+            self.saver.start_epoch()
+
+            #without chunks, the whole epoch is done in a single run, μ and Σ
+            #being fetched along if they are tracked
+            if self.file is None and debug_array is None:
+                fetches = ops["epoch"] if self.saver.keep_track\
+                            else ops["iteration"]
+                results = self.__run(sess, fetches, feed_dict = d_computed,
                                      **run_kwargs)
-                    for idx,an in enumerate(ans):
-                        print(debug_array[idx])
-                        print(an)
-                #----------------
-                #compute new elbo
-                statu, elbo, best_elbo = \
-                    self.__run(sess, ops["iteration"],
-                                        feed_dict = d_computed, **run_kwargs)
-                statu = statu.decode('utf-8')
-                #---->finish epoch
-                self.saver.finish_epoch(statu, elbo, best_elbo)
-                if self.saver.keep_track:
-                    mu, cov = sess.run([ops["mu"], ops["cov"]])
-                    self.saver.save_step(mu,cov,epoch)
-
-                b = bcolors.OKGREEN if statu=="accepted" else bcolors.FAIL
-                print('{b}{statu}{e}, with {elbo}'.format(statu = statu, elbo = elbo,
-                                                          e = bcolors.ENDC,
-                                                          b = b))
-
-            #get the lasts mu, cov, elbo
-            final_mu, final_cov, final_elbo = \
-                sess.run([ops["mu"], ops["cov"], ops["ELBO"]])
-
-            #save
-            self.saver.save_final_results(mu=final_mu, cov=final_cov)
+                self.__finish_epoch(epoch, *results)
+                continue
+
+            #update new_mu, new_cov and optionaly more
+            self.__run(sess, ops["update_new_parameters"],
+                                **run_kwargs)
+
+            d_iteration = d_computed
+            if self.file is not None:
+                #read chunks, and update partial es, rhos and betas
+                # in consequence
+                chunk_scale = self.__set_partials_from_chunks(sess,
+                                                      run_kwargs=run_kwargs)
+                d_iteration = {**d_computed, "chunk_scale:0" : chunk_scale}
+            #debug array-----
+            if debug_array is not None:
+                ans = self.__run(sess,[ops[op] for op in debug_array],
+                                 **run_kwargs)
+                for idx,an in enumerate(ans):
+                    print(debug_array[idx])
+                    print(an)
+            #----------------
+            #compute new elbo
+            statu, elbo, best_elbo = \
+                self.__run(sess, ops["iteration"],
+                                    feed_dict = d_iteration, **run_kwargs)
+            self.__finish_epoch(epoch, statu, elbo, best_elbo)
+
+        #get the lasts mu, cov, elbo
+        final_mu, final_cov, final_elbo = \
+            sess.run([ops["mu"], ops["cov"], ops["ELBO"]])
+
+        #save
+        self.saver.save_final_results(mu=final_mu, cov=final_cov)
 
         print_end("end of the run")
 
@@ -688,14 +1075,31 @@ class Graph:
         r =  {'mu':final_mu, 'cov':final_cov,'elbo':final_elbo}
         #add to the dictionnary what is saved by the saver
         r.update(self.saver.final_stats())
+        if self.chunk_cache is not None:
+            r.update({'cache_hits' : self.chunk_cache.hits,
+                      'cache_misses' : self.chunk_cache.misses})
+        if self.in_graph_loop:
+            r.update(self.loop_traces)
         return r
 
+    def close(self):
+        """
+        Close the session owned by the graph, if any. The next run starts
+        from μ₀ and Σ₀ again.
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
     def predict(self, X_test, mu, k, model = None, Predict = None,
                   **specific_parameters):
         """
         →
         """
         
+        from .predefined_functions import predefined_Predicts
+        tic = tf.constant_initializer
+
         if Predict is None:
             assert model is not None
             Predict_ = predefined_Predicts[model]
@@ -717,6 +1121,95 @@ class Graph:
         return T
             
 
+    def __run_engine(self, n_iter, run_id, resume, X = None, Y = None):
+        """
+        Equivalent of ``run`` with the tf.function and numpy backends.
+        """
+        backend = self.engine
+
+        #as with the session, data given in argument is used for this run,
+        #the data given to ``feed_with`` otherwise
+        if X is not None and Y is not None:
+            assert X.shape[-1] == self.d and Y.shape[0] == X.shape[0]
+            backend.set_data(X, Y)
+        elif self.X is not None:
+            if backend.data is None or backend.data[0] is not self.X:
+                backend.set_data(self.X, self.Y)
+        else:
+            err_unsupported_backend(self.backend, "X and Y must be given to "
+                                    "feed_with or run")
+
+        if run_id is None:
+            run_id = time.strftime("%Y_%m_%d_%H_%M_%S", time.gmtime())
+        elif not re.match("^[\\w ]+$", run_id):
+            err_bad_name(run_id)
+
+        self.saver = RunSaver(self, run_id, {}, False, False, self.keep_track)
+        print_title('beginning run "{}"'.format(run_id))
+
+        if not resume:
+            backend.initialize()
+        for epoch in range(n_iter):
+            print_subtitle("epoch number {}".format(epoch))
+            self.saver.start_epoch()
+            statu, elbo, best_elbo = backend.iteration()
+            if self.backend == "function":
+                statu, elbo, best_elbo = [t.numpy()
+                                          for t in (statu, elbo, best_elbo)]
+            mu, cov = backend.values("mu", "cov")
+            self.__finish_epoch(epoch, statu, elbo, best_elbo, mu, cov)
+
+        final_mu, final_cov, final_elbo = backend.values("mu", "cov", "elbo")
+        self.saver.save_final_results(mu=final_mu, cov=final_cov)
+        print_end("end of the run")
+
+        r =  {'mu':final_mu, 'cov':final_cov,'elbo':final_elbo}
+        r.update(self.saver.final_stats())
+        return r
+
+    def __run_loop(self, sess, n_iter, feed_dict, run_kwargs):
+        """
+        Run the n_iter iterations inside the tf.while_loop of the graph, and
+        keep their traces in ``loop_traces``.
+        """
+        self.saver.start_epoch()
+        traces = self.__run(sess, self.in_graph["loop"],
+                            feed_dict = {**feed_dict, "n_iter:0" : n_iter},
+                            **run_kwargs)
+        elbos, best_elbos, accepted, step_sizes = traces[:4]
+        status = ["accepted" if a else "refused" for a in accepted]
+        self.saver.finish_loop(status, elbos, best_elbos)
+        self.loop_traces = {'step_sizes' : step_sizes}
+        if self.trace_mu:
+            self.loop_traces['mus'] = traces[4]
+        print("{n} iterations, {a} accepted, with {elbo}".format(n = n_iter,
+                            a = sum(accepted), elbo = best_elbos[-1]
+                                                if n_iter>0 else None))
+
+    def __finish_epoch(self, epoch, statu, elbo, best_elbo, mu = None,
+                       cov = None):
+        """
+        Report the end of an epoch to the saver and the user. μ and Σ are read
+        from the session if they are not given.
+        """
+        if isinstance(statu, bytes):
+            statu = statu.decode('utf-8')
+        if self.chunk_cache is not None:
+            print("Chunk cache : {h} hits, {m} misses.".format(
+                h = self.chunk_cache.hits, m = self.chunk_cache.misses))
+        #---->finish epoch
+        self.saver.finish_epoch(statu, elbo, best_elbo)
+        if self.saver.keep_track:
+            if mu is None:
+                mu, cov = self.session.run([self.in_graph["mu"],
+                                            self.in_graph["cov"]])
+            self.saver.save_step(mu,cov,epoch)
+
+        b = bcolors.OKGREEN if statu=="accepted" else bcolors.FAIL
+        print('{b}{statu}{e}, with {elbo}'.format(statu = statu, elbo = elbo,
+                                                  e = bcolors.ENDC,
+                                                  b = b))
+
     def __run(self, sess, ops_to_compute, feed_dict={}, **run_kwargs):
         """
         This private method can be seen as an overload of the tensorflow.Session
@@ -758,47 +1251,207 @@ class Graph:
             The current tensorflow session.
         **run_kwargs :
             Additional arguments that will be added to ``sess.run()``
+
+        Returns
+        -------
+        float
+            The scale of the sum of the chunks : n_chunks over the number of
+            chunks actually read in stochastic mode, 1 otherwise.
         """
 
         #for simplicity
         ops = self.in_graph
+        n_read = 0
         #initialize global e, rho and beta
         self.__run(sess,ops["init_chunks"],**run_kwargs)
         
+        #stream the file with pandas or with the binary store
+        if not self.tf_dataset or self.store is not None:
+            self.decoder.reset()
+            chunks = self.__read_chunks()
+            #decode the next chunks while the current one is processed
+            if self.prefetch > 0:
+                chunks = Prefetcher(chunks, self.prefetch)
+
+            for (slot, (i, X, Y)) in enumerate(chunks):
+                #create the feeding dict
+                d_ = self.__feed_dict(X, Y)
+                #update the global parameters
+                self.__run_partials_update(sess, i, slot, run_kwargs=run_kwargs,
+                                           dict=d_)
+                #the buffer of the chunk can be reused
+                self.decoder.release(X)
+                n_read += 1
+
+        #else, create a tf.dataset reader to stream the file
+        else:
+            for i in range(self.M):
+                #the shards may give less than M batches
+                try:
+                    self.__run_partials_update(sess, i, i, run_kwargs=run_kwargs)
+                except tf.errors.OutOfRangeError:
+                    break
+                n_read += 1
+
+        #the drawn chunks beyond the end of the file are not read, and
+        #n_chunks may have been updated along
+        if self.stochastic_chunks and n_read > 0:
+            return self.n_chunks / n_read
+        return 1.
+
+    def __init_feed_dict(self, X, Y):
+        """
+        Create the dictionnary feeding the in-memory X and Y to the
+        initializers of their variables.
+        """
+        if self.X is None or self.m is not None:
+            return {}
+        if self.sparse:
+            X = to_sparse_value(scipy.sparse.csr_matrix(X, dtype = np.float32))
+            return {"X_indices_init:0" : X.indices,
+                    "X_values_init:0" : X.values,
+                    "Y_init:0" : Y}
+        return {"X_init:0" : X, "Y_init:0" : Y}
+
+    def __feed_dict(self, X, Y):
+        """
+        Create the dictionnary feeding X and Y to the placeholders, X being
+        converted to a tf.SparseTensorValue when working with sparse data.
+        """
+        if self.sparse:
+            return {self.in_graph["X"] : to_sparse_value(X), "Y:0" : Y}
+        return {"X:0" : X, "Y:0" : Y}
+
+    def __chunk_numbers(self):
+        """
+        Numbers of the chunks to go through during an epoch : the M first
+        chunks, or M chunks drawn at random in stochastic mode.
+        """
+        if self.stochastic_chunks and self.M < self.n_chunks:
+            drawn = np.random.choice(self.n_chunks, self.M, replace = False)
+            return sorted(drawn.tolist())
+        return list(range(self.M))
+
+    def __read_chunks(self):
+        """
+        Generator reading the chunks of the current epoch, see
+        ``__chunk_numbers``. If a chunk cache is used, cached chunks are served
+        from memory and the others are read then cached.
+
+        Yields
+        ------
+        i : int
+            Chunk number.
+        X : np.array [m,d]
+            Design matrix of the chunk.
+        Y : np.array [m,k]
+            Response matrix of the chunk.
+        """
+        numbers = self.__chunk_numbers()
+        cache = self.chunk_cache
+        if cache is None:
+            for chunk in self.__load_chunks(numbers):
+                yield chunk
+            return
+
+        #take the cached chunks first, so that they cannot be evicted by the
+        #chunks read during this epoch before being used
+        cached = {}
+        for i in numbers:
+            XY = cache.get(i)
+            if XY is not None:
+                cached[i] = XY
+        missing = [i for i in numbers if i not in cached]
+        loaded = self.__load_chunks(missing)
+
+        for i in numbers:
+            if i in cached:
+                X, Y = cached.pop(i)
+            else:
+                chunk = next(loaded, None)
+                #the file has less chunks than expected
+                if chunk is None:
+                    break
+                i, X, Y = chunk
+                #the cache keeps a copy : the buffer can be reused
+                X_, Y = cache.put(i, X, Y)
+                self.decoder.release(X)
+                X = X_
+            yield i, X, Y
+
+    def __load_chunks(self, indices):
+        """
+        Generator reading the chunks of the file with the given increasing
+        numbers.
+        """
+        #serve the chunks from the memory-mapped binary store
+        if self.store is not None:
+            n_chunks = math.ceil(self.store.n/self.m)
+            for i in indices:
+                if not i<n_chunks:
+                    break
+                X, Y = self.store.chunk(i, self.m)
+                yield i, X, Y
+
+        #seek the chunks thanks to the index, possibly in parallel
+        elif self.index is not None:
+            def read_chunk(i):
+                data = self.index.read(i, self.m)
+                return (i,) + self.decoder.decode(data)
+            n_chunks = self.index.number_of_chunks(self.m)
+            indices = [i for i in indices if i<n_chunks]
+            if self.readers > 1:
+                for chunk in parallel_map(read_chunk, indices, self.readers):
+                    yield chunk
+            else:
+                for i in indices:
+                    yield read_chunk(i)
+
+        #stream a sparse file in the libsvm format
+        elif self.file_format == "libsvm":
+            indices = list(indices)
+            if not indices:
+                return
+            wanted = set(indices)
+            reader = read_libsvm_chunks(self.file, self.m, self.d, self.k,
+                                        self.to_one_hot)
+            for (i, (X, Y)) in enumerate(reader):
+                if i>indices[-1]:
+                    break
+                if i in wanted:
+                    yield i, X, Y
+
         #create a pandas reader to stream the file
-        if not self.tf_dataset:
+        else:
+            indices = list(indices)
+            if not indices:
+                return
+            wanted = set(indices)
             reader = pd.read_table(self.file,
                                    sep = ",",
-                                   chunksize = self.m)
+                                   chunksize = self.m,
+                                   dtype = np.float32)
 
             #start streaming
+            n_chunks = 0
             for (i,chunk) in enumerate(reader):
+                n_chunks = i+1
 
-                #if the number of chunk to consider has been reached, we break
-                if not i<self.M:
+                #if the last chunk to consider has been reached, we break
+                if i>indices[-1]:
                     break
-                
-                #decode data
-                data = np.asarray(chunk)
-                #handle X and Y
-                if self.to_one_hot:
-                    X = data[:,1:]
-                    Y = to_one_hot(data[:,0],self.k)
-                else:
-                    X = data[:,self.k:self.d+self.k]
-                    Y = data[:,:self.k]
-                
-                #create the feeding dict
-                d_ = {"X:0" : X, "Y:0" : Y}
-                #update the global parameters
-                self.__run_partials_update(sess, i, run_kwargs=run_kwargs, dict=d_)
+                if i not in wanted:
+                    continue
 
-        #else, create a tf.dataset reader to stream the file
-        else:
-            for i in range(self.M):
-                self.__run_partials_update(sess, i, run_kwargs=run_kwargs)
+                #decode data, handle X and Y
+                X, Y = self.decoder.decode(chunk.values)
+                yield i, X, Y
+            else:
+                #the file has less chunks than expected, remember it
+                self.n_chunks = min(self.n_chunks, n_chunks)
+                self.M = min(self.M, n_chunks)
 
-    def __run_partials_update(self, sess, i, run_kwargs, dict={}):
+    def __run_partials_update(self, sess, i, slot, run_kwargs, dict={}):
         """
         Update global_e, global_rho and global_beta with a given chunk.
 
@@ -808,6 +1461,9 @@ class Graph:
             The current tensorflow session.
         i : int
             Chunk number.
+        slot : int
+            Position of the chunk in the current epoch, at which its eᵢ, ρᵢ
+            and βᵢ are stored if chunk_as_sum is False.
         run_kwargs :
             Additional arguments that will be added to ``sess.run()``
         dict : dict
@@ -818,12 +1474,25 @@ class Graph:
 
         #add to e,ρ and β the current eᵢ,ρᵢ and βᵢ
         if self.chunk_as_sum:
-            self.__run(sess,ops["update_partials"], feed_dict = dict,
-                    **run_kwargs)
+            update = ops["update_partials"]
 
-        #chunk as list : append current eᵢ, ρᵢ and βᵢ to [eᵢ],[ρᵢ],[βᵢ]
+        #chunk as list : write current eᵢ, ρᵢ and βᵢ in [eᵢ],[ρᵢ],[βᵢ]
+        else:
+            update = ops["update_partials"]
+            dict = {**dict, "chunk_index:0" : slot}
+
+        #the projections Aᵢ of a cached chunk are fed instead of computed,
+        #otherwise they are computed along and cached
+        cache = self.projection_cache
+        A_arrays = None if cache is None else cache.get(i)
+        if cache is None:
+            self.__run(sess, update, feed_dict = dict, **run_kwargs)
+        elif A_arrays is not None:
+            dict = {**dict, ops["A_array"] : A_arrays[0]}
+            self.__run(sess, update, feed_dict = dict, **run_kwargs)
         else:
-            self.__run(sess,ops["update_partials"][i], feed_dict = dict,
-                    **run_kwargs)
+            _, A_array = self.__run(sess, [update, ops["A_array"]],
+                                    feed_dict = dict, **run_kwargs)
+            cache.put(i, A_array)
 
         print("Chunk number {} done.".format(i))
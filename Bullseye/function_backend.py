@@ -0,0 +1,181 @@
+"""
+The ``function_backend`` module
+===============================
+
+Contains the ``FunctionBackend`` class, an execution backend of the
+Bullseye.Graph built on ``tf.function`` and ``tf.Variable`` instead of
+placeholders and sessions. It is selected with
+``Graph.set_options(backend = "function")``.
+
+The operations describing an iteration are the ones of the session backend,
+see the ``graph_aux`` module, traced once by ``tf.function``. As the rest of
+Bullseye, they use the ``tensorflow.compat.v1`` names, available with
+tensorflow 1.15 and 2.x. With the same ``seed`` option, both backends give
+the same results, see ``Tests.function_backend``.
+"""
+
+import tensorflow.compat.v1 as tf
+import numpy as np
+import scipy.sparse
+import inspect
+
+from .graph_aux import *
+from .utils import *
+from .warning_handler import *
+
+def xla_argument():
+    """
+    Name of the argument of ``tf.function`` compiling with XLA :
+    ``jit_compile`` since tensorflow 2.5, ``experimental_compile`` before.
+    """
+    if "jit_compile" in inspect.signature(tf.function).parameters:
+        return "jit_compile"
+    return "experimental_compile"
+
+class FunctionBackend:
+    """
+    The ``FunctionBackend`` class
+    =============================
+    Holds the state of the Bullseye algorithm in ``tf.Variable``'s and
+    performs its iterations with a ``tf.function``. Requires eager execution,
+    which is the default with tensorflow 2.
+
+    Only data kept in memory is supported : X and Y are given to
+    ``Graph.feed_with`` or to ``Graph.run``, see ``set_data``.
+    """
+    def __init__(self, G):
+        """
+        Create the variables and the traced iteration of a Bullseye.Graph.
+        """
+        if not tf.executing_eagerly():
+            err_unsupported_backend("function", "eager execution is disabled")
+
+        self.G = G
+        p = G.p
+
+        #μ, Σ and ELBO related
+        if G.diag_cov:
+            G.cov_0 = np.einsum('ij,ij->ij',G.cov_0,
+                                np.eye(*list(G.cov_0.shape)))
+        self.initial_values = {
+            "mu" : G.mu_0,
+            "cov" : G.cov_0,
+            "elbo" : -np.inf,
+            "e" : 0.,
+            "rho" : np.zeros(p),
+            "beta" : np.linalg.inv(G.cov_0),
+            "step_size" : G.speed,
+            "cov_sqrt" : np.eye(p)
+            }
+        self.variables = {name : tf.Variable(np.asarray(value, np.float32),
+                                             name = name, trainable = False)
+                          for (name, value) in self.initial_values.items()}
+        self.status = tf.Variable("", name = "status", trainable = False)
+        self.keep_sqrt = uses_cov_sqrt(G)
+
+        #the data, given later to ``Graph.run`` if it is not in the graph
+        self.data = None
+        if G.X is not None:
+            self.set_data(G.X, G.Y)
+
+    def set_data(self, X, Y):
+        """
+        Set the data and its projections, computed once, and trace the
+        iteration again, the data being constant within it.
+        """
+        G = self.G
+        self.data = (X, Y)
+        if G.sparse:
+            X = to_sparse_value(scipy.sparse.csr_matrix(X, dtype = np.float32))
+            self.X = tf.SparseTensor(X.indices, X.values, X.dense_shape)
+        else:
+            self.X = tf.constant(X, dtype = tf.float32)
+        self.Y = tf.constant(Y, dtype = tf.float32)
+        self.A_array = G.Proj(self.X, G.k) if G.use_projs else None
+
+        #the candidates and the triplets are compiled with XLA if G.jit
+        self.candidates_and_triplets = tf.function(
+            self.__candidates_and_triplets, **{xla_argument() : G.jit})
+        self.iteration = tf.function(self.__iteration)
+
+    def initialize(self):
+        """
+        Set μ, Σ and the other variables back to their initial values.
+        """
+        for (name, value) in self.initial_values.items():
+            self.variables[name].assign(np.asarray(value, np.float32))
+        self.status.assign("")
+
+    def __candidates_and_triplets(self):
+        """
+        The candidates μ and Σ, and the triplets of the likelihood and of the
+        prior at these candidates.
+        """
+        G = self.G
+        v = self.variables
+        cov_sqrt = v["cov_sqrt"] if self.keep_sqrt else None
+
+        new_cov, new_cov_sqrt, new_logdet, new_mu, _ = \
+            candidate_parameters(G, v["mu"], v["cov"], v["beta"],
+                                 v["rho"], v["step_size"], cov_sqrt)
+        if not self.keep_sqrt:
+            new_cov_sqrt = None
+        targs = [new_mu, new_cov, new_cov_sqrt]
+        likelihood = likelihood_triplet(G, self.X, self.Y, *targs,
+                                        A_array = self.A_array)
+        prior = prior_triplet(G, *targs)
+        return (new_cov, new_cov_sqrt, new_logdet, new_mu) + likelihood + prior
+
+    def __iteration(self):
+        """
+        One iteration of the Bullseye algorithm.
+
+        Returns
+        -------
+        status : tf.tensor []
+            "accepted" or "refused".
+        new_ELBO : tf.tensor []
+            The ELBO of the candidate.
+        ELBO : tf.tensor []
+            The best ELBO.
+        """
+        G = self.G
+        v = self.variables
+
+        #candidates and triplets
+        new_cov, new_cov_sqrt, new_logdet, new_mu, e_l, rho_l, beta_l, \
+            e_p, rho_p, beta_p = self.candidates_and_triplets()
+        if self.keep_sqrt:
+            v["cov_sqrt"].assign(new_cov_sqrt)
+
+        new_e = e_l + e_p
+        H = 0.5 * new_logdet + G.d * 0.5 * np.log(2*np.pi*np.e)
+        new_ELBO = - new_e + H
+
+        def accepted_update():
+            v["e"].assign(new_e)
+            v["rho"].assign(rho_l + rho_p)
+            v["beta"].assign(beta_l + beta_p)
+            v["cov"].assign(new_cov)
+            v["mu"].assign(new_mu)
+            v["elbo"].assign(new_ELBO)
+            v["step_size"].assign(G.speed)
+            return tf.constant("accepted")
+
+        def refused_update():
+            v["step_size"].assign(v["step_size"] * G.step_size)
+            return tf.constant("refused")
+
+        if G.brutal_iteration:
+            status = accepted_update()
+        else:
+            status = tf.cond(new_ELBO > v["elbo"], accepted_update,
+                             refused_update)
+        self.status.assign(status)
+        return status, new_ELBO, v["elbo"].read_value()
+
+    def values(self, *names):
+        """
+        Current values of the given variables, as numpy arrays.
+        """
+        return [self.variables[name].numpy() for name in names]
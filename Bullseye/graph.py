@@ -7,8 +7,7 @@
 """
 #→ may try to document this better
 
-import tensorflow as tf
-from tensorflow.initializers import constant as tic
+import tensorflow.compat.v1 as tf
 import numpy as np
 import re
 
@@ -16,6 +15,8 @@ from .sampling import *
 from .graph_aux import *
 from .utils import *
 
+tic = tf.constant_initializer
+
 def construct_bullseye_graph(G):
     """
     Creates the implicit tensorflow graph given a Bullseye.Graph.
@@ -34,10 +35,24 @@ def construct_bullseye_graph(G):
         A dictionnary containing the important variables and operations of the
         graph
     """
-    #set the graph
-    tf.reset_default_graph()
-    graph = tf.get_default_graph()
+    #set the graph, a new one rather than the default one, so that it is
+    #built in graph mode even when eager execution is enabled
+    graph = tf.Graph()
+    with graph.as_default():
+        ops_dict = bullseye_operations(G)
+    return graph, ops_dict
 
+def bullseye_operations(G):
+    """
+    Creates the operations of the implicit tensorflow graph in the default
+    graph, see ``construct_bullseye_graph``.
+
+    Returns
+    -------
+    ops_dict : dict
+        A dictionnary containing the important variables and operations of the
+        graph
+    """
     #for simplicity
     d,k,p = [G.d, G.k, G.p]
     dim_samp = p if not G.local_std_trick else k
@@ -49,33 +64,53 @@ def construct_bullseye_graph(G):
     #X, Y related
     #always put Y as a [n,k] tensor
     if G.X is None and G.Y is None:
-        if not G.tf_dataset: #placeholders of file with pandas
-            X = tf.placeholder(tf.float32, name='X', shape = [None, d])
-            Y = tf.placeholder(tf.float32, name='Y', shape = [None, k])
-        elif G.file is not None: #file with tf.file
-            filenames = [G.file]
-            record_defaults = [tf.float32] * (d+k)
-            dataset = tf.data.experimental.CsvDataset(filenames,record_defaults)
-            batched_dataset = dataset.batch(G.m)
-            iterator = batched_dataset.make_initializable_iterator()
-
-            it_next = iterator.get_next()
-            
-            #not that nice...
-            if not G.to_one_hot:
-                X = tf.transpose(tf.convert_to_tensor(it_next[k:(d+k)]))
-                Y = tf.transpose(tf.convert_to_tensor(it_next[:k]))
+        #placeholders of file with pandas or with the binary store
+        if not uses_tf_dataset(G):
+            if not G.sparse:
+                X = tf.placeholder(tf.float32, name='X', shape = [None, d])
             else:
-                read_Y = tf.transpose(it_next[0])
-                X = tf.transpose(tf.convert_to_tensor(it_next[1:(d+1)]))
-                Y = tf.one_hot(tf.cast(read_Y, 'int32'), k)
+                X = tf.sparse_placeholder(tf.float32, name='X',
+                                          shape = [None, d])
+            Y = tf.placeholder(tf.float32, name='Y', shape = [None, k])
+        else: #file with tf.data
+            X, Y, iterator = tf_dataset_pipeline(G)
     else:
+        #the data is not embedded in the graph as constants : the variables
+        #are initialized from placeholders fed when the session starts, see
+        #``Graph.run``
+        if G.m is None and G.sparse:
+            nnz = G.X.nnz
+            X_indices_init = tf.placeholder(tf.int64, [nnz,2],
+                                            name = "X_indices_init")
+            X_values_init = tf.placeholder(tf.float32, [nnz],
+                                           name = "X_values_init")
+            X_indices = tf.get_variable("X_indices", initializer = X_indices_init,
+                                        trainable = False)
+            X_values = tf.get_variable("X_values", initializer = X_values_init,
+                                       trainable = False)
+            X = tf.SparseTensor(X_indices, X_values, list(G.X.shape))
+        elif G.m is None:
+            X_init = tf.placeholder(tf.float32, G.X.shape, name = "X_init")
+            X = tf.get_variable("X", initializer = X_init, trainable = False)
         if G.m is None:
-            X = tf.get_variable("X", G.X.shape,initializer = tic(G.X),
-                                dtype = tf.float32)
-            Y = tf.get_variable("Y",G.Y.shape,initializer = tic(G.Y),
-                                dtype = tf.float32)
-                
+            Y_init = tf.placeholder(tf.float32, G.Y.shape, name = "Y_init")
+            Y = tf.get_variable("Y", initializer = Y_init, trainable = False)
+
+    #projections Aᵢ, which only depend on X : in memory, they are computed
+    #once at initialization
+    if G.X is not None and G.m is None:
+        #from the fed initial values of X
+        if G.sparse:
+            X_initial = tf.SparseTensor(X_indices_init, X_values_init,
+                                        list(G.X.shape))
+        else:
+            X_initial = X_init
+        A_array = data_projections(G, X_initial, resident = True)
+        #implicit block projections read X itself
+        if isinstance(A_array, BlockProjections):
+            A_array = data_projections(G, X)
+    else:
+        A_array = data_projections(G, X)
 
 
     #status
@@ -91,7 +126,7 @@ def construct_bullseye_graph(G):
     cov  = tf.get_variable("cov",[p,p],initializer = tic(G.cov_0),
                         dtype = tf.float32)
 
-    ELBO = tf.get_variable("elbo",[],initializer = tic(-np.infty),
+    ELBO = tf.get_variable("elbo",[],initializer = tic(-np.inf),
                         dtype = tf.float32)
 
     #e, ρ and β related
@@ -106,6 +141,10 @@ def construct_bullseye_graph(G):
     #step size
     step_size = tf.get_variable("step_size", [], initializer = tic(G.speed),
                                 dtype = tf.float32)
+    #number of accepted iterations, used by the stochastic step size schedule
+    n_accepted = tf.get_variable("n_accepted", [],
+                                 initializer = tf.zeros_initializer,
+                                 dtype = tf.float32)
 
     #new_cov, new_mu
     new_cov = tf.get_variable("new_cov",[p,p],
@@ -119,85 +158,74 @@ def construct_bullseye_graph(G):
                               dtype = tf.float32)
 
     #new_cov_sqrt
-    if (not G.local_std_trick or G.Psi is not None) or G.compute_gamma or not G.prior_iid:
+    if uses_cov_sqrt(G):
         new_cov_sqrt = tf.get_variable("new_cov_sqrt", [p,p],
                                        initializer = tic(np.eye(p)),
                                        dtype = tf.float32)
     else:
         new_cov_sqrt = None
     
-    if G.comp_opt is "cholesky":
-        beta_chol = tf.linalg.cholesky(beta)
-        beta_sqrt = tf.transpose(beta_chol)
-        #beta_inv = tf.linalg.inv(beta)
-        #beta_inv_sqrt = tf.linalg.inv(beta_sqrt)
-        beta_inv = tf.transpose(tf.cholesky_solve(beta_chol, tf.eye(p)))
-        beta_inv_sqrt = matrix_sqrt(beta_inv)
-    elif G.comp_opt=="svd":
-        s_beta, u_beta, v_beta = tf.linalg.svd(beta)
-        s_beta_sqrt = tf.linalg.diag(tf.sqrt(s_beta))
-        s_beta_inv = tf.linalg.diag(tf.reciprocal(s_beta))
-        s_beta_inv_sqrt = tf.linalg.diag(tf.reciprocal(tf.sqrt(s_beta)))
-        
-        beta_sqrt = tf.matmul(u_beta, tf.matmul(s_beta_sqrt, v_beta, adjoint_b=True))
-        beta_inv = tf.matmul(u_beta, tf.matmul(s_beta_inv, v_beta, adjoint_b=True))
-        beta_inv_sqrt = tf.matmul(u_beta, tf.matmul(s_beta_inv_sqrt, v_beta, adjoint_b=True))
-
-    #from definition of Σₘ
-    cov_max = beta_inv
-    cov_max_inv = beta
-    cov_max_sqrt = beta_inv_sqrt
-
     assert G.backtracking_degree in [-1,1,0.5]
 
-    if not G.compute_gamma:
-        gamma = step_size
-    else:
-        #compute
-        #K⁻¹=Σ^½•β•Σ^½
-        K_inv = new_cov_sqrt @ beta @ new_cov_sqrt
-        K_inv_sqrt = tf.linalg.cholesky(K_inv)
-        K_eig = tf.math.reciprocal(tf.linalg.diag_part(K_inv))
-        eig_limitation = 0.5
-        K_eigmin = tf.reduce_min(K_eig)
-        gamma = (eig_limitation - 1)/(K_eigmin -1)
-    #backtracking
-    pars = [cov_max_inv,new_cov_sqrt]
-    new_cov_, new_cov_sqrt_, new_logdet_ = compute_new_cov_and_co(G,gamma,cov,cov_max,*pars)
-    new_mu_  = mu - step_size * tf.einsum('ij,j->i', beta_inv, rho)
+    #candidate μ and Σ, and optionally γ
+    with jit_scope(G):
+        new_cov_, new_cov_sqrt_, new_logdet_, new_mu_, gamma = \
+            candidate_parameters(G, mu, cov, beta, rho, step_size,
+                                 new_cov_sqrt)
 
     """
     UPDATE
     """
-    update_new_cov = tf.assign(new_cov, new_cov_)
-    update_new_mu = tf.assign(new_mu, new_mu_)
-    update_new_logdet = tf.assign(new_logdet, new_logdet_)
-
-    update_new_parameters = [update_new_cov, update_new_mu, update_new_logdet]
+    #without chunks, a whole epoch is done in a single run : the candidates
+    #are used directly instead of being read from the variables, which are
+    #updated once every state variable has been read
+    fused_epoch = G.m is None
+    if new_cov_sqrt is None:
+        new_cov_sqrt_ = None
+    candidates = [t for t in [new_cov_, new_mu_, new_logdet_, new_cov_sqrt_]
+                  if t is not None]
+
+    with tf.control_dependencies(candidates if fused_epoch else []):
+        update_new_cov = tf.assign(new_cov, new_cov_)
+        update_new_mu = tf.assign(new_mu, new_mu_)
+        update_new_logdet = tf.assign(new_logdet, new_logdet_)
+
+        update_new_parameters = [update_new_cov, update_new_mu,
+                                 update_new_logdet]
+
+        #new_cov_sqrt
+        if new_cov_sqrt is not None:
+            update_new_cov_sqrt = tf.assign(new_cov_sqrt, new_cov_sqrt_)
+            update_new_parameters += [update_new_cov_sqrt]
+        else:
+            update_new_cov_sqrt = None
 
-    #new_cov_sqrt
-    if new_cov_sqrt is not None:
-        update_new_cov_sqrt = tf.assign(new_cov_sqrt, new_cov_sqrt_)
-        update_new_parameters += [update_new_cov_sqrt]
+    #the candidate μ, Σ, √Σ and log det Σ
+    if fused_epoch:
+        cand_mu, cand_cov = new_mu_, new_cov_
+        cand_cov_sqrt, cand_logdet = new_cov_sqrt_, new_logdet_
     else:
-        update_new_cov_sqrt = None
+        cand_mu, cand_cov = new_mu, new_cov
+        cand_cov_sqrt, cand_logdet = new_cov_sqrt, new_logdet
 
     """
     TRIPLETS
     """
     #LIKELIHOOD TRIPLET
     #for readability
-    ltargs = [new_mu,new_cov,new_cov_sqrt]
+    ltargs = [cand_mu,cand_cov,cand_cov_sqrt]
     
-    computed_e, computed_rho, computed_beta = \
-        likelihood_triplet(G,X,Y,*ltargs)
+    with jit_scope(G):
+        computed_e, computed_rho, computed_beta = \
+            likelihood_triplet(G,X,Y,*ltargs, A_array = A_array)
     
     #test = test_(G,X,Y,*ltargs)
 
     #PRIO TRIPLET
-    ptargs = [new_mu,new_cov,new_cov_sqrt]
-    computed_e_prior, computed_rho_prior, computed_beta_prior =\
-        prior_triplet(G, *ptargs)
+    ptargs = [cand_mu,cand_cov,cand_cov_sqrt]
+    with jit_scope(G):
+        computed_e_prior, computed_rho_prior, computed_beta_prior =\
+            prior_triplet(G, *ptargs)
 
     """
     FOR CHUNKS
@@ -208,7 +236,7 @@ def construct_bullseye_graph(G):
         init_partials = []
         update_partials = []
         
-        if G.file is not None and G.tf_dataset:
+        if uses_tf_dataset(G):
             #if we use tf.dataset, we need to reset the iterator to 0
             init_partials += [iterator]
         
@@ -234,32 +262,26 @@ def construct_bullseye_graph(G):
             init_partials += [e_sum, rho_sum, beta_sum]
 
         #conside vectors
-        # then we need to keep in mind all the different eᵢ,ρᵢ,βᵢ
+        # then we need to keep in mind all the different eᵢ,ρᵢ,βᵢ, stacked in
+        # preallocated variables updated at the index of the current chunk
         else:
-            e_tab = []
-            rho_tab = []
-            beta_tab = []
-
-            update_e_tab = []
-            update_rho_tab = []
-            update_beta_tab = []
-
-            width = len(str(G.M))
-            for _ in range(G.M):
-                idx = "chunk_{_:0>{width}}".format(_=_, width=width)
-                e_tab.append(tf.get_variable("e_"+idx, [],
-                                        initializer = tf.zeros_initializer,
-                                        dtype = tf.float32))
-                rho_tab.append(tf.get_variable("rho_"+idx, [p],
-                                        initializer = tf.zeros_initializer,
-                                        dtype = tf.float32))
-                beta_tab.append(tf.get_variable("beta_"+idx, [p,p],
-                                        initializer=tf.zeros_initializer,
-                                        dtype = tf.float32))
-
-                update_partial_e.append(tf.assign(e_tab[_],computed_e))
-                update_partial_rho.append(tf.assign(rho_tab[_],commuted_rho))
-                update_partial_beta.append(tf.assign(beta_tab[_],computed_beta))
+            chunk_index = tf.placeholder(tf.int32, [], name = "chunk_index")
+            e_tab = tf.get_variable("e_tab", [G.M],
+                                    initializer = tf.zeros_initializer,
+                                    dtype = tf.float32)
+            rho_tab = tf.get_variable("rho_tab", [G.M,p],
+                                    initializer = tf.zeros_initializer,
+                                    dtype = tf.float32)
+            beta_tab = tf.get_variable("beta_tab", [G.M]+chunk_beta_shape(G),
+                                    initializer = tf.zeros_initializer,
+                                    dtype = tf.float32)
+
+            update_partial_e = tf.scatter_update(e_tab, [chunk_index],
+                                                 [computed_e])
+            update_partial_rho = tf.scatter_update(rho_tab, [chunk_index],
+                                                   [computed_rho])
+            update_partial_beta = tf.scatter_update(beta_tab, [chunk_index],
+                                        [pack_chunk_beta(G, computed_beta)])
 
         update_partials+=[update_partial_e, update_partial_rho, update_partial_beta]
         init_chunks = tf.variables_initializer(init_partials)
@@ -280,36 +302,61 @@ def construct_bullseye_graph(G):
 
     #if batches are used
     else:
+        #in stochastic mode, M chunks out of n_chunks are drawn at random :
+        #rescaling their sum gives unbiased estimates of e, ρ and β. The
+        #scale is fed at each iteration, from the chunks actually read
+        chunk_scale = tf.placeholder_with_default(1., [], name = "chunk_scale")
+
         if G.chunk_as_sum:
-            new_e = e_sum + computed_e_prior
-            new_rho = rho_sum + computed_rho_prior
-            new_beta = beta_sum + computed_beta_prior
+            new_e = chunk_scale * e_sum + computed_e_prior
+            new_rho = chunk_scale * rho_sum + computed_rho_prior
+            new_beta = chunk_scale * beta_sum + computed_beta_prior
         else: #chunk as list
-            new_e = tf.reduce_sum(e_tab, axis = 0) + computed_e_prior
-            new_rho = tf.reduce_sum(rho_tab, axis = 0) + computed_rho_prior
-            new_beta = tf.reduce_sum(beta_tab, axis = 0) + computed_beta_prior
+            new_e = chunk_scale * tf.reduce_sum(e_tab, axis = 0) \
+                        + computed_e_prior
+            new_rho = chunk_scale * tf.reduce_sum(rho_tab, axis = 0) \
+                        + computed_rho_prior
+            new_beta = chunk_scale * sum_chunk_betas(G, beta_tab) \
+                        + computed_beta_prior
+
+    #in a fused epoch, the state variables are only modified once the
+    #candidates are computed, and the candidate variables are updated along
+    epoch_dependencies = candidates + update_new_parameters if fused_epoch\
+                            else []
 
     #new ELBO
-    H = 0.5 *  new_logdet + d * 0.5 * np.log(2*np.pi*np.e)
+    H = 0.5 *  cand_logdet + d * 0.5 * np.log(2*np.pi*np.e)
     new_ELBO = - new_e + H
 
+
     """
     ACCEPTED UPDATE
     """
-    def accepted_update():
-        update_e = tf.assign(e, new_e, name = "update_e")
-        update_rho  = tf.assign(rho,  new_rho, name = "update_rho")
-        update_beta = tf.assign(beta, new_beta, name = "update_beta")
-        update_cov  = tf.assign(cov, new_cov, name = "update_cov")
-        update_mu = tf.assign(mu, new_mu, name = "update_mu")
-        update_ELBO = tf.assign(ELBO, new_ELBO, name = "update_ELBO")
-        update_step_size=tf.assign(step_size, G.speed, name="update_step_size")
+    def accepted_update(dependencies = []):
+        with tf.control_dependencies(dependencies):
+            update_e = tf.assign(e, new_e, name = "update_e")
+            update_rho  = tf.assign(rho,  new_rho, name = "update_rho")
+            update_beta = tf.assign(beta, new_beta, name = "update_beta")
+            update_cov  = tf.assign(cov, cand_cov, name = "update_cov")
+            update_mu = tf.assign(mu, cand_mu, name = "update_mu")
+            update_ELBO = tf.assign(ELBO, new_ELBO, name = "update_ELBO")
+            if not G.stochastic_chunks:
+                new_step_size = G.speed
+            else:
+                #decreasing schedule γₜ = speed·(t+1)^(-decay), t being the
+                #number of accepted iterations
+                update_n_accepted = tf.assign_add(n_accepted, 1.)
+                new_step_size = G.speed * tf.pow(update_n_accepted + 1.,
+                                                 -G.step_size_decay)
+            update_step_size=tf.assign(step_size, new_step_size,
+                                       name="update_step_size")
 
         #→
         with tf.control_dependencies([update_e, update_rho, update_beta,
                                      update_cov, update_mu, update_ELBO,
                                      update_step_size]):
-            return [tf.assign(status, "accepted"), new_ELBO, ELBO]
+            return [tf.assign(status, "accepted"), new_ELBO, ELBO,
+                    tf.identity(cand_mu), tf.identity(cand_cov)]
 
     """
     REFUSED UPDATE
@@ -319,25 +366,46 @@ def construct_bullseye_graph(G):
                                 step_size*G.step_size)
         #status_to_refused = tf.assign(status, "refused")
         with tf.control_dependencies([decrease_step_size]):
-            return [tf.assign(status, "refused"), new_ELBO, ELBO]
+            return [tf.assign(status, "refused"), new_ELBO, ELBO,
+                    tf.identity(mu), tf.identity(cov)]
 
     """
     ITERATIONS
     """
-    condition_update = new_ELBO > ELBO
+    #the branches of the condition are run after the condition itself
+    with tf.control_dependencies(epoch_dependencies):
+        condition_update = new_ELBO > ELBO
 
-    brutal_iteration = accepted_update()
+    brutal_iteration = accepted_update(epoch_dependencies)
     soft_iteration = tf.cond(condition_update, accepted_update, refused_update)
 
-    if G.brutal_iteration:
-        iteration = brutal_iteration
+    #in stochastic mode, the ELBO is estimated on random chunks and cannot be
+    #compared from one iteration to another
+    if G.brutal_iteration or G.stochastic_chunks:
+        epoch = brutal_iteration
     else:
-        iteration = soft_iteration
+        epoch = soft_iteration
+    #status, new ELBO and best ELBO, then μ and Σ after the iteration
+    iteration = epoch[:3]
+
+    """
+    IN-GRAPH LOOP
+    """
+    #all the iterations in a single run, for data kept in memory
+    if G.in_graph_loop:
+        assert G.m is None
+        loop = in_graph_loop(G, X, Y, A_array, mu, cov, beta, rho, e, ELBO,
+                             step_size, new_cov_sqrt, status)
+    else:
+        loop = None
 
     """
     INIT and RETURN
     """
     init = tf.global_variables_initializer()
+    #block projections are implicit, there is no A_array to fetch nor to feed
+    if isinstance(A_array, BlockProjections):
+        A_array = None
     ops_dict = {'init' : init,
                 'new_ELBO' : new_ELBO,
                 'ELBO' : ELBO,
@@ -347,6 +415,7 @@ def construct_bullseye_graph(G):
                 'beta' : beta,
                 'X' : X,
                 'Y' : Y,
+                'A_array' : A_array,
                 'gamma' : gamma,
                 
                 'new_logdet' : new_logdet,
@@ -371,6 +440,8 @@ def construct_bullseye_graph(G):
                 'update_new_cov_sqrt' : update_new_cov_sqrt,
 
                 'iteration' : iteration,
+                'epoch' : epoch,
+                'loop' : loop,
                 'status' : status,
 
                 'update_new_parameters' : update_new_parameters,
@@ -378,4 +449,4 @@ def construct_bullseye_graph(G):
                 #'test' : test
                 }
 
-    return graph, ops_dict
+    return ops_dict
@@ -6,17 +6,113 @@
     This module is only intended to make the code more flexible
 """
 
-import tensorflow as tf
+from .lazy_import import tf
 import numpy as np
+import contextlib
 import re
 
 from .sampling import *
+from .autodiff import weighted_hessian
+
+def uses_tf_dataset(G):
+    """
+    Whether the file fed to the Bullseye.Graph is streamed with the tensorflow
+    dataset class rather than through placeholders.
+    """
+    return G.file is not None and G.tf_dataset and G.store is None \
+        and not G.sparse
+
+def uses_cov_sqrt(G):
+    """
+    Whether the square root of the candidate Σ is needed by the triplets or
+    the computation of γ, and should be kept from one iteration to another.
+    """
+    return (not G.local_std_trick or G.Psi is not None) or G.compute_gamma\
+            or not G.prior_iid
+
+def tf_dataset_pipeline(G):
+    """
+    Describes the input pipeline streaming the file(s) of the Bullseye.Graph
+    with the tensorflow dataset class. The first line of each file is skipped
+    as a header, as pandas does.
+
+    The lines of the shards are read by G.readers parallel readers, batched by
+    G.m, then each batch is decoded at once into X and Y, the one-hot
+    expansion included, by G.readers parallel calls. G.prefetch batches (at
+    least one) are prepared while the current one is processed.
+
+    Returns
+    -------
+    X : tf.tensor [m,d]
+        The design matrix of the current batch.
+    Y : tf.tensor [m,k]
+        The response matrix of the current batch.
+    iterator : tf.data.Iterator
+        The initializable iterator of the pipeline.
+    """
+    d, k = G.d, G.k
+    n_columns = d+1 if G.to_one_hot else d+k
+    readers = max(1, G.readers)
+
+    read_file = lambda filename : tf.data.TextLineDataset(filename).skip(1)
+    if len(G.files) == 1:
+        lines = read_file(G.files[0])
+    else:
+        lines = tf.data.Dataset.from_tensor_slices(G.files).apply(
+            tf.data.experimental.parallel_interleave(read_file,
+                                                     cycle_length = readers))
+
+    def decode(batch):
+        #vectorized decoding of the whole batch into a [m,n_columns] tensor
+        columns = tf.decode_csv(batch, [[0.]]*n_columns)
+        data = tf.stack(columns, axis = 1)
+        if G.to_one_hot:
+            X = data[:,1:]
+            Y = tf.one_hot(tf.cast(data[:,0], tf.int32), k)
+        else:
+            X = data[:,k:d+k]
+            Y = data[:,:k]
+        return X, Y
+
+    dataset = lines.batch(G.m)\
+                   .map(decode, num_parallel_calls = readers)\
+                   .prefetch(max(1, G.prefetch))
+    iterator = dataset.make_initializable_iterator()
+    X, Y = iterator.get_next()
+    X.set_shape([None, d])
+    Y.set_shape([None, k])
+    return X, Y, iterator
+
+def jit_scope(G):
+    """
+    Scope in which the created operations are compiled with XLA when G.jit is
+    set. The operations without XLA kernel are left out of the compiled
+    clusters and run as usual. Without XLA support, the scope does nothing
+    and compilation is left to the session, see ``session_config``.
+    """
+    if G.jit:
+        try:
+            return tf.xla.experimental.jit_scope(compile_ops = True)
+        except AttributeError:
+            pass
+    return contextlib.nullcontext()
+
+def session_config(G):
+    """
+    Configuration of the sessions of a Bullseye.Graph : when G.jit is set,
+    XLA also clusters automatically the supported operations of the graph.
+    """
+    config = tf.ConfigProto()
+    if G.jit:
+        config.graph_options.optimizer_options.global_jit_level = \
+            tf.OptimizerOptions.ON_1
+    return config
 
 """
 TRIPLETS
 """
 
-def likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
+def likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt,A_array=None):
     """
     Describes the part of the tensorflow graph related to the computation of e,
     ρ and β.
@@ -35,6 +131,9 @@ def likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
         The new Σ candidate that is being studied.
     new_cov_sqrt : tf.tensor [p,p]
         The square root of the new Σ candidate that is being studied.
+    A_array : tf.tensor [n,p,k], optional
+        The projections of X, see ``data_projections``. Computed from X if
+        not given.
 
     Returns
     -------
@@ -49,7 +148,7 @@ def likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
     pars = [G,X,Y,new_mu,new_cov,new_cov_sqrt]
     
     if G.use_projs :
-        return proj_likelihood_triplet(*pars)
+        return proj_likelihood_triplet(*pars, A_array = A_array)
     else:
         return brutal_likelihood_triplet(*pars)
 
@@ -67,7 +166,7 @@ def brutal_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
         return tf.zeros([]), tf.zeros([G.p]), tf.zeros([G.p,G.p])
 
     #sample s realisations of Zᵢ~𝒩(0,1)
-    z, z_weights = generate_sampling_tf(G.s, G.p)
+    z, z_weights = generate_sampling_tf(G.s, G.p, G.seed)
 
     #from sample z, compute the corresponding activations :
     # thetas[j] = θⱼ = μ+σ·zⱼ           of size [s,n,k]
@@ -89,7 +188,13 @@ def brutal_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
     #computed_beta = β = ∑ⱼ wⱼ·Hψ(θⱼ) ≈ 𝔼[Hψ(θⱼ)]          of size [k,k]
     computed_e = tf.einsum('s,s->',z_weights, psi)
     computed_rho = tf.einsum('s,sk->k',z_weights, grad_psi)
-    if not G.diag_cov:
+    weighted_hess_Psi = weighted_hess_psi(G)
+    if weighted_hess_Psi is not None:
+        #in a single pass, without the hessian of each θⱼ
+        computed_beta = weighted_hess_Psi(X,Y,thetas,z_weights)
+        if G.diag_cov:
+            computed_beta = tf.linalg.diag_part(computed_beta)
+    elif not G.diag_cov:
         computed_beta = tf.einsum('s,skj->kj',z_weights, hess_psi)
     else:
         computed_beta = tf.einsum('s,sk->k',z_weights, hess_psi)
@@ -111,7 +216,7 @@ def test_(G,X,Y,new_mu,new_cov,new_cov_sqrt):
                         dtype=tf.float32)
     return psi
 """
-def proj_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
+def proj_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt,A_array=None):
     if tf.shape(X)[0] == 0 or tf.shape(Y)[0]==0:
         return tf.zeros([]), tf.zeros([G.p]), tf.zeros([G.p,G.p])
     """
@@ -121,25 +226,52 @@ def proj_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
     """
     #consider i, ∀i ∈〚1,n〛
 
-    #compute projection arrays:
+    #compute projection arrays, unless they are given:
     # A_array[i] = Aᵢ               of size [p,k]
-    A_array = G.Proj(X, G.k)
+    if A_array is None:
+        A_array = G.Proj(X, G.k)
+
+    #sample s realisations of Zᵢ~𝒩(0,1), shared by all the rows
+    l=G.p if not G.local_std_trick else G.k
+    z, z_weights = generate_sampling_tf(G.s, l, G.seed)
+
+    #the rows are processed all at once, or by sub-batches whose e, ρ and β
+    #are accumulated
+    pars = [new_mu, new_cov, new_cov_sqrt, z, z_weights]
+    rows = micro_batch_rows(G)
+    if rows is None:
+        computed = proj_rows_triplet(G, Y, A_array, *pars)
+    else:
+        computed = micro_batched_triplet(G, Y, A_array, rows, pars)
+    computed_e, computed_rho, computed_beta = computed
 
+    return relocalize(computed_e, computed_rho, computed_beta,
+                      new_mu, new_cov, G.diag_cov)
+
+def proj_rows_triplet(G,Y,A_array,new_mu,new_cov,new_cov_sqrt,z,z_weights):
+    """
+    Compute e, ρ and β of the rows of Y and A_array, for the sample z, before
+    ``relocalize``.
+    """
     #compute local parameters, in other terms describe how behaves Aᵢ·θ:
     # local_mu[i]=μᵢ
     # local_std[i]=√Σᵢ
     local_mu, local_std, local_cov = aux_local_parameters(G, A_array,
                                                new_mu, new_cov, new_cov_sqrt)
     
-    #sample s realisations of Zᵢ~𝒩(0,1)
-    l=G.p if not G.local_std_trick else G.k
-    z, z_weights = generate_sampling_tf(G.s, l)
-
     #from sample z, compute the corresponding activations :
     # Activations[j,i] = Aᵢθⱼ = = μᵢ+√Σᵢzⱼ       of size [s,l,k]
-    Activations = tf.expand_dims(local_mu,0) +\
-                  tf.einsum('npk,sp->snk', local_std,z,
-                            name = 'einsum_in_activations')
+    if G.local_std_trick and G.k <= 2:
+        #one or two products broadcast over [s,n,k]
+        # Activations[j,i] = μᵢ + ∑ₐ zⱼₐ·√Σᵢ[a]
+        Activations = tf.expand_dims(local_mu,0)
+        for a in range(G.k):
+            Activations += tf.expand_dims(z[:,a:a+1],1)\
+                            * tf.expand_dims(local_std[:,a,:],0)
+    else:
+        Activations = tf.expand_dims(local_mu,0) +\
+                      tf.einsum('npk,sp->snk', local_std,z,
+                                name = 'einsum_in_activations')
 
     #activate the functions with the computed activations
     #compute :
@@ -163,12 +295,67 @@ def proj_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt):
     # computed_rho = ρ* = ∑ᵢ Aᵢ·rᵢ = ∑ᵢ ρᵢ              of size [p]
     # computed_beta = β = ∑ᵢ (Aᵢ^T)·Bᵢ·Aᵢ = ∑ᵢ βᵢ       of size[p,p]
     computed_e = tf.reduce_sum(local_e, name="computed_e_l")
-    computed_rho  = tf.einsum('npk,nk->p', A_array, local_r,
-                              name = 'computed_rho_l')
+    computed_rho  = aux_compute_rho(G, A_array, local_r)
     computed_beta = aux_compute_beta(G, A_array, local_B)
-    
-    return relocalize(computed_e, computed_rho, computed_beta,
-                      new_mu, new_cov, G.diag_cov)
+
+    return computed_e, computed_rho, computed_beta
+
+def micro_batch_rows(G):
+    """
+    Number of rows processed at once by the projection path, from the
+    ``micro_batch_size`` and ``micro_batch_memory`` options, or None to
+    process all the rows at once.
+    """
+    if G.micro_batch_size is not None:
+        return G.micro_batch_size
+    if G.micro_batch_memory is None:
+        return None
+    s, k, p = G.s, G.k, G.p
+    #floats held per row : the activations, ϕ, ∇ϕ and Hϕ for each sample,
+    #σᵢ, Aᵢ and (Aᵢ^T)·Bᵢ
+    floats = s*(2 + 2*k + k*k) + 3*p*k
+    return max(1, int(G.micro_batch_memory * 2**20) // (4*floats))
+
+def slice_rows(T, start, rows):
+    """
+    Rows [start, start+rows) of a tensor or a tf.SparseTensor, fewer if T
+    ends before.
+    """
+    if isinstance(T, tf.SparseTensor):
+        start = tf.cast(start, tf.int64)
+        begin = tf.concat([[start], tf.zeros_like(T.dense_shape[1:])], 0)
+        size = tf.concat([tf.constant([rows], tf.int64), T.dense_shape[1:]], 0)
+        return tf.sparse_slice(T, begin, size)
+    return T[start:start+rows]
+
+def micro_batched_triplet(G, Y, A_array, rows, pars):
+    """
+    Accumulate e, ρ and β of ``proj_rows_triplet`` over sub-batches of rows
+    in a tf.while_loop, so that the intermediates, e.g. Hϕ of size
+    [s,rows,k,k], are only held for one sub-batch at a time.
+    """
+    p = G.p
+    n = tf.shape(Y)[0]
+    n_batches = (n + rows - 1) // rows
+
+    def body(i, e, rho, beta):
+        start = i * rows
+        if isinstance(A_array, BlockProjections):
+            A_b = BlockProjections(slice_rows(A_array.X, start, rows),
+                                   A_array.k)
+        else:
+            A_b = slice_rows(A_array, start, rows)
+        e_b, rho_b, beta_b = proj_rows_triplet(G, slice_rows(Y, start, rows),
+                                               A_b, *pars)
+        return i+1, e+e_b, rho+rho_b, beta+beta_b
+
+    beta_shape = [p] if G.diag_cov else [p,p]
+    init = [tf.constant(0), tf.zeros([]), tf.zeros([p]), tf.zeros(beta_shape)]
+    #one sub-batch at a time, to bound the memory
+    _, computed_e, computed_rho, computed_beta = \
+        tf.while_loop(lambda i, *_ : i < n_batches, body, init,
+                      parallel_iterations = 1, back_prop = False)
+    return computed_e, computed_rho, computed_beta
 
 def prior_triplet(G,new_mu,new_cov,new_cov_sqrt):
     """
@@ -202,7 +389,9 @@ def prior_triplet(G,new_mu,new_cov,new_cov_sqrt):
     """
     l=G.p if not G.prior_iid else 1
     
-    z, z_weights = generate_sampling_tf(G.s, l)
+    #a distinct seed from the likelihood one
+    seed = None if G.seed is None else G.seed+1
+    z, z_weights = generate_sampling_tf(G.s, l, seed)
 
 
     if not G.prior_iid:
@@ -219,7 +408,7 @@ def prior_triplet(G,new_mu,new_cov,new_cov_sqrt):
         # θᵢⱼ is a realisation of θ[j]~𝒩(μⱼ,Σⱼⱼ)
         new_cov_diag_sqrt = tf.sqrt(tf.linalg.diag_part(new_cov))
         thetas = tf.expand_dims(new_mu,0)\
-                    + tf.einsum('p,sp->sp', new_cov_diag_sqrt,z)
+                    + tf.expand_dims(new_cov_diag_sqrt,0) * z
     
     #recall we have Activations of size [s_q,p].
     #compute:
@@ -372,27 +561,37 @@ def compute_phis(G, Activations, Y, local_mu, local_std, local_cov):
     return phi, grad_phi, hess_phi
 
 def compute_psis(G, X, Y, thetas, mu, cov):
+    """
+    Compute ψ(θ), ∇ψ(θ), Hψ(θ), ∀θ ∈ thetas : in a single pass if the ψ of
+    the graph is batched, one θ at a time with map_fn otherwise.
+    """
     grad_psi = None
     hess_psi = None
     
+    #apply a function to all the θ's
+    if G.batched_Psi:
+        apply = lambda f : f(X, Y, thetas)
+    else:
+        apply = lambda f : tf.map_fn(lambda t : f(X, Y, t), thetas,
+                                     dtype=tf.float32)
+    
     #ψ
-    psi = tf.map_fn(lambda t: G.Psi(X, Y, t), thetas,
-                        dtype=tf.float32)
+    psi = apply(G.Psi)
     #∇ψ
     if G.grad_Psi is not None:
-        gp = lambda t: G.grad_Psi(X,Y,t)
-        grad_psi = tf.map_fn(gp, thetas, dtype=tf.float32)
+        grad_psi = apply(G.grad_Psi)
         
-    #Hψ
-    if G.hess_Psi is not None:
-        if not G.diag_cov:
-            hp = lambda t: G.hess_Psi(X,Y,t)
-        else:
-            hp = lambda t: tf.linalg.diag_part(G.hess_Psi(X,Y,t))
-        hess_psi = tf.map_fn(hp, thetas, dtype=tf.float32)
-        #if both are computed
-        if grad_psi is not None:
-            return psi, grad_psi, hess_psi
+    #Hψ, unless ∑ⱼ wⱼ·Hψ(θⱼ) is computed directly, in which case None is
+    #returned
+    weighted = weighted_hess_psi(G) is not None
+    if not weighted and G.hess_Psi is not None:
+        hess_psi = apply(G.hess_Psi)
+        if G.diag_cov:
+            hess_psi = tf.linalg.diag_part(hess_psi)
+    hess_needed = not weighted and hess_psi is None
+    #if both are computed
+    if grad_psi is not None and not hess_needed:
+        return psi, grad_psi, hess_psi
     
     #APPROXIMATIONS
     
@@ -405,10 +604,25 @@ def compute_psis(G, X, Y, thetas, mu, cov):
     
     if grad_psi is None:
         grad_psi = grad_approx(G,w,psi)
-    if hess_psi is None :
+    if hess_needed :
         hess_psi = hess_approx(G,w,cov_inv,psi,grad_psi)
         
     return psi, grad_psi, hess_psi
+
+def weighted_hess_psi(G):
+    """
+    The function computing ∑ⱼ wⱼ·Hψ(θⱼ) directly, if any : the given one or,
+    with the "hvp" compute_hess option and a batched ψ whose hessian is not
+    given, the one built from hessian-vector products, see ``autodiff``.
+    """
+    if G.weighted_hess_Psi is not None:
+        return G.weighted_hess_Psi
+    if G.compute_hess == "hvp" and G.batched_Psi\
+            and "hess_Psi" in G.derived_functions:
+        return lambda X,Y,thetas,weights : \
+            weighted_hessian(lambda t : G.Psi(X,Y,t), thetas, weights,
+                             block_size = G.hvp_block_size)
+    return None
     
 def grad_approx(G,w,act):
     #using the activations previously computed
@@ -416,7 +630,7 @@ def grad_approx(G,w,act):
     return grad
     
 def hess_approx(G,w,cov_inv,act,grad):
-    if G.compute_hess in ["grad","tf"]:
+    if G.compute_hess in ["grad","tf","pfor","hvp"]:
         #using the gradient previously computed
         #Hƒ(θ)[i] = Sym(∇ƒ(θ)(θ-μᵢ)^T Σᵢ⁻¹)
         #         = Sym(∇ƒ(θ)•wᵢ^T)
@@ -511,6 +725,48 @@ def aux_A_arrays(G, X):
 
     return A_array, A_array_kernel
 """
+def data_projections(G, X, resident = False):
+    """
+    Describes the projection matrices Aᵢ of the data, which do not depend on
+    θ. Returns None if the projections are not used.
+
+    If ``resident``, X being the initial value of the in-memory design matrix,
+    the projections are kept in variables computed once when the graph is
+    initialized, so that the epochs only pay for the μ and Σ related
+    computations. Otherwise they are computed from the current chunk, and
+    can then be fed from a cache in place of X, see
+    ``Graph.set_options(projection_cache_size)``.
+
+    Block projections, see ``BlockProjections``, are returned as they are.
+
+    Returns
+    -------
+    A_array : tf.tensor or tf.SparseTensor [n,p,k], or BlockProjections
+        The set of projection matrices where A_array[i]=Aᵢ
+    """
+    if not G.use_projs:
+        return None
+    A_array = G.Proj(X, G.k)
+    if isinstance(A_array, BlockProjections):
+        #implicit, nothing to compute nor to keep
+        return A_array
+    if not resident:
+        return tf.identity(A_array, name = "A_array")\
+            if not isinstance(A_array, tf.SparseTensor) else A_array
+
+    def keep(tensor, name):
+        variable = tf.Variable(tensor, trainable = False, name = name,
+                               validate_shape = False)
+        value = variable.read_value()
+        value.set_shape(tensor.get_shape())
+        return value
+
+    if isinstance(A_array, tf.SparseTensor):
+        return tf.SparseTensor(keep(A_array.indices, "A_indices"),
+                               keep(A_array.values, "A_values"),
+                               keep(A_array.dense_shape, "A_dense_shape"))
+    return keep(A_array, "A_array")
+
 def aux_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt):
     """
     Make the computation of the different local parameters, μᵢ and σᵢ.
@@ -522,6 +778,11 @@ def aux_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt):
     local_std : tf.tensor [n,k,k]
         sd[Aᵢ·θ]=√Var[Aᵢ·θ]
     """
+    if isinstance(A_array, tf.SparseTensor):
+        return sparse_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt)
+    if isinstance(A_array, BlockProjections):
+        return block_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt)
+
     #compute local_mu:
     # local_mu[i] = μᵢ = Aᵢ·μ               of size [n,k]
     local_mu = tf.einsum('iba,b->ia',A_array, new_mu,
@@ -541,15 +802,62 @@ def aux_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt):
         #                         name = 'einsum_lazy_local_cov')
         local_cov_ = tf.einsum('npk,pq->nkq',A_array,new_cov)
         local_cov = tf.einsum('nkq,nql->nkl', local_cov_, A_array)
-        local_std_T = tf.linalg.cholesky(local_cov)
-        local_std = tf.transpose(local_std_T, perm=[0, 2, 1])
+        local_std = local_cov_sqrt(G, local_cov)
 
     return local_mu, local_std, local_cov
 
+def local_cov_sqrt(G, local_cov):
+    """
+    Upper triangular square roots Rᵢ of the local covariances, such that
+    Rᵢ^T•Rᵢ = Σᵢ. For k = 1 and k = 2, they are computed in closed form
+    rather than with a batched Cholesky factorization.
+
+    Parameters
+    ----------
+    local_cov : tf.tensor [n,k,k]
+        Σᵢ
+
+    Returns
+    -------
+    tf.tensor [n,k,k]
+        Rᵢ
+    """
+    if G.k == 1:
+        # Rᵢ = √Σᵢ
+        return tf.sqrt(local_cov)
+    if G.k == 2:
+        # Σᵢ = [[a,b],[b,c]], Rᵢ = [[√a, b/√a],[0, √(c-b²/a)]]
+        a, b, c = local_cov[:,0,0], local_cov[:,0,1], local_cov[:,1,1]
+        r_00 = tf.sqrt(a)
+        r_01 = b / r_00
+        r_11 = tf.sqrt(c - tf.square(r_01))
+        R = tf.stack([r_00, r_01, tf.zeros_like(a), r_11], axis = 1)
+        return tf.reshape(R, [-1,2,2])
+    local_std_T = tf.linalg.cholesky(local_cov)
+    return tf.transpose(local_std_T, perm=[0, 2, 1])
+
+def aux_compute_rho(G, A_array, local_r):
+    """
+    Compute ρ from r in the case we are using projected parameters.
+    """
+    # computed_rho = ρ* = ∑ᵢ Aᵢ·rᵢ = ∑ᵢ ρᵢ              of size [p]
+    if isinstance(A_array, BlockProjections):
+        return block_compute_rho(G, A_array, local_r)
+    if isinstance(A_array, tf.SparseTensor):
+        i, q, a, v = sparse_entries(A_array)
+        r = tf.gather_nd(local_r, tf.stack([i,a],1))
+        return tf.unsorted_segment_sum(v*r, q, G.p, name = 'computed_rho_l')
+    return tf.einsum('npk,nk->p', A_array, local_r, name = 'computed_rho_l')
+
 def aux_compute_beta(G, A_array, local_B):
     """
     Compute β from B in the case we are using projected parameters.
     """
+    if isinstance(A_array, tf.SparseTensor):
+        return sparse_compute_beta(G, A_array, local_B)
+    if isinstance(A_array, BlockProjections):
+        return block_compute_beta(G, A_array, local_B)
+
     #compute β
     # computed_beta = β = ∑ᵢ (Aᵢ^T)·Bᵢ·Aᵢ = ∑ᵢ βᵢ       of size [p,p]
     computed_beta_ = tf.einsum('ijk,ikl->ijl', A_array, local_B,
@@ -562,6 +870,257 @@ def aux_compute_beta(G, A_array, local_B):
                                 name = 'computed_beta')
     return computed_beta
 
+"""
+SPARSE PROJECTIONS
+"""
+#When the design matrix is sparse, the projections Aᵢ are given as a
+#tf.SparseTensor A_array of size [n,p,k]. Each stored entry (i,q,a) with value
+#v is used directly, so that the cost scales with the number of non zero
+#entries. A_flat denotes A_array seen as a [n·k,p] matrix, whose row i·k+a is
+#the column a of Aᵢ.
+
+def sparse_entries(A_array):
+    """
+    Return the coordinates (i,q,a) and the values v of the entries of A_array.
+    """
+    i, q, a = tf.unstack(A_array.indices, axis=1)
+    return i, q, a, A_array.values
+
+def sparse_flat(G, A_array):
+    """
+    Return A_flat, A_array seen as a tf.SparseTensor [n·k,p].
+    """
+    i, q, a, v = sparse_entries(A_array)
+    n = A_array.dense_shape[0]
+    indices = tf.stack([i*G.k+a, q], 1)
+    dense_shape = tf.stack([n*G.k, G.p])
+    return tf.sparse_reorder(tf.SparseTensor(indices, v, dense_shape))
+
+def sparse_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt):
+    """
+    Overload of ``aux_local_parameters`` for sparse projections.
+    """
+    k, p = G.k, G.p
+    n = tf.shape(A_array)[0]
+    i, q, a, v = sparse_entries(A_array)
+    A_flat = sparse_flat(G, A_array)
+
+    #local_mu[i,a] = ∑_q Aᵢ[q,a]·μ[q]                  of size [n,k]
+    local_mu = tf.unsorted_segment_sum(v*tf.gather(new_mu,q), i*k+a, n*k)
+    local_mu = tf.reshape(local_mu, [n,k], name = 'einsum_local_mu')
+
+    if not G.local_std_trick:
+        local_cov = None
+        # local_std = σᵢ = √Σ·Aᵢ                          of size [n,p,k]
+        S_A = tf.sparse_tensor_dense_matmul(A_flat, new_cov_sqrt,
+                                            adjoint_b=True)
+        local_std = tf.transpose(tf.reshape(S_A,[n,k,p]), perm=[0,2,1])
+    else:
+        #T[i·k+a] = Aᵢ[:,a]^T•Σ                             of size [n·k,p]
+        T = tf.sparse_tensor_dense_matmul(A_flat, new_cov)
+        #local_cov[i,a,b] = ∑_q T[i·k+a,q]·Aᵢ[q,b]          of size [n,k,k]
+        rows = tf.expand_dims(i*k,1) + tf.expand_dims(tf.range(k,
+                                                        dtype=tf.int64),0)
+        cols = tf.tile(tf.expand_dims(q,1),[1,k])
+        T_q = tf.gather_nd(T, tf.stack([rows,cols],2))
+        segments = rows*k + tf.expand_dims(a,1)
+        local_cov = tf.unsorted_segment_sum(
+                        tf.reshape(T_q*tf.expand_dims(v,1),[-1]),
+                        tf.reshape(segments,[-1]), n*k*k)
+        local_cov = tf.reshape(local_cov, [n,k,k])
+        local_std = local_cov_sqrt(G, local_cov)
+
+    return local_mu, local_std, local_cov
+
+def sparse_compute_beta(G, A_array, local_B):
+    """
+    Overload of ``aux_compute_beta`` for sparse projections.
+    """
+    k, p = G.k, G.p
+    n = tf.shape(A_array)[0]
+    i, q, a, v = sparse_entries(A_array)
+
+    #D[i·k+l,q] = ∑_a Bᵢ[l,a]·Aᵢ[q,a] = (Bᵢ•Aᵢ^T)[l,q]     of size [n·k,p]
+    B_a = tf.gather_nd(tf.transpose(local_B,[0,2,1]), tf.stack([i,a],1))
+    rows = tf.expand_dims(i*k,1) + tf.expand_dims(tf.range(k,
+                                                    dtype=tf.int64),0)
+    cols = tf.tile(tf.expand_dims(q,1),[1,k])
+    D = tf.scatter_nd(tf.reshape(tf.stack([rows,cols],2),[-1,2]),
+                      tf.reshape(B_a*tf.expand_dims(v,1),[-1]),
+                      tf.cast(tf.stack([n*k,p]),tf.int64))
+
+    if not G.diag_cov:
+        # computed_beta = β = ∑ᵢ (Aᵢ^T)·Bᵢ·Aᵢ = A_flat^T•D      of size [p,p]
+        A_flat = sparse_flat(G, A_array)
+        return tf.sparse_tensor_dense_matmul(A_flat, D, adjoint_a=True,
+                                             name = 'computed_beta')
+    else:
+        # computed_beta[q] = ∑ᵢ,ₐ Aᵢ[q,a]·D[i·k+a,q]           of size [p]
+        D_q = tf.gather_nd(D, tf.stack([i*k+a,q],1))
+        return tf.unsorted_segment_sum(v*D_q, q, p, name = 'computed_beta')
+
+"""
+STRUCTURED PROJECTIONS
+"""
+#For the multilogit and LM models, Aᵢ is made of k copies of xᵢ on its block
+#diagonal : Aᵢ[a·d+j,a] = xᵢⱼ, so that Aᵢ·θ = Θ^T•xᵢ with Θ[j,a] = θ[a·d+j].
+#Such projections are given as a ``BlockProjections`` and stay implicit : μᵢ,
+#σᵢ, ρ and β are computed from X, in O(n·d·k) per column of Σ or of B instead
+#of O(n·d·k²) with the [n,p,k] A_array.
+
+class BlockProjections:
+    """
+    The ``BlockProjections`` class
+    ==============================
+    The projections Aᵢ[a·d+j,a] = xᵢⱼ of size [p,k] with p = d·k, kept as the
+    design matrix X. With k = 1, Aᵢ is xᵢ as a column, as for the LM model.
+
+    Parameters
+    ----------
+    X : tf.tensor or tf.SparseTensor [n,d]
+        The design matrix.
+    k : int
+        The number of blocks.
+    """
+    def __init__(self, X, k):
+        self.X = X
+        self.k = k
+
+def block_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt):
+    """
+    Overload of ``aux_local_parameters`` for block projections.
+    """
+    from .predefined_functions_aux import X_matmul, X_row_pairs
+    X, k, p = A_array.X, A_array.k, G.p
+    d = p // k
+
+    # local_mu[i,a] = ∑ⱼ xᵢⱼ·μ[a·d+j]                    of size [n,k]
+    M = tf.transpose(tf.reshape(new_mu, [k,d]))
+    local_mu = tf.identity(X_matmul(X, M), name = 'einsum_local_mu')
+
+    if not G.local_std_trick:
+        local_cov = None
+        # local_std[i,q,a] = ∑ⱼ √Σ[q,a·d+j]·xᵢⱼ            of size [n,p,k]
+        S = tf.transpose(tf.reshape(new_cov_sqrt, [p,k,d]), perm=[2,0,1])
+        local_std = tf.reshape(X_matmul(X, tf.reshape(S, [d,p*k])), [-1,p,k],
+                               name = 'einsum_std_trick')
+    else:
+        #C[j,a,b,l] = Σ[a·d+j,b·d+l]                        of size [d,k,k,d]
+        C = tf.transpose(tf.reshape(new_cov, [k,d,k,d]), perm=[1,0,2,3])
+        #local_cov[i,a,b] = ∑ⱼ,ₗ xᵢⱼ·C[j,a,b,l]·xᵢₗ          of size [n,k,k]
+        #one block row a at a time, so that at most [n,k,d] is held
+        if isinstance(X, tf.SparseTensor):
+            #summed over the pairs of non zero entries of each row
+            rows, cols_1, cols_2, values = X_row_pairs(X)
+            pairs = cols_1*d + cols_2
+        def block_row(a):
+            C_a = C[:,a]
+            if isinstance(X, tf.SparseTensor):
+                C_pairs = tf.reshape(tf.transpose(C_a, perm=[0,2,1]), [d*d,k])
+                C_pairs = tf.gather(C_pairs, pairs)
+                return tf.unsorted_segment_sum(
+                    C_pairs * tf.expand_dims(values, 1), rows,
+                    X.dense_shape[0])
+            # X_C[i,b,l] = ∑ⱼ xᵢⱼ·C[j,a,b,l]                    of size [n,k,d]
+            X_C = tf.reshape(X_matmul(X, tf.reshape(C_a, [d,k*d])), [-1,k,d])
+            return tf.einsum('nbl,nl->nb', X_C, X)
+        local_cov = tf.map_fn(block_row, tf.range(k), dtype=tf.float32,
+                              parallel_iterations=1)
+        local_cov = tf.transpose(local_cov, perm=[1,0,2])
+        local_std = local_cov_sqrt(G, local_cov)
+
+    return local_mu, local_std, local_cov
+
+def block_compute_rho(G, A_array, local_r):
+    """
+    Overload of ``aux_compute_rho`` for block projections.
+    """
+    from .predefined_functions_aux import X_transpose_matmul
+    # computed_rho[a·d+j] = ∑ᵢ xᵢⱼ·rᵢₐ = (X^T•r)[j,a]      of size [p]
+    X_r = X_transpose_matmul(A_array.X, local_r)
+    return tf.reshape(tf.transpose(X_r), [G.p], name = 'computed_rho_l')
+
+def block_compute_beta(G, A_array, local_B):
+    """
+    Overload of ``aux_compute_beta`` for block projections.
+    """
+    from .predefined_functions_aux import X_transpose_matmul, X_weighted_grams
+    X, k, p = A_array.X, A_array.k, G.p
+    d = p // k
+
+    if not G.diag_cov:
+        # computed_beta[a·d+j,b·d+l] = ∑ᵢ xᵢⱼ·Bᵢ[a,b]·xᵢₗ      of size [p,p]
+        grams = X_weighted_grams(X, tf.reshape(local_B, [-1,k*k]))
+        grams = tf.transpose(tf.reshape(grams, [k,k,d,d]), perm=[0,2,1,3])
+        return tf.reshape(grams, [p,p], name = 'computed_beta')
+    else:
+        # computed_beta[a·d+j] = ∑ᵢ xᵢⱼ²·Bᵢ[a,a]                of size [p]
+        if isinstance(X, tf.SparseTensor):
+            X_2 = tf.SparseTensor(X.indices, tf.square(X.values),
+                                  X.dense_shape)
+        else:
+            X_2 = tf.square(X)
+        X_B = X_transpose_matmul(X_2, tf.linalg.diag_part(local_B))
+        return tf.reshape(tf.transpose(X_B), [p], name = 'computed_beta')
+
+def candidate_parameters(G, mu, cov, beta, rho, step_size, new_cov_sqrt):
+    """
+    Describes the computation of the candidates μ and Σ of the next iteration
+    from the current μ, Σ, β, ρ and step size.
+
+    Returns
+    -------
+    new_cov : tf.tensor [p,p]
+        The Σ candidate.
+    new_cov_sqrt : tf.tensor [p,p]
+        Its square root.
+    new_logdet : tf.tensor []
+        The log determinant of the Σ candidate.
+    new_mu : tf.tensor [p]
+        The μ candidate.
+    gamma : tf.tensor []
+        The step size γ used for Σ.
+    """
+    p = G.p
+    if G.comp_opt == "cholesky":
+        beta_chol = tf.linalg.cholesky(beta)
+        beta_sqrt = tf.transpose(beta_chol)
+        #beta_inv = tf.linalg.inv(beta)
+        #beta_inv_sqrt = tf.linalg.inv(beta_sqrt)
+        beta_inv = tf.transpose(tf.cholesky_solve(beta_chol, tf.eye(p)))
+        beta_inv_sqrt = matrix_sqrt(beta_inv)
+    elif G.comp_opt=="svd":
+        s_beta, u_beta, v_beta = tf.linalg.svd(beta)
+        s_beta_sqrt = tf.linalg.diag(tf.sqrt(s_beta))
+        s_beta_inv = tf.linalg.diag(tf.reciprocal(s_beta))
+        s_beta_inv_sqrt = tf.linalg.diag(tf.reciprocal(tf.sqrt(s_beta)))
+        
+        beta_sqrt = tf.matmul(u_beta, tf.matmul(s_beta_sqrt, v_beta, adjoint_b=True))
+        beta_inv = tf.matmul(u_beta, tf.matmul(s_beta_inv, v_beta, adjoint_b=True))
+        beta_inv_sqrt = tf.matmul(u_beta, tf.matmul(s_beta_inv_sqrt, v_beta, adjoint_b=True))
+
+    #from definition of Σₘ
+    cov_max = beta_inv
+    cov_max_inv = beta
+    cov_max_sqrt = beta_inv_sqrt
+
+    if not G.compute_gamma:
+        gamma = step_size
+    else:
+        #compute
+        #K⁻¹=Σ^½•β•Σ^½
+        K_inv = new_cov_sqrt @ beta @ new_cov_sqrt
+        K_inv_sqrt = tf.linalg.cholesky(K_inv)
+        K_eig = tf.math.reciprocal(tf.linalg.diag_part(K_inv))
+        eig_limitation = 0.5
+        K_eigmin = tf.reduce_min(K_eig)
+        gamma = (eig_limitation - 1)/(K_eigmin -1)
+    #backtracking
+    pars = [cov_max_inv,new_cov_sqrt]
+    new_cov_, new_cov_sqrt_, new_logdet_ = compute_new_cov_and_co(G,gamma,cov,cov_max,*pars)
+    new_mu_  = mu - step_size * tf.einsum('ij,j->i', beta_inv, rho)
+    return new_cov_, new_cov_sqrt_, new_logdet_, new_mu_, gamma
+
 def compute_new_cov_and_co(G,gamma,cov, cov_max,
                     cov_max_inv,
                     new_cov_sqrt):
@@ -608,3 +1167,151 @@ def Sym(Ms):
     Apply the "Sym" operation to a set of square matrices.
     """
     return tf.map_fn(sym, Ms,  dtype=tf.float32)
+
+"""
+IN-GRAPH LOOP
+"""
+
+def in_graph_loop(G, X, Y, A_array, mu, cov, beta, rho, e, ELBO, step_size,
+                  new_cov_sqrt, status):
+    """
+    Describes n_iter iterations of the Bullseye algorithm inside a
+    tf.while_loop, for data kept in memory. n_iter is fed through the
+    "n_iter" placeholder. At the end of the loop, the variables are set to
+    the reached μ, Σ, β, ρ, e, ELBO, step size and status.
+
+    Returns
+    -------
+    list of tf.tensor
+        The traces of the iterations : the new ELBOs [n_iter], the best ELBOs
+        [n_iter], whether the iterations were accepted [n_iter], the step
+        sizes [n_iter] and, if G.trace_mu, the μ's [n_iter,p] after each
+        iteration.
+    """
+    n_iter = tf.placeholder(tf.int32, [], name = "n_iter")
+    H_constant = G.d * 0.5 * np.log(2*np.pi*np.e)
+    #the square root of Σ is only kept if it is needed, see ``Graph.build``
+    keep_sqrt = new_cov_sqrt is not None
+    cov_sqrt = new_cov_sqrt if keep_sqrt else tf.eye(G.p)
+
+    traces = [tf.TensorArray(tf.float32, size = n_iter),
+              tf.TensorArray(tf.float32, size = n_iter),
+              tf.TensorArray(tf.bool, size = n_iter),
+              tf.TensorArray(tf.float32, size = n_iter)]
+    if G.trace_mu:
+        traces.append(tf.TensorArray(tf.float32, size = n_iter))
+
+    def body(t, mu, cov, beta, rho, e, ELBO, step_size, cov_sqrt, accepted,
+             *traces):
+        with jit_scope(G):
+            new_cov, new_cov_sqrt, new_logdet, new_mu, _ = \
+                candidate_parameters(G, mu, cov, beta, rho, step_size,
+                                     cov_sqrt if keep_sqrt else None)
+            if not keep_sqrt:
+                new_cov_sqrt = None
+            targs = [new_mu, new_cov, new_cov_sqrt]
+            e_l, rho_l, beta_l = likelihood_triplet(G, X, Y, *targs,
+                                                    A_array = A_array)
+            e_p, rho_p, beta_p = prior_triplet(G, *targs)
+        new_e, new_rho, new_beta = e_l + e_p, rho_l + rho_p, beta_l + beta_p
+        new_ELBO = - new_e + 0.5 * new_logdet + H_constant
+
+        if G.brutal_iteration:
+            accepted = tf.constant(True)
+        else:
+            accepted = new_ELBO > ELBO
+        keep = lambda new, old : tf.where(accepted, new, old)
+        mu, cov = keep(new_mu, mu), keep(new_cov, cov)
+        beta, rho, e = keep(new_beta, beta), keep(new_rho, rho), keep(new_e, e)
+        ELBO = keep(new_ELBO, ELBO)
+        step_size = keep(tf.constant(G.speed, tf.float32),
+                         step_size * G.step_size)
+        if keep_sqrt:
+            cov_sqrt = new_cov_sqrt
+
+        values = [new_ELBO, ELBO, accepted, step_size]
+        if G.trace_mu:
+            values.append(mu)
+        traces = [ta.write(t, v) for (ta, v) in zip(traces, values)]
+        return [t+1, mu, cov, beta, rho, e, ELBO, step_size, cov_sqrt,
+                accepted] + traces
+
+    state = [mu, cov, beta, rho, e, ELBO, step_size, cov_sqrt]
+    loop_vars = [tf.constant(0)] + [tf.convert_to_tensor(v) for v in state]\
+                + [tf.constant(False)] + traces
+    results = tf.while_loop(lambda t, *_ : t < n_iter, body, loop_vars)
+
+    #set the variables to the reached state
+    variables = [mu, cov, beta, rho, e, ELBO, step_size]
+    if keep_sqrt:
+        variables.append(new_cov_sqrt)
+    assigns = [tf.assign(v, r) for (v, r) in zip(variables, results[1:])]
+    assigns.append(tf.assign(status, tf.where(results[9], "accepted",
+                                              "refused")))
+    with tf.control_dependencies(assigns):
+        return [tf.identity(ta.stack()) for ta in results[10:]]
+
+"""
+CHUNK STORAGE
+"""
+#When chunk_as_sum is False, the βᵢ of the M chunks are kept in one stacked
+#variable, in the form given by the chunk_beta_form option :
+#   -"full" : βᵢ as it is, of size [p,p],
+#   -"packed" : the upper triangle of βᵢ, of size [p(p+1)/2],
+#   -"low_rank" : βᵢ ≈ Uᵢ·diag(λᵢ)·Uᵢᵀ keeping the chunk_beta_rank
+#    eigenvalues of largest magnitude, Uᵢ [p,r] and λᵢ [r] stacked in a
+#    [p+1,r] array.
+#With diag_cov, βᵢ is diagonal : only its diagonal is kept, of size [p],
+#whatever the form.
+
+def chunk_beta_shape(G):
+    """
+    Size of the stored form of one βᵢ.
+    """
+    p = G.p
+    if G.diag_cov:
+        return [p]
+    if G.chunk_beta_form == "full":
+        return [p,p]
+    elif G.chunk_beta_form == "packed":
+        return [p*(p+1)//2]
+    elif G.chunk_beta_form == "low_rank":
+        assert 0 < G.chunk_beta_rank <= p
+        return [p+1, G.chunk_beta_rank]
+    raise ValueError("Unknown chunk_beta_form : {}".format(G.chunk_beta_form))
+
+def pack_chunk_beta(G, beta):
+    """
+    Stored form of a given βᵢ, see ``chunk_beta_shape``.
+    """
+    if G.diag_cov:
+        return tf.linalg.diag_part(beta)
+    if G.chunk_beta_form == "full":
+        return beta
+    elif G.chunk_beta_form == "packed":
+        return tf.gather_nd(beta, np.stack(np.triu_indices(G.p), axis = 1))
+    #low rank : keep the eigenvalues of largest magnitude
+    eigenvalues, eigenvectors = tf.self_adjoint_eig(beta)
+    _, kept = tf.nn.top_k(tf.abs(eigenvalues), k = G.chunk_beta_rank)
+    U = tf.gather(eigenvectors, kept, axis = 1)
+    lambdas = tf.gather(eigenvalues, kept)
+    return tf.concat([U, tf.expand_dims(lambdas,0)], axis = 0)
+
+def sum_chunk_betas(G, beta_tab):
+    """
+    ∑ᵢ βᵢ of size [p,p], given the stacked stored forms of the βᵢ.
+    """
+    p = G.p
+    if G.diag_cov:
+        return tf.linalg.diag(tf.reduce_sum(beta_tab, axis = 0))
+    if G.chunk_beta_form == "full":
+        return tf.reduce_sum(beta_tab, axis = 0)
+    elif G.chunk_beta_form == "packed":
+        #the sum is linear : sum the triangles, then unpack once
+        upper = tf.scatter_nd(np.stack(np.triu_indices(p), axis = 1),
+                              tf.reduce_sum(beta_tab, axis = 0), [p,p])
+        return upper + tf.transpose(upper) - tf.diag(tf.diag_part(upper))
+    #low rank : ∑ᵢ Uᵢ·diag(λᵢ)·Uᵢᵀ
+    U = beta_tab[:,:p,:]
+    lambdas = beta_tab[:,p,:]
+    return tf.einsum('mpr,mr,mqr->pq', U, lambdas, U)
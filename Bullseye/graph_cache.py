@@ -0,0 +1,238 @@
+"""
+The ``graph_cache`` module
+==========================
+
+Contains the tools used to keep the implicit tensorflow graphs built by
+``Graph.build`` on disk, as MetaGraphs, so that an identical configuration
+built in another process is loaded instead of being traced again. In
+particular, contains :
+    -the ``graph_signature`` function, hashing everything the construction
+     of the graph depends on,
+    -the ``save_graph`` and ``load_graph`` functions, writing and reading a
+     MetaGraph along with the names of the operations of ``ops_dict``.
+"""
+
+import tensorflow.compat.v1 as tf
+import numpy as np
+import hashlib
+import inspect
+import json
+import glob
+import os
+
+#attributes of the Bullseye.Graph read by ``construct_bullseye_graph``
+graph_attrs = ["d","k","p","m","M","n_chunks","to_one_hot","sparse",
+               "file_format","use_projs","prior_iid","batched_Psi"]
+#model functions of the Bullseye.Graph
+graph_functions = ["Psi","grad_Psi","hess_Psi","weighted_hess_Psi",
+                   "Phi","grad_Phi","hess_Phi","Proj","Pi","grad_Pi","hess_Pi"]
+#options that do not change the graph
+ignored_options = ["graph_cache"]
+#suffixes of the files of a cached graph
+meta_suffix = ".meta"
+names_suffix = ".json"
+
+def function_signature(f, seen = ()):
+    """
+    Describe a function by its source code, the values of its closure and the
+    globals it references, so that lambdas specialized to different
+    parameters are told apart. Functions whose source cannot be read, such as
+    the ones defined through ``exec`` or in an interpreter, are described by
+    their code object instead of their name.
+    """
+    if f is None:
+        return None
+    code = getattr(f, "__code__", None)
+    #builtins, ufuncs and classes
+    if code is None:
+        return [getattr(f, "__module__", None),
+                getattr(f, "__qualname__", type(f).__qualname__)]
+    #recursive functions
+    if id(f) in seen:
+        return getattr(f, "__qualname__", None)
+    seen = seen + (id(f),)
+    try:
+        source = inspect.getsource(f)
+    except (OSError, TypeError):
+        source = code_signature(code)
+    closure = getattr(f, "__closure__", None) or []
+    cells = [reference_signature(cell.cell_contents, seen)
+             for cell in closure]
+    f_globals = getattr(f, "__globals__", {})
+    references = {name : reference_signature(f_globals[name], seen)
+                  for name in global_names(code) if name in f_globals}
+    return [source, cells, references]
+
+def code_signature(code):
+    """
+    Describe a code object by its bytecode, its constants, nested code
+    objects included, and the names it uses.
+    """
+    consts = [code_signature(c) if inspect.iscode(c) else repr(c)
+              for c in code.co_consts]
+    return [hashlib.sha256(code.co_code).hexdigest(), consts,
+            list(code.co_names), list(code.co_varnames)]
+
+def global_names(code):
+    """
+    Names a code object and its nested code objects may read from the
+    globals.
+    """
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if inspect.iscode(c):
+            names.update(global_names(c))
+    return sorted(names)
+
+def reference_signature(value, seen):
+    """
+    Describe a value referenced by a function, modules by their name.
+    """
+    if inspect.ismodule(value):
+        return ["module", value.__name__]
+    if callable(value):
+        return function_signature(value, seen)
+    return value_signature(value)
+
+def value_signature(value):
+    """
+    Describe a value, arrays by their shape and content.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [value_signature(v) for v in value]
+    array = np.asarray(value)
+    if array.dtype == object:
+        return repr(value)
+    return [list(array.shape), str(array.dtype),
+            hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()]
+
+def graph_signature(G):
+    """
+    Hash everything the construction of the implicit tensorflow graph of a
+    Bullseye.Graph depends on : the model functions, the dimensions, the
+    options, the initial parameters embedded in the graph, the way the data is
+    fed and the source code of the package itself.
+
+    The functions computed by automatic differentiation close over the
+    Bullseye.Graph itself : they are described by the function they
+    differentiate, the compute_grad and compute_hess options and batched_Psi
+    being hashed along.
+
+    Parameters
+    ----------
+    G : Bullseye.Graph
+        Graph whose implicit tensorflow graph is considered.
+
+    Returns
+    -------
+    str
+        The hexadecimal sha256 digest.
+    """
+    description = {
+        "attrs" : {a : value_signature(getattr(G, a)) for a in graph_attrs},
+        "functions" : {f : ["derived from", G.derived_functions[f]]
+                                if f in G.derived_functions
+                                else function_signature(getattr(G, f))
+                       for f in graph_functions},
+        "options" : {o : value_signature(getattr(G, o))
+                     for o in G.option_list if o not in ignored_options},
+        "init" : [value_signature(G.mu_0), value_signature(G.cov_0)],
+        "data" : {"X" : None if G.X is None else list(G.X.shape),
+                  #the placeholders of a sparse X have nnz rows
+                  "nnz" : G.X.nnz if G.X is not None and G.sparse else None,
+                  "Y" : None if G.Y is None else list(G.Y.shape),
+                  "files" : G.files,
+                  "store" : G.store is not None},
+        "tensorflow" : tf.__version__
+        }
+    h = hashlib.sha256(json.dumps(description, sort_keys = True,
+                                  default = repr).encode('utf-8'))
+    #the graph also depends on the code building it
+    cwd = os.path.dirname(os.path.realpath(__file__))
+    for source in sorted(glob.glob(os.path.join(cwd, "*.py"))):
+        with open(source, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def encode_names(value):
+    """
+    Replace the tensors, operations and variables of ``ops_dict`` by their
+    names, recursively. Variables are replaced by the tensor reading their
+    value, the name of a resource variable being the one of its handle : it
+    is created in the graph, which must be the default one.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [encode_names(v) for v in value]
+    if isinstance(value, tf.SparseTensor):
+        return {"sparse" : [value.indices.name, value.values.name,
+                            value.dense_shape.name]}
+    #the base class of the reference, resource and assigned variables
+    if isinstance(value, tf.compat.v2.Variable):
+        return {"tensor" : value.value().name}
+    if isinstance(value, tf.Tensor):
+        return {"tensor" : value.name}
+    if isinstance(value, tf.Operation):
+        return {"operation" : value.name}
+    #tf.data iterators are only reinitialized through their initializer
+    return {"operation" : value.initializer.name}
+
+def decode_names(graph, value):
+    """
+    Inverse of ``encode_names`` within a given graph.
+    """
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [decode_names(graph, v) for v in value]
+    if "sparse" in value:
+        indices, values, dense_shape = [graph.get_tensor_by_name(name)
+                                        for name in value["sparse"]]
+        return tf.SparseTensor(indices, values, dense_shape)
+    if "tensor" in value:
+        return graph.get_tensor_by_name(value["tensor"])
+    return graph.get_operation_by_name(value["operation"])
+
+def save_graph(path, graph, ops_dict):
+    """
+    Write a graph as a MetaGraph at ``path``.meta and the names of the
+    operations of ``ops_dict`` at ``path``.json.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    #the tensors reading the variables are exported along, the graph being
+    #the default one even when eager execution is enabled
+    with graph.as_default():
+        names = {key : encode_names(value)
+                 for (key, value) in ops_dict.items()}
+        tf.train.export_meta_graph(filename = path + meta_suffix,
+                                   graph = graph, clear_devices = True)
+    #write the names last : a graph is cached once they exist
+    with open(path + names_suffix + ".tmp", "w", encoding = 'utf-8') as f:
+        json.dump(names, f)
+    os.replace(path + names_suffix + ".tmp", path + names_suffix)
+
+def load_graph(path):
+    """
+    Read a graph written by ``save_graph``, or return None if there is none.
+
+    Returns
+    -------
+    graph : tf.graph
+        The loaded tensorflow graph.
+    ops_dict : dict
+        The operations of the graph, as returned by
+        ``construct_bullseye_graph``.
+    """
+    if not os.path.isfile(path + names_suffix):
+        return None
+    with open(path + names_suffix, "r", encoding = 'utf-8') as f:
+        names = json.load(f)
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.train.import_meta_graph(path + meta_suffix)
+    ops_dict = {key : decode_names(graph, value)
+                for (key, value) in names.items()}
+    return graph, ops_dict
@@ -0,0 +1,37 @@
+"""
+    The ``lazy_import`` module
+    ==========================
+
+    Contains the ``LazyModule`` class, standing for a module that is only
+    imported when one of its attributes is first used. In particular,
+    ``tf`` stands for the tensorflow 1.x API, ``tensorflow.compat.v1``, so
+    that the parts of Bullseye that do not need it, e.g. the numpy backend,
+    start without importing it.
+"""
+
+import importlib
+import types
+
+class LazyModule(types.ModuleType):
+    """
+    The ``LazyModule`` class
+    ========================
+    Module imported at the first access to one of its attributes.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__module = None
+
+    def __load(self):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name__)
+        return self.__module
+
+    def __getattr__(self, attr):
+        #only called for the attributes that are not already set
+        return getattr(self.__load(), attr)
+
+    def __dir__(self):
+        return dir(self.__load())
+
+tf = LazyModule("tensorflow.compat.v1")
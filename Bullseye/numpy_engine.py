@@ -0,0 +1,408 @@
+"""
+The ``numpy_engine`` module
+===========================
+
+Contains the ``NumpyEngine`` class, an execution backend of the
+Bullseye.Graph written with numpy and scipy only, so that neither tensorflow
+nor its graph construction is needed. It is selected with
+``Graph.set_options(backend = "numpy")`` and suits problems small enough for
+the whole data to be kept in memory.
+
+Its functions mirror the ones of the ``graph_aux`` module :
+    -``likelihood_triplet`` and its overloads, computing e, ρ and β,
+    -``prior_triplet``, computing e, ρ and β for the prior,
+    -``candidate_parameters`` and ``compute_new_cov_and_co``, computing the
+     candidates μ and Σ of the next iteration.
+"""
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+
+from .sampling import generate_sampling
+from .graph_aux import micro_batch_rows, uses_cov_sqrt
+from .warning_handler import warn
+
+class NumpyEngine:
+    """
+    The ``NumpyEngine`` class
+    =========================
+    Holds the state of the Bullseye algorithm in numpy arrays and performs
+    its iterations with the functions of this module.
+
+    Only data kept in memory is supported : X and Y are given to
+    ``Graph.feed_with`` or to ``Graph.run``, see ``set_data``. The model and
+    the prior must be predefined ones, see the ``predefined_functions_numpy``
+    module.
+
+    The samples are drawn by a ``np.random.Generator`` seeded with the
+    ``seed`` option when the variables are initialized, so that two runs
+    with the same seed give the same results.
+    """
+    def __init__(self, G):
+        """
+        Compute the projections of the data and the initial state of a
+        Bullseye.Graph.
+        """
+        assert G.predefined_model is not None \
+            and G.predefined_prior is not None
+
+        self.G = G
+        p = G.p
+
+        #the data, given later to ``Graph.run`` if it is not in the graph
+        self.data = None
+        if G.X is not None:
+            self.set_data(G.X, G.Y)
+
+        #μ, Σ and ELBO related
+        if G.diag_cov:
+            G.cov_0 = np.einsum('ij,ij->ij',G.cov_0,
+                                np.eye(*list(G.cov_0.shape)))
+        self.initial_values = {
+            "mu" : G.mu_0,
+            "cov" : G.cov_0,
+            "elbo" : -np.inf,
+            "e" : 0.,
+            "rho" : np.zeros(p),
+            "beta" : np.linalg.inv(G.cov_0),
+            "step_size" : G.speed,
+            "cov_sqrt" : np.eye(p)
+            }
+        self.keep_sqrt = uses_cov_sqrt(G)
+        self.initialize()
+
+    def set_data(self, X, Y):
+        """
+        Set the data and its projections, computed once. A sparse X is
+        converted into a dense array.
+        """
+        G = self.G
+        self.data = (X, Y)
+        if scipy.sparse.issparse(X):
+            warn("The numpy backend works with a dense copy of the sparse X,"
+                 " of {:.1f} MB".format(8 * np.prod(X.shape) / 2**20))
+            X = X.toarray()
+        self.X = np.asarray(X, dtype = np.float64)
+        self.Y = np.asarray(Y, dtype = np.float64)
+        self.A_array = G.Proj(self.X, G.k) if G.use_projs else None
+
+    def initialize(self):
+        """
+        Set μ, Σ and the other variables back to their initial values.
+        """
+        self.variables = {name : np.array(value, dtype = np.float64)
+                          for (name, value) in self.initial_values.items()}
+        self.status = ""
+        self.rng = np.random.default_rng(self.G.seed)
+
+    def iteration(self):
+        """
+        One iteration of the Bullseye algorithm.
+
+        Returns
+        -------
+        status : str
+            "accepted" or "refused".
+        new_ELBO : float
+            The ELBO of the candidate.
+        ELBO : float
+            The best ELBO.
+        """
+        G = self.G
+        v = self.variables
+        cov_sqrt = v["cov_sqrt"] if self.keep_sqrt else None
+
+        #candidates
+        new_cov, new_cov_sqrt, new_logdet, new_mu, _ = \
+            candidate_parameters(G, v["mu"], v["cov"], v["beta"],
+                                 v["rho"], v["step_size"], cov_sqrt)
+        targs = [new_mu, new_cov, new_cov_sqrt]
+        e_l, rho_l, beta_l = likelihood_triplet(G, self.X, self.Y, *targs,
+                                                A_array = self.A_array,
+                                                rng = self.rng)
+        e_p, rho_p, beta_p = prior_triplet(G, *targs, rng = self.rng)
+        if self.keep_sqrt:
+            v["cov_sqrt"] = new_cov_sqrt
+
+        new_e = e_l + e_p
+        H = 0.5 * new_logdet + G.d * 0.5 * np.log(2*np.pi*np.e)
+        new_ELBO = - new_e + H
+
+        if G.brutal_iteration or new_ELBO > v["elbo"]:
+            v["e"] = new_e
+            v["rho"] = rho_l + rho_p
+            v["beta"] = beta_l + beta_p
+            v["cov"] = new_cov
+            v["mu"] = new_mu
+            v["elbo"] = np.asarray(new_ELBO)
+            v["step_size"] = np.asarray(G.speed, dtype = np.float64)
+            self.status = "accepted"
+        else:
+            v["step_size"] = v["step_size"] * G.step_size
+            self.status = "refused"
+        return self.status, new_ELBO, v["elbo"][()]
+
+    def values(self, *names):
+        """
+        Current values of the given variables.
+        """
+        return [self.variables[name] for name in names]
+
+"""
+TRIPLETS
+"""
+
+def likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt,A_array=None,
+                       rng=np.random):
+    """
+    Compute e, ρ and β of the likelihood, see ``graph_aux``, the samples
+    being drawn by ``rng``.
+
+    Returns
+    -------
+    e : float
+    rho : np.array [p]
+    beta : np.array [p,p]
+    """
+    pars = [G,X,Y,new_mu,new_cov,new_cov_sqrt]
+
+    if G.use_projs :
+        return proj_likelihood_triplet(*pars, A_array = A_array, rng = rng)
+    else:
+        return brutal_likelihood_triplet(*pars, rng = rng)
+
+def brutal_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt,
+                              rng=np.random):
+    """
+    Overload function of ``likelihood_triplet`` without projections.
+    """
+    z, z_weights = generate_sampling(G.s, G.p, rng)
+
+    # thetas[j] = θⱼ = μ+√Σ·zⱼ                           of size [s,p]
+    thetas = new_mu[None,:] + z @ new_cov_sqrt
+
+    psi = G.Psi(X,Y,thetas)
+    grad_psi = G.grad_Psi(X,Y,thetas)
+
+    computed_e = z_weights @ psi
+    computed_rho = z_weights @ grad_psi
+    if G.weighted_hess_Psi is not None:
+        #without the hessian of each θⱼ
+        computed_beta = G.weighted_hess_Psi(X,Y,thetas,z_weights)
+        if G.diag_cov:
+            computed_beta = np.diag(computed_beta)
+    elif not G.diag_cov:
+        computed_beta = np.einsum('s,skj->kj', z_weights,
+                                  G.hess_Psi(X,Y,thetas))
+    else:
+        computed_beta = np.einsum('s,skk->k', z_weights,
+                                  G.hess_Psi(X,Y,thetas))
+
+    return relocalize(computed_e, computed_rho, computed_beta, G.diag_cov)
+
+def proj_likelihood_triplet(G,X,Y,new_mu,new_cov,new_cov_sqrt,A_array=None,
+                            rng=np.random):
+    """
+    Overload function of ``likelihood_triplet`` with projections.
+    """
+    if A_array is None:
+        A_array = G.Proj(X, G.k)
+
+    l = G.p if not G.local_std_trick else G.k
+    z, z_weights = generate_sampling(G.s, l, rng)
+
+    #the rows are processed all at once, or by sub-batches whose e, ρ and β
+    #are accumulated
+    pars = [new_mu, new_cov, new_cov_sqrt, z, z_weights]
+    rows = micro_batch_rows(G)
+    if rows is None:
+        computed = proj_rows_triplet(G, Y, A_array, *pars)
+    else:
+        computed = [0., 0., 0.]
+        for i in range(0, Y.shape[0], rows):
+            batch = proj_rows_triplet(G, Y[i:i+rows], A_array[i:i+rows],
+                                      *pars)
+            computed = [c + b for (c, b) in zip(computed, batch)]
+    computed_e, computed_rho, computed_beta = computed
+
+    return relocalize(computed_e, computed_rho, computed_beta, G.diag_cov)
+
+def proj_rows_triplet(G,Y,A_array,new_mu,new_cov,new_cov_sqrt,z,z_weights):
+    """
+    Compute e, ρ and β of the rows of Y and A_array, for the sample z, before
+    ``relocalize``.
+    """
+    local_mu, local_std = aux_local_parameters(G, A_array, new_mu, new_cov,
+                                               new_cov_sqrt)
+
+    # Activations[j,i] = Aᵢθⱼ = μᵢ+√Σᵢzⱼ               of size [s,n,k]
+    if G.local_std_trick and G.k <= 2:
+        # Activations[j,i] = μᵢ + ∑ₐ zⱼₐ·√Σᵢ[a]
+        Activations = local_mu[None]
+        for a in range(G.k):
+            Activations = Activations + z[:,a,None,None] * local_std[None,:,a]
+    else:
+        Activations = local_mu[None] + np.einsum('npk,sp->snk', local_std, z)
+
+    phi = G.Phi(Activations, Y)
+    grad_phi = G.grad_Phi(Activations, Y)
+    hess_phi = G.hess_Phi(Activations, Y)
+
+    # local_e[i] = eᵢ, local_r[i] = rᵢ, local_B[i] = Bᵢ
+    local_e = z_weights @ phi
+    local_r = np.einsum('s,snk->nk', z_weights, grad_phi)
+    local_B = np.einsum('s,snkj->nkj', z_weights, hess_phi)
+
+    # e* = ∑ᵢ eᵢ, ρ* = ∑ᵢ Aᵢ·rᵢ, β = ∑ᵢ (Aᵢ^T)·Bᵢ·Aᵢ
+    computed_e = np.sum(local_e)
+    computed_rho = np.einsum('npk,nk->p', A_array, local_r)
+    computed_beta_ = np.einsum('ijk,ikl->ijl', A_array, local_B)
+    if not G.diag_cov:
+        computed_beta = np.einsum('ijl,iml->jm', computed_beta_, A_array)
+    else:
+        computed_beta = np.einsum('ijl,ijl->j', computed_beta_, A_array)
+
+    return computed_e, computed_rho, computed_beta
+
+def prior_triplet(G,new_mu,new_cov,new_cov_sqrt,rng=np.random):
+    """
+    Compute e, ρ and β of the prior, see ``graph_aux``, the samples being
+    drawn by ``rng``.
+    """
+    l = G.p if not G.prior_iid else 1
+    z, z_weights = generate_sampling(G.s, l, rng)
+
+    if not G.prior_iid:
+        # thetas[j] = θⱼ = μ+√Σ·zⱼ                       of size [s,p]
+        thetas = new_mu[None,:] + z @ new_cov_sqrt
+    else:
+        # thetas[i][j] = θᵢⱼ = μⱼ+zᵢ•√Σⱼⱼ                of size [s,p]
+        thetas = new_mu[None,:] + np.sqrt(np.diag(new_cov))[None,:] * z
+
+    pi = G.Pi(thetas)
+    grad_pi = G.grad_Pi(thetas)
+    hess_pi = G.hess_Pi(thetas)
+
+    computed_e = z_weights @ pi
+    computed_rho = z_weights @ grad_pi
+    if not G.prior_iid:
+        computed_beta = np.einsum('s,skj->kj', z_weights, hess_pi)
+    else:
+        computed_beta = np.einsum('s,skk->k', z_weights, hess_pi)
+
+    return relocalize(computed_e, computed_rho, computed_beta, G.prior_iid)
+
+"""
+AUXILLIARY FUNCTIONS
+"""
+
+def relocalize(e, rho, beta, beta_diag=False):
+    if not beta_diag:
+        return e, rho, beta
+    return e, rho, np.diag(beta)
+
+def matrix_sqrt(A):
+    """
+    Upper triangular square root R of A, such that R^T•R = A.
+    """
+    return np.linalg.cholesky(A).T
+
+def aux_local_parameters(G,A_array,new_mu,new_cov,new_cov_sqrt):
+    """
+    Compute the local parameters μᵢ = Aᵢ·μ and σᵢ = √Var[Aᵢ·θ].
+    """
+    local_mu = np.einsum('iba,b->ia', A_array, new_mu)
+    if not G.local_std_trick:
+        # local_std = σᵢ = √Σ·Aᵢ                         of size [n,p,k]
+        local_std = np.einsum('pq,nqk->npk', new_cov_sqrt, A_array)
+    else:
+        # local_cov = Σᵢ = Aᵢ^T•Σ•Aᵢ                     of size [n,k,k]
+        local_cov = np.einsum('npk,pq,nql->nkl', A_array, new_cov, A_array,
+                              optimize = True)
+        local_std = local_cov_sqrt(G, local_cov)
+    return local_mu, local_std
+
+def local_cov_sqrt(G, local_cov):
+    """
+    Upper triangular square roots Rᵢ of the local covariances, such that
+    Rᵢ^T•Rᵢ = Σᵢ, in closed form for k = 1 and k = 2, see ``graph_aux``.
+    """
+    if G.k == 1:
+        return np.sqrt(local_cov)
+    if G.k == 2:
+        a, b, c = local_cov[:,0,0], local_cov[:,0,1], local_cov[:,1,1]
+        R = np.zeros_like(local_cov)
+        R[:,0,0] = np.sqrt(a)
+        R[:,0,1] = b / R[:,0,0]
+        R[:,1,1] = np.sqrt(c - np.square(R[:,0,1]))
+        return R
+    return np.transpose(np.linalg.cholesky(local_cov), [0,2,1])
+
+def candidate_parameters(G, mu, cov, beta, rho, step_size, new_cov_sqrt):
+    """
+    Compute the candidates μ and Σ of the next iteration, see ``graph_aux``.
+
+    Returns
+    -------
+    new_cov, new_cov_sqrt, new_logdet, new_mu, gamma
+    """
+    p = G.p
+    if G.comp_opt == "cholesky":
+        beta_chol = np.linalg.cholesky(beta)
+        beta_inv = scipy.linalg.cho_solve((beta_chol, True), np.eye(p))
+        beta_inv_sqrt = matrix_sqrt(beta_inv)
+    elif G.comp_opt == "svd":
+        u_beta, s_beta, v_beta = np.linalg.svd(beta)
+        beta_inv = (u_beta / s_beta) @ v_beta
+        beta_inv_sqrt = (u_beta / np.sqrt(s_beta)) @ v_beta
+
+    #from definition of Σₘ
+    cov_max = beta_inv
+    cov_max_inv = beta
+    cov_max_sqrt = beta_inv_sqrt
+
+    if not G.compute_gamma:
+        gamma = step_size
+    else:
+        #K⁻¹=Σ^½•β•Σ^½
+        K_inv = new_cov_sqrt @ beta @ new_cov_sqrt
+        K_eig = 1. / np.diag(K_inv)
+        eig_limitation = 0.5
+        gamma = (eig_limitation - 1)/(np.min(K_eig) - 1)
+
+    new_cov_, new_cov_sqrt_, new_logdet_ = \
+        compute_new_cov_and_co(G, gamma, cov, cov_max, cov_max_inv,
+                               cov_max_sqrt, new_cov_sqrt)
+    new_mu_ = mu - step_size * beta_inv @ rho
+    return new_cov_, new_cov_sqrt_, new_logdet_, new_mu_, gamma
+
+def compute_new_cov_and_co(G, gamma, cov, cov_max, cov_max_inv, cov_max_sqrt,
+                           new_cov_sqrt):
+    """
+    Backtracking between Σ and Σₘ, see ``graph_aux``.
+    """
+    new_cov_sqrt_ = None
+    if G.backtracking_degree == -1:
+        # Σⁿ⁺¹ = (γ·(Σₘ)⁻¹ + (1-γ)·(Σⁿ)⁻¹)⁻¹
+        new_cov_ = np.linalg.inv(gamma * cov_max_inv \
+                                 + (1-gamma) * np.linalg.inv(cov))
+    elif G.backtracking_degree == 1:
+        # Σⁿ⁺¹ = γ·Σₘ + (1-γ)·Σⁿ
+        new_cov_ = gamma * cov_max + (1-gamma) * cov
+    elif G.backtracking_degree == 0.5:
+        # Sⁿ⁺¹ = γ·Σₘ^(½) + (1-γ)·Sⁿ                with Sⁿ = (Σⁿ)^½
+        new_cov_sqrt_ = gamma * cov_max_sqrt + (1-gamma) * new_cov_sqrt
+        new_cov_ = new_cov_sqrt_ @ new_cov_sqrt_.T
+
+    if G.comp_opt == "cholesky":
+        if new_cov_sqrt_ is None:
+            new_cov_sqrt_ = matrix_sqrt(new_cov_)
+        new_logdet_ = 2*np.sum(np.log(np.abs(np.diag(new_cov_sqrt_))))
+    elif G.comp_opt == "svd":
+        u_new_cov, s_new_cov, v_new_cov = np.linalg.svd(new_cov_)
+        if new_cov_sqrt_ is None:
+            new_cov_sqrt_ = (u_new_cov * np.sqrt(s_new_cov)) @ v_new_cov
+        new_logdet_ = np.sum(np.log(s_new_cov))
+
+    return new_cov_, new_cov_sqrt_, new_logdet_
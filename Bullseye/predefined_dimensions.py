@@ -0,0 +1,35 @@
+"""
+The ``predefined_dimensions`` module
+====================================
+
+Contains the dimension p of θ for each of the predefined models, see the
+``predefined_functions`` module. Kept apart from the model functions so that
+it can be used without tensorflow.
+"""
+
+import numpy as np
+import math
+
+compute_ps = {}
+compute_p_docstring = """
+compute_p functions
+===================
+"""
+
+def compute_p_multilogit(d,k):
+    return d*k
+compute_ps["multilogit"] = compute_p_multilogit
+
+def compute_p_LM(d,k):
+    return d
+compute_ps["LM"] = compute_p_LM
+
+def compute_p_CNN(d, k, conv_sizes, pools):
+    tab_conv = [conv_size**2 + 1 for conv_size in conv_sizes]
+    n_for_conv = sum(tab_conv)
+    
+    c = int(math.sqrt(d))
+    flatten_size = math.floor(c/np.prod(pools))**2
+    n_for_multilogit = flatten_size * k + k
+    return n_for_conv + n_for_multilogit
+compute_ps["CNN"] = compute_p_CNN
@@ -21,7 +21,7 @@ The public function that may be used are
 """
 
 import numpy as np
-import tensorflow as tf
+import tensorflow.compat.v1 as tf
 import inspect
 import math
 import re
@@ -29,31 +29,10 @@ import re
 from .utils import *
 from .warning_handler import *
 from .predefined_functions_aux import *
+from .graph_aux import BlockProjections
 
 #===============================================================================
-compute_ps = {}
-compute_p_docstring = """
-compute_p functions
-===================
-"""
-
-def compute_p_multilogit(d,k):
-    return d*k
-compute_ps["multilogit"] = compute_p_multilogit
-
-def compute_p_LM(d,k):
-    return d
-compute_ps["LM"] = compute_p_LM
-
-def compute_p_CNN(d, k, conv_sizes, pools):
-    tab_conv = [conv_size**2 + 1 for conv_size in conv_sizes]
-    n_for_conv = sum(tab_conv)
-    
-    c = int(math.sqrt(d))
-    flatten_size = math.floor(c/np.prod(pools))**2
-    n_for_multilogit = flatten_size * k + k
-    return n_for_conv + n_for_multilogit
-compute_ps["CNN"] = compute_p_CNN
+from .predefined_dimensions import *
 
 #===============================================================================
 predefined_Psis = {}
@@ -64,10 +43,12 @@ Psi functions
 Refers to Psi_*(), grad_Psi_*() and hess_Psi_*().
 The definitions of ψ, ∇ψ, Hψ when considering the log posterior as ψ(θ)
 The operations used within these functions must be tensorflow operations.
+The design matrix may be a tf.SparseTensor when the graph is fed with sparse
+data, see ``X_matmul`` and its variants.
 
 Parameters
 ----------
-X : tf.tensor [n,d]
+X : tf.tensor or tf.SparseTensor [n,d]
     Design matrix.
 Y : tf.tensor [n,k]
     Response matrix.
@@ -84,16 +65,26 @@ or
 or
     [p,p]:
         Hψ(θ)
+
+The last item of each entry tells whether the functions are batched : they
+then take all the sampled θ's at once, thetas of size [s,p], and return ψ, ∇ψ
+and Hψ for each of them, of size [s], [s,p] and [s,p,p], see
+``Graph.set_model``.
+
+Batched models may also give weighted_hess_Psi_*(X,Y,thetas,weights), in
+``predefined_weighted_hess_Psis``, computing directly ∑ⱼ wⱼ·Hψ(θⱼ) of size
+[p,p] without the hessian of each θ.
 """
+predefined_weighted_hess_Psis = {}
 
 def Psi_multilogit(X,Y,theta):
     """
     ψ(X,Y,θ) = - log[ ∑ᵢ (∑ⱼ Yⱼexp(θⱼ·xᵢ))/(∑ⱼ exp(θⱼ·xᵢ)) ]
     """
     k = Y.shape.as_list()[1]
-    d = X.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
     theta_matrix = tf.transpose(tf.reshape(theta, [k,d]))
-    A = tf.matmul(X,theta_matrix)
+    A = X_matmul(X,theta_matrix)
     P=Softmax_probabilities(A)
     s = -tf.log(tf.einsum('nk,nk->n',Y,P))
     r = tf.reduce_sum(s, axis=0)
@@ -101,18 +92,18 @@ def Psi_multilogit(X,Y,theta):
 
 def grad_Psi_multilogit(X,Y,theta):
     k = Y.shape.as_list()[1]
-    d = X.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
     theta_matrix = tf.transpose(tf.reshape(theta, [k,d]))
-    A = tf.matmul(X,theta_matrix)
+    A = X_matmul(X,theta_matrix)
     P=Softmax_probabilities(A)
-    r = tf.transpose(Y-P)@X
+    r = tf.transpose(X_transpose_matmul(X,Y-P))
     return -tf.reshape(r,[d*k])
 
 def hess_Psi_multilogit(X,Y,theta):
     k = Y.shape.as_list()[1]
-    d = X.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
     theta_matrix = tf.reshape(theta, [d,k])
-    A = tf.matmul(X,theta_matrix)
+    A = X_matmul(X,theta_matrix)
     P = Softmax_probabilities(A)
     P_eq = -tf.einsum('ia,ib->abi',P,tf.ones_like(P)-P)
     P_neq = tf.einsum('ia,ib->abi',P,P)
@@ -122,16 +113,94 @@ def hess_Psi_multilogit(X,Y,theta):
     big_P = tf.einsum('ab,abi->abi',I,P_eq)\
         + tf.einsum('ab,abi->abi',I_,P_neq)
     #H__ = tf.einsum('ik,abi,il->akbl',X,big_P,X)
-    H_ = tf.einsum('ik,abi->akbi',X,big_P)
-    H__ = tf.einsum('akbi,il->akbl',H_,X)
+    #computed as k² weighted Gram matrices G[a,b] = X^T•diag(big_P[a,b])•X
+    G = X_weighted_grams(X, tf.transpose(tf.reshape(big_P,[k*k,-1])))
+    H__ = tf.transpose(tf.reshape(G,[k,k,d,d]),[0,2,1,3])
     H = tf.reshape(H__,[d*k,d*k])
     return -H
 
 
-predefined_Psis["multilogit_without_hess"] = [Psi_multilogit, grad_Psi_multilogit,None]
-predefined_Psis["multilogit_without_grad"] = [Psi_multilogit, None, hess_Psi_multilogit]
-predefined_Psis["multilogit"] = [Psi_multilogit, grad_Psi_multilogit,hess_Psi_multilogit]
-predefined_Psis["multilogit_simple"] = [Psi_multilogit, None,None]
+predefined_Psis["multilogit_mapfn"] = [Psi_multilogit, grad_Psi_multilogit,
+                                      hess_Psi_multilogit, False]
+
+#batched
+def multilogit_probabilities(X,k,thetas):
+    """
+    Softmax probabilities of each observation for each θ, θ being the k
+    columns of size d one after the other.
+
+    Returns
+    -------
+    tf.tensor [n,s,k]
+    """
+    d = X.get_shape().as_list()[1]
+    s = tf.shape(thetas)[0]
+    #a single [n,d]×[d,s·k] product for all the θ's
+    W = tf.transpose(tf.reshape(thetas, [s,k,d]), [2,0,1])
+    A = X_matmul(X, tf.reshape(W, [d,s*k]))
+    P = Softmax_probabilities(tf.reshape(A, [-1,k]))
+    return tf.reshape(P, [-1,s,k])
+
+def Psi_multilogit_batched(X,Y,thetas):
+    """
+    ψ(X,Y,θ) = - log[ ∑ᵢ (∑ⱼ Yⱼexp(θⱼ·xᵢ))/(∑ⱼ exp(θⱼ·xᵢ)) ]
+    """
+    k = Y.shape.as_list()[1]
+    P = multilogit_probabilities(X,k,thetas)
+    return -tf.reduce_sum(tf.log(tf.einsum('nk,nsk->ns',Y,P)), axis=0)
+
+def grad_Psi_multilogit_batched(X,Y,thetas):
+    k = Y.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
+    s = tf.shape(thetas)[0]
+    P = multilogit_probabilities(X,k,thetas)
+    #∇ψ[a·d+j] = -∑ᵢ xᵢⱼ(Yᵢₐ-Pᵢₐ), for all the θ's at once
+    R = tf.reshape(tf.expand_dims(Y,1) - P, [-1,s*k])
+    G = tf.reshape(X_transpose_matmul(X,R), [d,s,k])
+    return -tf.reshape(tf.transpose(G,[1,2,0]), [s,k*d])
+
+def hess_Psi_multilogit_batched(X,Y,thetas):
+    k = Y.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
+    s = tf.shape(thetas)[0]
+    P = multilogit_probabilities(X,k,thetas)
+    #W[i,j] = diag(Pᵢ) - Pᵢ•Pᵢ^T                 of size [n,s,k,k]
+    W = tf.einsum('nsk,kj->nskj', P, tf.eye(k))\
+        - tf.einsum('nsa,nsb->nsab', P, P)
+    #Hψ[a·d+i,b·d+j] = ∑ₙ xₙᵢ·W[a,b]·xₙⱼ, as s·k² weighted Gram matrices
+    G = X_weighted_grams(X, tf.reshape(W, [-1,s*k*k]))
+    H = tf.transpose(tf.reshape(G, [s,k,k,d,d]), [0,1,3,2,4])
+    return tf.reshape(H, [s,k*d,k*d])
+
+def weighted_hess_Psi_multilogit(X,Y,thetas,weights):
+    """
+    ∑ⱼ wⱼ·Hψ(θⱼ) = ∑ᵢ (∑ⱼ wⱼ·(diag(Pᵢⱼ) - Pᵢⱼ•Pᵢⱼ^T)) ⊗ xᵢ•xᵢ^T
+    """
+    k = Y.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
+    P = multilogit_probabilities(X,k,thetas)
+    #W[i] = ∑ⱼ wⱼ·(diag(Pᵢⱼ) - Pᵢⱼ•Pᵢⱼ^T)         of size [n,k,k]
+    W = tf.einsum('s,nsk,kj->nkj', weights, P, tf.eye(k))\
+        - tf.einsum('s,nsa,nsb->nab', weights, P, P)
+    #a single pass over the rows, as k² weighted Gram matrices
+    G = X_weighted_grams(X, tf.reshape(W, [-1,k*k]))
+    H = tf.transpose(tf.reshape(G, [k,k,d,d]), [0,2,1,3])
+    return tf.reshape(H, [k*d,k*d])
+
+predefined_Psis["multilogit_without_hess"] = [Psi_multilogit_batched,
+                                              grad_Psi_multilogit_batched,
+                                              None, True]
+predefined_Psis["multilogit_without_grad"] = [Psi_multilogit_batched, None,
+                                              hess_Psi_multilogit_batched,
+                                              True]
+predefined_Psis["multilogit"] = [Psi_multilogit_batched,
+                                 grad_Psi_multilogit_batched,
+                                 hess_Psi_multilogit_batched, True]
+predefined_Psis["multilogit_simple"] = [Psi_multilogit_batched, None, None,
+                                        True]
+predefined_weighted_hess_Psis["multilogit"] = weighted_hess_Psi_multilogit
+predefined_weighted_hess_Psis["multilogit_without_grad"] = \
+    weighted_hess_Psi_multilogit
 
 def Psi_LM(X,Y,theta):
     """
@@ -140,7 +209,8 @@ def Psi_LM(X,Y,theta):
     #size of the sample
     n = tf.cast(tf.shape(X)[0],tf.float32)
     #e
-    e = tf.square(tf.squeeze(Y,1) - tf.einsum('ij,j->i',X,theta))
+    e = tf.square(tf.squeeze(Y,1) - tf.squeeze(X_matmul(X,
+                                               tf.expand_dims(theta,1)),1))
     #compute the log likelihood
     log_likelihood = -0.5*n*tf.log(2*math.pi) - 0.5*tf.reduce_sum(e)
     return -log_likelihood
@@ -150,9 +220,10 @@ def grad_Psi_LM(X,Y,theta):
     ∂ψ(X,Y,β)/∂βⱼ = Xⱼ•(Y-X•β)^T
     """
     #e
-    e = tf.squeeze(Y,1) - tf.einsum('ij,j->i',X,theta)
+    e = tf.squeeze(Y,1) - tf.squeeze(X_matmul(X,tf.expand_dims(theta,1)),1)
     #compute the grad log likelihood
-    grad_log_likelihood = tf.einsum('ij,i->j',X,e)
+    grad_log_likelihood = tf.squeeze(X_transpose_matmul(X,
+                                                tf.expand_dims(e,1)),1)
     return -grad_log_likelihood
 
 def hess_Psi_LM(X,Y,theta):
@@ -160,13 +231,52 @@ def hess_Psi_LM(X,Y,theta):
     ∂ψ(X,Y,β)/∂βⱼ∂βₙ = -Xⱼ•Xₙ
     """
     #compute the hess log likelihood
-    hess_log_likelihood = -tf.einsum('ji,jk->ik',X,X)
+    W = tf.ones(tf.stack([tf.shape(X)[0],1]))
+    hess_log_likelihood = -X_weighted_grams(X,W)[0]
     return -hess_log_likelihood
 
-predefined_Psis["LM_simple"]=[Psi_LM, None, None]
-predefined_Psis["LM_without_hess"] = [Psi_LM, grad_Psi_LM, None]
-predefined_Psis["LM_without_grad"]=[Psi_LM, grad_Psi_LM, hess_Psi_LM]
-predefined_Psis["LM"]=[Psi_LM, grad_Psi_LM, hess_Psi_LM]
+predefined_Psis["LM_mapfn"] = [Psi_LM, grad_Psi_LM, hess_Psi_LM, False]
+
+#batched
+def Psi_LM_batched(X,Y,thetas):
+    """
+    ψ(X,Y,Θ) = ψ(X,Y,β) = 0.5·n·log(2π) + 0.5 • ∑ᵢ(Yᵢ-Xᵢβ)²
+    """
+    n = tf.cast(tf.shape(X)[0],tf.float32)
+    #e[i,j] = (Yᵢ-Xᵢβⱼ)²                             of size [n,s]
+    e = tf.square(Y - X_matmul(X, tf.transpose(thetas)))
+    return 0.5*n*tf.log(2*math.pi) + 0.5*tf.reduce_sum(e, axis=0)
+
+def grad_Psi_LM_batched(X,Y,thetas):
+    """
+    ∂ψ(X,Y,β)/∂βⱼ = -Xⱼ•(Y-X•β)^T
+    """
+    e = Y - X_matmul(X, tf.transpose(thetas))
+    return -tf.transpose(X_transpose_matmul(X, e))
+
+def hess_Psi_LM_batched(X,Y,thetas):
+    """
+    ∂ψ(X,Y,β)/∂βⱼ∂βₙ = Xⱼ•Xₙ
+    """
+    W = tf.ones(tf.stack([tf.shape(X)[0],1]))
+    return tf.tile(X_weighted_grams(X,W), tf.stack([tf.shape(thetas)[0],1,1]))
+
+def weighted_hess_Psi_LM(X,Y,thetas,weights):
+    """
+    ∑ⱼ wⱼ·Hψ(θⱼ) = (∑ⱼ wⱼ)·X^T•X
+    """
+    W = tf.ones(tf.stack([tf.shape(X)[0],1]))
+    return tf.reduce_sum(weights) * X_weighted_grams(X,W)[0]
+
+predefined_Psis["LM_simple"]=[Psi_LM_batched, None, None, True]
+predefined_Psis["LM_without_hess"] = [Psi_LM_batched, grad_Psi_LM_batched,
+                                      None, True]
+predefined_Psis["LM_without_grad"]=[Psi_LM_batched, grad_Psi_LM_batched,
+                                    hess_Psi_LM_batched, True]
+predefined_Psis["LM"]=[Psi_LM_batched, grad_Psi_LM_batched,
+                       hess_Psi_LM_batched, True]
+predefined_weighted_hess_Psis["LM"] = weighted_hess_Psi_LM
+predefined_weighted_hess_Psis["LM_without_grad"] = weighted_hess_Psi_LM
 
 
 def Psi_CNN(X,Y,theta,conv_sizes,pools):
@@ -174,7 +284,7 @@ def Psi_CNN(X,Y,theta,conv_sizes,pools):
     P = Probabilities_CNN(X,k,theta,conv_sizes,pools)
     return -tf.reduce_sum(tf.log(tf.einsum('nk,nk->n',Y,P)),0)
 
-predefined_Psis["CNN"] = [Psi_CNN, None, None]
+predefined_Psis["CNN"] = [Psi_CNN, None, None, False]
 
 #===============================================================================
 
@@ -395,26 +505,50 @@ Corresponds to (proj_*(xᵢ) : i∈〚1,n〛).
 The operations used within these functions must be tensorflow
 operations.
 
+When the design matrix is a tf.SparseTensor, the projections are returned as
+a tf.SparseTensor as well.
+
+The default multilogit and LM projections are ``BlockProjections``, which
+keep Aᵢ implicit, see the ``graph_aux`` module. Their "dense" option gives
+the [n,p,k] tensor instead.
+
 Parameters
 ----------
-X : tf.tensor [n,d]
+X : tf.tensor or tf.SparseTensor [n,d]
     The design matrix.
 
 Returns
 -------
-tf.tensor [n, d, k]:
+tf.tensor or tf.SparseTensor [n, p, k]:
     {Aᵢ : i∈〚1,n〛}
 """
 
 def Proj_multilogit(X,k):
+    #Aᵢ[a·d+j,a] = xᵢⱼ, kept implicit
+    return BlockProjections(X,k)
+
+predefined_Projs["multilogit"] = Proj_multilogit
+
+def Proj_multilogit_dense(X,k):
     #→
-    d = X.shape.as_list()[1]
+    d = X.get_shape().as_list()[1]
+    if isinstance(X, tf.SparseTensor):
+        #Aᵢ[a·d+j,a] = xᵢⱼ, for each class a
+        nnz = tf.shape(X.values)[0]
+        i = tf.tile(X.indices[:,0],[k])
+        j = tf.tile(X.indices[:,1],[k])
+        a = tf.reshape(tf.tile(tf.expand_dims(tf.range(k,dtype=tf.int64),1),
+                               tf.stack([1,nnz])),[-1])
+        indices = tf.stack([i,a*d+j,a],1)
+        values = tf.tile(X.values,[k])
+        dense_shape = tf.stack([X.dense_shape[0],d*k,k])
+        return tf.sparse_reorder(tf.SparseTensor(indices,values,dense_shape))
     X_tiled = tf.tile(X, [1,k])
     kron = np.kron(np.eye(k),np.ones((d,1)))
     KP = tf.convert_to_tensor(kron, tf.float32)
     return tf.einsum('np,pk->npk',X_tiled,KP)
 
-predefined_Projs["multilogit"] = Proj_multilogit
+predefined_Projs["multilogit_dense"] = Proj_multilogit_dense
 
 def Proj_multilogit_mapfn(X, k):
     d = X.shape.as_list()[1]
@@ -423,9 +557,16 @@ def Proj_multilogit_mapfn(X, k):
 predefined_Projs["multilogit_mapfn"] = Proj_multilogit_mapfn
 
 def Proj_LM(X,k):
-    return tf.expand_dims(X,2)
+    #Aᵢ = xᵢ as a column, kept implicit
+    return BlockProjections(X,1)
 predefined_Projs["LM"] = Proj_LM
 
+def Proj_LM_dense(X,k):
+    if isinstance(X, tf.SparseTensor):
+        return tf.sparse_reshape(X, tf.concat([X.dense_shape,[1]],0))
+    return tf.expand_dims(X,2)
+predefined_Projs["LM_dense"] = Proj_LM_dense
+
 
 #===============================================================================
 
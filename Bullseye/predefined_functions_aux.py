@@ -3,7 +3,7 @@
 """
 
 import numpy as np
-import tensorflow as tf
+import tensorflow.compat.v1 as tf
 import inspect
 import math
 import re
@@ -91,6 +91,119 @@ def apply_max_pool(X, pool_size):
         )
     return X_pooled
 
+"""
+SPARSE
+"""
+
+def X_matmul(X,W):
+    """
+    Compute X•W, X being either a dense tensor or a tf.SparseTensor.
+
+    Parameters
+    ----------
+    X : tf.tensor or tf.SparseTensor [n,d]
+        Design matrix.
+    W : tf.tensor [d,q]
+        Dense matrix.
+
+    Returns
+    -------
+    tf.tensor [n,q] :
+        X•W
+    """
+    if isinstance(X, tf.SparseTensor):
+        return tf.sparse_tensor_dense_matmul(X,W)
+    return tf.matmul(X,W)
+
+def X_transpose_matmul(X,W):
+    """
+    Compute X^T•W, X being either a dense tensor or a tf.SparseTensor.
+
+    Parameters
+    ----------
+    X : tf.tensor or tf.SparseTensor [n,d]
+        Design matrix.
+    W : tf.tensor [n,q]
+        Dense matrix.
+
+    Returns
+    -------
+    tf.tensor [d,q] :
+        X^T•W
+    """
+    if isinstance(X, tf.SparseTensor):
+        return tf.sparse_tensor_dense_matmul(X,W,adjoint_a=True)
+    return tf.matmul(X,W,transpose_a=True)
+
+def X_row_pairs(X):
+    """
+    List the pairs of non zero entries of a tf.SparseTensor X lying on the
+    same row, so that products xᵢⱼ·xᵢₗ are computed without densifying X :
+    there are ∑ᵢ nnzᵢ² pairs, nnzᵢ being the number of non zero entries of the
+    row i.
+
+    Parameters
+    ----------
+    X : tf.SparseTensor [n,d]
+        Design matrix.
+
+    Returns
+    -------
+    rows : tf.tensor [P]
+        Row i of each pair.
+    cols_1 : tf.tensor [P]
+        Column j of each pair.
+    cols_2 : tf.tensor [P]
+        Column l of each pair.
+    values : tf.tensor [P]
+        xᵢⱼ·xᵢₗ for each pair.
+    """
+    #the entries of a row must be contiguous
+    X = tf.sparse_reorder(X)
+    rows, cols = X.indices[:,0], X.indices[:,1]
+    row_nnz = tf.unsorted_segment_sum(tf.ones_like(rows), rows,
+                                      X.dense_shape[0])
+    row_start = tf.cumsum(row_nnz, exclusive=True)
+    #for each entry, the range of the entries of its row
+    starts = tf.gather(row_start, rows)
+    pairs = tf.ragged.range(starts, starts + tf.gather(row_nnz, rows))
+    first, second = pairs.value_rowids(), pairs.flat_values
+    values = tf.gather(X.values, first) * tf.gather(X.values, second)
+    return (tf.gather(rows, first), tf.gather(cols, first),
+            tf.gather(cols, second), values)
+
+def X_weighted_grams(X,W):
+    """
+    Compute the weighted Gram matrices X^T•diag(W[:,q])•X for each column q of
+    W, X being either a dense tensor or a tf.SparseTensor.
+
+    In the sparse case, the products of the non zero entries of each row are
+    summed into the Gram matrices, so that memory and cost scale with the
+    number of pairs ∑ᵢ nnzᵢ² instead of n·d.
+
+    Parameters
+    ----------
+    X : tf.tensor or tf.SparseTensor [n,d]
+        Design matrix.
+    W : tf.tensor [n,q]
+        Weights of each observation.
+
+    Returns
+    -------
+    tf.tensor [q,d,d] :
+        {X^T•diag(W[:,q])•X}
+    """
+    if not isinstance(X, tf.SparseTensor):
+        return tf.einsum('ij,iq,il->qjl',X,W,X)
+    d = X.get_shape().as_list()[1]
+    if d is None:
+        d = X.dense_shape[1]
+    rows, cols_1, cols_2, values = X_row_pairs(X)
+    #G[j·d+l,q] = ∑ᵢ xᵢⱼ·W[i,q]·xᵢₗ                      of size [d*d,q]
+    weighted = tf.gather(W, rows) * tf.expand_dims(values, 1)
+    G = tf.unsorted_segment_sum(weighted, cols_1*d + cols_2, d*d)
+    return tf.reshape(tf.transpose(G), [-1,d,d])
+
 """
 MULTILOGIT
 """
@@ -0,0 +1,281 @@
+"""
+The ``predefined_functions_numpy`` module
+=========================================
+
+NumPy counterpart of the ``predefined_functions`` module, used by the numpy
+backend, see the ``numpy_engine`` module. Contains the predefined ψ's, ϕ's,
+projections and π's of the multilogit and LM models, evaluated at once on
+all the sampled θ's or activations instead of one sample at a time.
+
+The exact gradients and hessians are always given : the options selecting an
+approximation or a tensorflow implementation, e.g. "mapfn", do not apply.
+"""
+
+import numpy as np
+import math
+
+#===============================================================================
+numpy_Psis = {}
+Psi_docstring = """
+Psi functions
+=============
+
+Refers to Psi_*(), grad_Psi_*() and hess_Psi_*().
+
+Parameters
+----------
+X : np.array [n,d]
+    Design matrix.
+Y : np.array [n,k]
+    Response matrix.
+thetas : np.array [s,p]
+    The sampled θ's.
+
+Returns
+-------
+    [s]:
+        ψ(θ) for each θ
+or
+    [s,p]:
+        ∇ψ(θ) for each θ
+or
+    [s,p,p]:
+        Hψ(θ) for each θ
+
+As in the ``predefined_functions`` module, the last item of each entry tells
+that the functions are batched, which they always are here, and
+``numpy_weighted_hess_Psis`` gives ∑ⱼ wⱼ·Hψ(θⱼ) directly.
+"""
+numpy_weighted_hess_Psis = {}
+
+def softmax_probabilities(A):
+    """
+    Softmax probabilities along the last axis of A.
+    """
+    E = np.exp(A - np.max(A, axis = -1, keepdims = True))
+    return E / np.sum(E, axis = -1, keepdims = True)
+
+def multilogit_activations(X, thetas, k):
+    """
+    Activations X•θ of each θ, θ being the k columns of size d one after the
+    other.
+
+    Returns
+    -------
+    np.array [s,n,k]
+    """
+    s = thetas.shape[0]
+    d = X.shape[1]
+    #a single [n,d]×[d,s·k] product for all the θ's
+    W = np.transpose(np.reshape(thetas, [s,k,d]), [2,0,1])
+    A = X @ np.reshape(W, [d,s*k])
+    return np.transpose(np.reshape(A, [-1,s,k]), [1,0,2])
+
+def Psi_multilogit(X,Y,thetas):
+    """
+    ψ(X,Y,θ) = - log[ ∑ᵢ (∑ⱼ Yⱼexp(θⱼ·xᵢ))/(∑ⱼ exp(θⱼ·xᵢ)) ]
+    """
+    P = softmax_probabilities(multilogit_activations(X, thetas, Y.shape[1]))
+    return -np.sum(np.log(np.einsum('nk,snk->sn', Y, P)), axis = 1)
+
+def grad_Psi_multilogit(X,Y,thetas):
+    s, k, d = thetas.shape[0], Y.shape[1], X.shape[1]
+    P = softmax_probabilities(multilogit_activations(X, thetas, k))
+    #∇ψ[a·d+j] = -∑ᵢ xᵢⱼ(Yᵢₐ-Pᵢₐ)
+    R = np.reshape(np.transpose(Y - P, [1,0,2]), [-1,s*k])
+    G = np.reshape(X.T @ R, [d,s,k])
+    return -np.reshape(np.transpose(G, [1,2,0]), [s,k*d])
+
+def hess_Psi_multilogit(X,Y,thetas):
+    s, k, d = thetas.shape[0], Y.shape[1], X.shape[1]
+    P = softmax_probabilities(multilogit_activations(X, thetas, k))
+    #W[j,i] = diag(Pᵢ) - Pᵢ•Pᵢ^T                   of size [s,n,k,k]
+    W = np.einsum('snk,kj->snkj', P, np.eye(k))\
+        - np.einsum('sni,snj->snij', P, P)
+    #Hψ[a·d+i,b·d+j] = ∑ₙ xₙᵢ·W[a,b]·xₙⱼ
+    H = np.einsum('ni,snab,nj->saibj', X, W, X, optimize = True)
+    return np.reshape(H, [s,k*d,k*d])
+
+def weighted_hess_Psi_multilogit(X,Y,thetas,weights):
+    """
+    ∑ⱼ wⱼ·Hψ(θⱼ) = ∑ᵢ (∑ⱼ wⱼ·(diag(Pᵢⱼ) - Pᵢⱼ•Pᵢⱼ^T)) ⊗ xᵢ•xᵢ^T
+    """
+    k, d = Y.shape[1], X.shape[1]
+    P = softmax_probabilities(multilogit_activations(X, thetas, k))
+    #W[i] = ∑ⱼ wⱼ·(diag(Pᵢⱼ) - Pᵢⱼ•Pᵢⱼ^T)         of size [n,k,k]
+    W = np.einsum('s,snk,kj->nkj', weights, P, np.eye(k))\
+        - np.einsum('s,sna,snb->nab', weights, P, P)
+    H = np.einsum('ni,nab,nj->aibj', X, W, X, optimize = True)
+    return np.reshape(H, [k*d,k*d])
+
+numpy_Psis["multilogit"] = [Psi_multilogit, grad_Psi_multilogit,
+                            hess_Psi_multilogit, True]
+numpy_weighted_hess_Psis["multilogit"] = weighted_hess_Psi_multilogit
+
+def Psi_LM(X,Y,thetas):
+    """
+    ψ(X,Y,Θ) = ψ(X,Y,β) = 0.5·n·log(2π) + 0.5 • ∑ᵢ(Yᵢ-Xᵢβ)²
+    """
+    n = X.shape[0]
+    e = np.square(Y - X @ thetas.T)
+    return 0.5*n*np.log(2*math.pi) + 0.5*np.sum(e, axis = 0)
+
+def grad_Psi_LM(X,Y,thetas):
+    """
+    ∂ψ(X,Y,β)/∂βⱼ = -Xⱼ•(Y-X•β)^T
+    """
+    e = Y - X @ thetas.T
+    return -(X.T @ e).T
+
+def hess_Psi_LM(X,Y,thetas):
+    """
+    ∂ψ(X,Y,β)/∂βⱼ∂βₙ = Xⱼ•Xₙ
+    """
+    s = thetas.shape[0]
+    return np.broadcast_to(X.T @ X, (s,) + (X.shape[1],)*2)
+
+def weighted_hess_Psi_LM(X,Y,thetas,weights):
+    """
+    ∑ⱼ wⱼ·Hψ(θⱼ) = (∑ⱼ wⱼ)·X^T•X
+    """
+    return np.sum(weights) * (X.T @ X)
+
+numpy_Psis["LM"] = [Psi_LM, grad_Psi_LM, hess_Psi_LM, True]
+numpy_weighted_hess_Psis["LM"] = weighted_hess_Psi_LM
+
+#===============================================================================
+numpy_Pis = {}
+Pi_docstring = """
+Pi functions
+============
+
+Refers to Pi_*(), grad_Pi_*() and hess_Pi_*(), the last item of each entry
+telling whether the prior supposes the components of θ independent.
+
+Parameters
+----------
+thetas : np.array [s,p]
+    The sampled θ's.
+
+Returns
+-------
+    [s]:
+        π(θ) for each θ
+or
+    [s,p]:
+        ∇π(θ) for each θ
+or
+    [s,p,p]:
+        Hπ(θ) for each θ
+"""
+
+"""
+NORMAL
+"""
+#iid
+def Pi_normal_iid(thetas, mu = 0, sigma = 1):
+    p = thetas.shape[1]
+    summands = np.sum(np.square(thetas - mu), axis = 1)
+    const = 0.5*p*(np.log(2*math.pi) + 2*np.log(sigma))
+    return 0.5/sigma**2 * summands + const
+def grad_Pi_normal_iid(thetas, mu = 0, sigma = 1):
+    return (thetas - mu)/sigma**2
+def hess_Pi_normal_iid(thetas, mu = 0, sigma = 1):
+    s, p = thetas.shape
+    return np.broadcast_to(np.eye(p)/sigma**2, (s,p,p))
+
+numpy_Pis["normal_iid"] = [Pi_normal_iid, grad_Pi_normal_iid,
+                           hess_Pi_normal_iid, True]
+
+#===============================================================================
+numpy_Phis = {}
+Phi_docstring = """
+Phi functions
+=============
+
+Refers to Phi_*(), grad_Phi_*() and hess_Phi_*().
+
+Parameters
+----------
+A : np.array [s,n,k]
+    Activations, for each sampled θ.
+Y : np.array [n,k]
+    Response matrix.
+
+Returns
+-------
+    [s,n]:
+        ϕ(A)
+or
+    [s,n,k]:
+        ∇ϕ(A)
+or
+    [s,n,k,k]:
+        Hϕ(A)
+"""
+
+"""
+LM
+"""
+def Phi_LM(A,Y):
+    """
+    φ(Xᵢ,β) = 0.5·(log(2π) + (Yᵢ-Xᵢβ)²)
+    """
+    e = np.square(Y - A)[...,0]
+    return 0.5 * (np.log(2*math.pi) + e)
+
+def grad_Phi_LM(A,Y):
+    return A - Y
+
+def hess_Phi_LM(A,Y):
+    return np.ones(A.shape + (1,))
+
+numpy_Phis["LM"] = [Phi_LM, grad_Phi_LM, hess_Phi_LM]
+
+"""
+MULTILOGIT
+"""
+def Phi_multilogit(A,Y):
+    P = softmax_probabilities(A)
+    return -np.log(np.sum(Y*P, axis = -1))
+def grad_Phi_multilogit(A,Y):
+    return softmax_probabilities(A) - Y
+def hess_Phi_multilogit(A,Y):
+    k = Y.shape[-1]
+    P = softmax_probabilities(A)
+    return P[...,:,None]*np.eye(k) - P[...,:,None]*P[...,None,:]
+
+numpy_Phis["multilogit"] = [Phi_multilogit, grad_Phi_multilogit,
+                            hess_Phi_multilogit]
+
+#===============================================================================
+numpy_Projs = {}
+Proj_docstring = """
+Projection functions
+====================
+
+Refers to Proj_*
+
+Parameters
+----------
+X : np.array [n,d]
+    The design matrix.
+
+Returns
+-------
+np.array [n, p, k]:
+    {Aᵢ : i∈〚1,n〛}
+"""
+
+def Proj_multilogit(X,k):
+    n, d = X.shape
+    #Aᵢ[a·d+j,a] = xᵢⱼ, for each class a
+    A = np.zeros([n,d*k,k], dtype = X.dtype)
+    for a in range(k):
+        A[:,a*d:(a+1)*d,a] = X
+    return A
+numpy_Projs["multilogit"] = Proj_multilogit
+
+def Proj_LM(X,k):
+    return X[:,:,None]
+numpy_Projs["LM"] = Proj_LM
@@ -7,7 +7,7 @@ In particular, contains the class ``RunSaver`` which is widely used in the
 ``bullseye_graph`` module.
 """
 
-import tensorflow as tf
+from .lazy_import import tf
 import numpy as np
 import json
 import time
@@ -15,7 +15,6 @@ import os
 import shutil
 import re
 
-from tensorflow.python.client import timeline
 
 from .warning_handler import *
 
@@ -217,6 +216,18 @@ class RunSaver():
         if self.profiler is not None:
             self.profiler.profile_operations()
 
+    def finish_loop(self, status, elbos, best_elbos):
+        """
+        Finish the iterations run at once inside the graph and save their
+        statistics, the total time being shared evenly between them.
+        """
+        n_iter = len(status)
+        total_time = time.time()-self.start_time
+        self.times += n_iter * [total_time/max(n_iter,1)]
+        self.status += list(status)
+        self.elbos += list(elbos)
+        self.best_elbos += list(best_elbos)
+
     def save_step(self, mu, cov, epoch):
         """
         To call at the end of an iteration, to save the results of one iteration
@@ -322,6 +333,7 @@ class TimeLiner:
         """
         Update the timeliner metadata.
         """
+        from tensorflow.python.client import timeline
         #added lines
         fetched_timeline = timeline.Timeline(run_metadata.step_stats)
         chrome_trace = fetched_timeline.generate_chrome_trace_format()
@@ -5,7 +5,7 @@
     Contains all functions related to samplings and quadratures.
 """
 
-import tensorflow as tf
+from .lazy_import import tf
 
 from .utils import *
 
@@ -50,12 +50,14 @@ def generate_sampling(s,k):
     return z, z_weights
 
 """
-def generate_sampling(s,k):
-    z_array = np.random.normal(size=(s,k))
+def generate_sampling(s,k,rng=np.random):
+    #rng is a np.random.Generator, or the global numpy random state
+    z_array = rng.normal(size=(s,k))
     weights_array = 1./s*np.ones([s]) #TOSEE
     return z_array, weights_array
 
-def generate_sampling_tf(s,k):
-    z = tf.random_normal([s,k])
+def generate_sampling_tf(s,k,seed=None):
+    #with a seed, the same draws are made in a tf.Session and a tf.function
+    z = tf.random_normal([s,k], seed = seed)
     weights = 1./s * tf.ones([s])
     return z, weights
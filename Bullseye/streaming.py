@@ -0,0 +1,771 @@
+"""
+The ``streaming`` module
+========================
+
+Contains the tools used to stream a dataset chunk by chunk when the Bullseye
+algorithm is fed with a file. In particular, contains :
+    -the ``BinaryChunkStore`` class, a memory-mapped float32 copy of a .csv
+     file from which each chunk can be served without parsing any text,
+    -the ``Prefetcher`` class, decoding the next chunks on a worker thread
+     while the current one is being processed,
+    -the ``ChunkIndex`` class, a sidecar file recording the byte offsets of
+     the chunks of a .csv file so that any chunk can be read directly,
+    -the ``ShardedIndex`` class, gathering the indices of several .csv files
+     into one logical dataset,
+    -the ``ChunkCache`` class, keeping decoded chunks in memory across epochs
+     within a given memory budget,
+    -the ``ChunkDecoder`` class, writing parsed chunks into reused float32
+     buffers,
+    -the functions reading sparse files in the libsvm format.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import concurrent.futures
+import collections
+import threading
+import glob
+import struct
+import queue
+import json
+import io
+import os
+
+from .utils import *
+from .warning_handler import warn
+
+#suffix of the binary chunk store written next to the streamed file
+binary_suffix = ".bullseye_bin"
+#header of the binary chunk store : magic, version, n, d, k, one_hot
+binary_header = struct.Struct("<8sIQIII")
+binary_magic = b"BULLSEYE"
+binary_version = 2
+#number of rows parsed at once when converting a .csv file
+conversion_chunksize = 10000
+#suffix of the chunk index written next to the streamed file
+index_suffix = ".bullseye_idx"
+
+def decode_chunk(data, d, k, one_hot):
+    """
+    Split a chunk read from a .csv file into its design and response matrices.
+
+    Parameters
+    ----------
+    data : np.array [m, d+k] (or [m, d+1] if one_hot)
+        The raw chunk.
+    d : int
+        d
+    k : int
+        k
+    one_hot : bool
+        Whether the first column contains labels to be expanded.
+
+    Returns
+    -------
+    X : np.array [m,d]
+        Design matrix.
+    Y : np.array [m,k]
+        Response matrix.
+    """
+    if one_hot:
+        X = data[:,1:]
+        Y = to_one_hot(data[:,0],k)
+    else:
+        X = data[:,k:d+k]
+        Y = data[:,:k]
+    return X, Y
+
+class ChunkDecoder:
+    """
+    The ``ChunkDecoder`` class
+    ==========================
+    Float32-native version of ``decode_chunk``. The chunks are parsed as
+    float32 by pandas, whose values are then written with their final layout,
+    one-hot labels included, into preallocated float32 buffers : this is the
+    copy that makes X and Y contiguous, so that they can be fed to
+    ``sess.run`` without any further conversion or copy.
+
+    Each buffer is leased by ``decode`` until the chunk is given back with
+    ``release``. There are ``live_chunks`` buffers, the largest number of
+    decoded chunks alive at the same time : decoding a chunk while all of
+    them are leased raises instead of overwriting a chunk still in use.
+    """
+    def __init__(self, m, d, k, one_hot, prefetch, readers):
+        """
+        Allocate ``live_chunks(prefetch, readers)`` pairs of X [m,d] and Y
+        [m,k] float32 buffers.
+        """
+        self.d, self.k, self.one_hot = d, k, one_hot
+        n_buffers = self.live_chunks(prefetch, readers)
+        self.buffers = [(np.empty((m,d), dtype = np.float32),
+                         np.empty((m,k), dtype = np.float32))
+                        for _ in range(n_buffers)]
+        self.lock = threading.Lock()
+        self.reset()
+
+    @staticmethod
+    def live_chunks(prefetch, readers):
+        """
+        Largest number of decoded chunks alive at the same time while an epoch
+        is streamed : the chunk being processed, the ``prefetch`` chunks of
+        the queue of the ``Prefetcher``, the one its worker holds while the
+        queue is full and the ``readers``-1 other chunks being read by
+        ``parallel_map``.
+        """
+        return prefetch + readers + 1
+
+    def reset(self):
+        """
+        Give back all the buffers, the chunks of a previous epoch being dead.
+        """
+        with self.lock:
+            self.free = list(range(len(self.buffers)))
+
+    def decode(self, data):
+        """
+        Split a raw float32 chunk into X and Y, see ``decode_chunk``.
+
+        Returns
+        -------
+        X : np.array [m,d]
+            Design matrix, view of a leased float32 buffer.
+        Y : np.array [m,k]
+            Response matrix, view of a leased float32 buffer.
+        """
+        with self.lock:
+            assert self.free, "all the {} chunk buffers are in use".format(
+                len(self.buffers))
+            X, Y = self.buffers[self.free.pop()]
+        r = data.shape[0]
+        X, Y = X[:r], Y[:r]
+        if self.one_hot:
+            np.copyto(X, data[:,1:])
+            Y.fill(0.)
+            Y[np.arange(r), data[:,0].astype(np.intp)] = 1.
+        else:
+            np.copyto(X, data[:,self.k:self.d+self.k])
+            np.copyto(Y, data[:,:self.k])
+        return X, Y
+
+    def release(self, X):
+        """
+        Give back the buffer of a chunk returned by ``decode``, given its X.
+        Chunks which do not come from a buffer, e.g. the ones of the binary
+        store, are ignored.
+        """
+        with self.lock:
+            for (j, (B, _)) in enumerate(self.buffers):
+                if getattr(X, "base", None) is B and j not in self.free:
+                    self.free.append(j)
+                    return
+
+def binary_store_path(file):
+    """
+    Path of the binary chunk store associated to a given .csv file.
+    """
+    return file + binary_suffix
+
+def read_binary_header(path):
+    """
+    Read the header of a binary chunk store.
+
+    Returns
+    -------
+    tuple or None
+        (n, d, k, one_hot), or None if ``path`` is not a store of the current
+        version.
+    """
+    with open(path, "rb") as f:
+        header = f.read(binary_header.size)
+    if len(header) < binary_header.size:
+        return None
+    magic, version, n, d, k, one_hot = binary_header.unpack(header)
+    if magic != binary_magic or version != binary_version:
+        return None
+    return n, d, k, bool(one_hot)
+
+def open_binary_store(file, k, one_hot):
+    """
+    Open the binary chunk store associated to ``file``, converting the file
+    first if the store does not exist, is outdated or does not match the
+    layout of the file, i.e. k, one_hot and the resulting d.
+
+    Parameters
+    ----------
+    file : str
+        Path of the .csv file.
+    k : int
+        k
+    one_hot : bool
+        Whether the first column of the file contains labels.
+
+    Returns
+    -------
+    BinaryChunkStore
+        The opened store.
+    """
+    path = binary_store_path(file)
+
+    #d as deduced from the header of the .csv file
+    with open(file, "rb") as f:
+        n_columns = len(f.readline().split(b","))
+    d = n_columns-1 if one_hot else n_columns-k
+
+    up_to_date = os.path.isfile(path) \
+        and os.path.getmtime(path) >= os.path.getmtime(file)
+    if up_to_date:
+        header = read_binary_header(path)
+        if header is not None and header[1:] == (d, k, one_hot):
+            return BinaryChunkStore(path)
+    write_binary_store(file, path, k, one_hot)
+    return BinaryChunkStore(path)
+
+def write_binary_store(file, path, k, one_hot):
+    """
+    Convert a .csv file into a binary chunk store. The file is parsed only
+    once : X is written right after the header while Y is written in a
+    temporary file, then appended.
+
+    The store is written to ``path + ".tmp"`` and only moved to ``path`` once
+    complete, so that an interrupted conversion never leaves a partial store.
+
+    The layout of the store is :
+        header | X as float32 [n,d] | Y as float32 [n,k]
+    """
+    reader = pd.read_table(file, sep = ",", chunksize = conversion_chunksize,
+                           dtype = np.float32)
+    tmp_path = path + ".tmp"
+    y_path = path + ".y.tmp"
+    n, d = 0, None
+
+    with open(tmp_path, "wb") as f, open(y_path, "wb") as f_y:
+        #reserve space for the header, written once n is known
+        f.write(b"\0" * binary_header.size)
+        for chunk in reader:
+            data = np.asarray(chunk)
+            if d is None:
+                d = data.shape[-1]-1 if one_hot else data.shape[-1]-k
+            X, Y = decode_chunk(data, d, k, one_hot)
+            f.write(np.ascontiguousarray(X, dtype = np.float32).tobytes())
+            f_y.write(np.ascontiguousarray(Y, dtype = np.float32).tobytes())
+            n += data.shape[0]
+
+    #append Y after X
+    with open(tmp_path, "ab") as f, open(y_path, "rb") as f_y:
+        while True:
+            block = f_y.read(1 << 24)
+            if not block:
+                break
+            f.write(block)
+    os.remove(y_path)
+
+    #finally write the header, then move the complete store into place
+    with open(tmp_path, "r+b") as f:
+        f.write(binary_header.pack(binary_magic, binary_version, n, d, k,
+                                   int(one_hot)))
+    os.replace(tmp_path, path)
+
+class BinaryChunkStore:
+    """
+    The ``BinaryChunkStore`` class
+    ==============================
+    Memory-mapped view of a dataset converted with ``write_binary_store``.
+    X and Y are stored as contiguous float32 arrays, chunk i is therefore a
+    zero-copy slice of the mapped file.
+    """
+    def __init__(self, path):
+        """
+        Open the store located at ``path``.
+        """
+        header = read_binary_header(path)
+        assert header is not None
+        n, d, k, one_hot = header
+
+        self.path = path
+        self.n, self.d, self.k = n, d, k
+        self.one_hot = one_hot
+
+        offset = binary_header.size
+        self.X = np.memmap(path, dtype = np.float32, mode = "r",
+                           offset = offset, shape = (n,d))
+        offset += n * d * np.dtype(np.float32).itemsize
+        self.Y = np.memmap(path, dtype = np.float32, mode = "r",
+                           offset = offset, shape = (n,k))
+
+    def chunk(self, i, m):
+        """
+        Return the i-th chunk of size m.
+
+        Returns
+        -------
+        X : np.memmap [m,d]
+            Design matrix of the chunk.
+        Y : np.memmap [m,k]
+            Response matrix of the chunk.
+        """
+        return self.X[i*m:(i+1)*m], self.Y[i*m:(i+1)*m]
+
+class Prefetcher:
+    """
+    The ``Prefetcher`` class
+    ========================
+    Wraps an iterator of chunks and consumes it on a worker thread, keeping at
+    most ``depth`` decoded chunks in a bounded queue. While tensorflow
+    processes the current chunk, the next ones are parsed in the background,
+    so that an epoch costs about max(parse, compute) instead of their sum.
+
+    Exceptions raised by the wrapped iterator are raised again in the
+    consuming thread.
+    """
+    #marks the end of the wrapped iterator
+    _end = object()
+
+    def __init__(self, iterable, depth):
+        """
+        Start prefetching ``iterable`` with a queue of size ``depth``.
+        """
+        assert depth > 0
+        self.queue = queue.Queue(maxsize = depth)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target = self.__produce,
+                                       args = (iter(iterable),),
+                                       daemon = True)
+        self.thread.start()
+
+    def __produce(self, iterator):
+        """
+        Worker loop, fills the queue until the iterator is exhausted or the
+        consumer stopped.
+        """
+        try:
+            for item in iterator:
+                if not self.__put((item, None)):
+                    return
+            self.__put((self._end, None))
+        except Exception as e:
+            self.__put((self._end, e))
+
+    def __put(self, item):
+        """
+        Put an item in the queue, giving up if the consumer stopped.
+        """
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        try:
+            while True:
+                item, e = self.queue.get()
+                if e is not None:
+                    raise e
+                if item is self._end:
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the worker thread.
+        """
+        self.stop.set()
+        self.thread.join()
+
+def parallel_map(f, items, workers, depth = None):
+    """
+    Generator applying ``f`` to each item on a pool of ``workers`` threads,
+    yielding the results in order. At most ``depth`` calls are in flight,
+    which bounds the memory used by the results waiting to be consumed.
+    """
+    depth = depth or workers
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(executor.submit(f, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def index_path(file):
+    """
+    Path of the chunk index associated to a given .csv file.
+    """
+    return file + index_suffix
+
+class ChunkIndex:
+    """
+    The ``ChunkIndex`` class
+    ========================
+    Sidecar of a .csv file, saved as "<file><index_suffix>". It records the
+    number of rows and columns of the file, and for each chunk size m the
+    byte offset of every chunk boundary. The first line of the file is
+    considered as a header, as pandas does.
+
+    Once the index exists, the metadata of the file is known without reading
+    it, and ``read`` seeks directly to any chunk, so that chunks can also be
+    read in parallel. If the sidecar cannot be written, e.g. in a read-only
+    directory, the index is only kept in memory.
+    """
+    def __init__(self, file, m = None):
+        """
+        Load the index of ``file``, or build it if it does not exist or is
+        outdated, in which case the boundaries of chunks of size m are
+        recorded during the same pass.
+        """
+        self.file = file
+        self.path = index_path(file)
+        stat = os.stat(file)
+        self.signature = [stat.st_size, stat.st_mtime]
+
+        if os.path.isfile(self.path):
+            with open(self.path, "r", encoding = 'utf-8') as f:
+                content = json.load(f)
+            if content["signature"] == self.signature:
+                for key in ["n", "n_columns", "start", "end", "offsets"]:
+                    setattr(self, key, content[key])
+                return
+
+        self.offsets = {}
+        self.__scan(m)
+        self.save()
+
+    def __scan(self, m):
+        """
+        Go once through the file to count its rows and columns, and to record
+        the boundaries of chunks of size m.
+        """
+        boundaries = []
+        with open(self.file, "rb") as f:
+            header = f.readline()
+            self.n_columns = len(header.split(b","))
+            self.start = position = f.tell()
+            n = 0
+            for line in f:
+                if m is not None and n % m == 0:
+                    boundaries.append(position)
+                position += len(line)
+                n += 1
+        self.n = n
+        self.end = position
+        if m is not None:
+            boundaries.append(position)
+            self.offsets[str(m)] = boundaries
+
+    def prepare(self, m):
+        """
+        Make sure the boundaries of chunks of size m are known, going through
+        the file again if needed.
+        """
+        if str(m) in self.offsets:
+            return
+        if m >= self.n:
+            self.offsets[str(m)] = [self.start, self.end]
+        else:
+            self.__scan(m)
+        self.save()
+
+    def save(self):
+        """
+        Write the index next to the file, if possible.
+        """
+        content = {"signature" : self.signature,
+                   "n" : self.n,
+                   "n_columns" : self.n_columns,
+                   "start" : self.start,
+                   "end" : self.end,
+                   "offsets" : self.offsets}
+        try:
+            with open(self.path, "w", encoding = 'utf-8') as f:
+                json.dump(content, f)
+        except OSError as e:
+            warn("The chunk index of {} is kept in memory : {}".format(
+                self.file, e))
+
+    def number_of_chunks(self, m):
+        """
+        Number of chunks of size m.
+        """
+        return len(self.offsets[str(m)]) - 1
+
+    def read(self, i, m):
+        """
+        Read the i-th chunk of size m.
+
+        Returns
+        -------
+        np.array [m, n_columns]
+            The raw chunk.
+        """
+        boundaries = self.offsets[str(m)]
+        start, end = boundaries[i], boundaries[i+1]
+        with open(self.file, "rb") as f:
+            f.seek(start)
+            raw = f.read(end-start)
+        chunk = pd.read_csv(io.BytesIO(raw), sep = ",", header = None,
+                            dtype = np.float32)
+        return chunk.values
+
+def list_shards(files):
+    """
+    Return the sorted list of shards given as a list of paths or as a glob
+    pattern.
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+    files = list(files)
+    assert len(files) > 0
+    for file in files:
+        assert os.path.isfile(file)
+    return files
+
+class ShardedIndex:
+    """
+    The ``ShardedIndex`` class
+    ==========================
+    Logical dataset made of several .csv files (shards) sharing the same
+    columns. Each shard has its own ``ChunkIndex``, so that its rows and
+    columns are only discovered once, the indices being built concurrently.
+
+    The shards are split into chunks of at most m rows which never overlap two
+    shards. The chunks of all shards are then numbered one after the other,
+    and ``read`` exposes the same interface as ``ChunkIndex``.
+    """
+    def __init__(self, files, m = None, workers = 1):
+        """
+        Load or build the indices of the shards ``files``, with at most
+        ``workers`` threads, e.g. the ``readers`` option of the graph.
+        """
+        self.files = files
+        self.workers = workers
+        self.indices = list(self.__map(lambda file : ChunkIndex(file, m),
+                                       files))
+        n_columns = set(index.n_columns for index in self.indices)
+        assert len(n_columns) == 1
+        self.n_columns = n_columns.pop()
+        self.n = sum(index.n for index in self.indices)
+        #chunks[m][c] = (shard, chunk number within the shard)
+        self.chunks = {}
+
+    def prepare(self, m):
+        """
+        Make sure the boundaries of chunks of size m are known for each shard.
+        """
+        if m in self.chunks:
+            return
+        list(self.__map(lambda index : index.prepare(m), self.indices))
+        chunks = []
+        for (shard, index) in enumerate(self.indices):
+            chunks += [(shard, i) for i in range(index.number_of_chunks(m))]
+        self.chunks[m] = chunks
+
+    def __map(self, f, items):
+        """
+        Apply ``f`` to the shards or their indices, on ``workers`` threads.
+        """
+        workers = min(self.workers, len(items))
+        if workers > 1:
+            return parallel_map(f, items, workers)
+        return map(f, items)
+
+    def number_of_chunks(self, m):
+        """
+        Number of chunks of size m, all shards together.
+        """
+        return len(self.chunks[m])
+
+    def read(self, c, m):
+        """
+        Read the c-th chunk of size m of the dataset.
+
+        Returns
+        -------
+        np.array [m, n_columns]
+            The raw chunk.
+        """
+        shard, i = self.chunks[m][c]
+        return self.indices[shard].read(i, m)
+
+class ChunkCache:
+    """
+    The ``ChunkCache`` class
+    ========================
+    In-memory cache of decoded chunks, keyed by chunk number. X and Y (or any
+    other arrays derived from the chunk) are kept as float32 arrays. When the
+    total size of the cached chunks exceeds ``budget`` bytes, the least
+    recently used chunks are evicted.
+
+    Hits and misses are counted by ``get``.
+    """
+    def __init__(self, budget):
+        """
+        Initialize an empty cache of ``budget`` bytes.
+        """
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.chunks = collections.OrderedDict()
+
+    def __contains__(self, i):
+        return i in self.chunks
+
+    def get(self, i):
+        """
+        Return the cached arrays of chunk i, such as (X, Y), or None if it is
+        not cached.
+        """
+        if i not in self.chunks:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.chunks.move_to_end(i)
+        return self.chunks[i]
+
+    def put(self, i, *arrays):
+        """
+        Cache a float32 copy of the arrays of chunk i, such as X and Y, being
+        possibly reused buffers, and return it.
+        """
+        arrays = tuple(copy_float32(A) for A in arrays)
+        size = sum(nbytes(A) for A in arrays)
+        #chunks larger than the whole budget are never cached
+        if size > self.budget:
+            return arrays
+        if i in self.chunks:
+            self.__remove(i)
+        self.chunks[i] = arrays
+        self.size += size
+        self.set_budget(self.budget)
+        return arrays
+
+    def set_budget(self, budget):
+        """
+        Change the budget, evicting the least recently used chunks if needed.
+        """
+        self.budget = budget
+        while self.size > self.budget:
+            self.__remove(next(iter(self.chunks)))
+
+    def __remove(self, i):
+        arrays = self.chunks.pop(i)
+        self.size -= sum(nbytes(A) for A in arrays)
+
+def copy_float32(X):
+    """
+    Contiguous float32 copy of a dense or scipy sparse matrix.
+    """
+    if scipy.sparse.issparse(X):
+        return X.astype(np.float32)
+    return np.array(X, dtype = np.float32, order = 'C')
+
+def nbytes(X):
+    """
+    Memory used by a dense or scipy sparse csr matrix.
+    """
+    if scipy.sparse.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+"""
+LIBSVM
+"""
+
+def libsvm_dimensions(file):
+    """
+    Go once through a file in the libsvm format to count its rows and deduce
+    d from the largest feature index. Feature indices start at 1.
+
+    Returns
+    -------
+    n : int
+        Number of rows.
+    d : int
+        Number of features.
+    """
+    n, d = 0, 0
+    with open(file, "rb") as f:
+        for line in f:
+            items = line.split(b"#")[0].split()
+            if not items:
+                continue
+            n += 1
+            for item in items[1:]:
+                idx = item.split(b":")[0]
+                if idx != b"qid":
+                    d = max(d, int(idx))
+    return n, d
+
+def parse_libsvm(lines, d, k, one_hot):
+    """
+    Parse lines in the libsvm format ("label idx:value idx:value ...").
+
+    Parameters
+    ----------
+    lines : list of bytes
+        The lines to parse.
+    d : int
+        d
+    k : int
+        k
+    one_hot : bool
+        Whether the labels are classes to be expanded. If not, k must be 1 and
+        the labels are directly used as responses.
+
+    Returns
+    -------
+    X : scipy.sparse.csr_matrix [m,d]
+        Design matrix.
+    Y : np.array [m,k]
+        Response matrix.
+    """
+    labels, indices, values, indptr = [], [], [], [0]
+    for line in lines:
+        items = line.split(b"#")[0].split()
+        if not items:
+            continue
+        labels.append(float(items[0]))
+        for item in items[1:]:
+            idx, value = item.split(b":")
+            if idx != b"qid":
+                indices.append(int(idx)-1)
+                values.append(float(value))
+        indptr.append(len(indices))
+
+    X = scipy.sparse.csr_matrix((np.asarray(values, dtype = np.float32),
+                                 np.asarray(indices, dtype = np.int64),
+                                 np.asarray(indptr, dtype = np.int64)),
+                                shape = (len(labels), d))
+    if one_hot:
+        Y = to_one_hot(labels, k)
+    else:
+        assert k == 1
+        Y = np.expand_dims(np.asarray(labels), 1)
+    return X, Y
+
+def read_libsvm_chunks(file, m, d, k, one_hot):
+    """
+    Generator streaming a file in the libsvm format by chunks of m rows.
+
+    Yields
+    ------
+    X : scipy.sparse.csr_matrix [m,d]
+        Design matrix of the chunk.
+    Y : np.array [m,k]
+        Response matrix of the chunk.
+    """
+    with open(file, "rb") as f:
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) == m:
+                yield parse_libsvm(lines, d, k, one_hot)
+                lines = []
+        if lines:
+            yield parse_libsvm(lines, d, k, one_hot)
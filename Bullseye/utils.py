@@ -8,7 +8,7 @@
 import numpy as np
 import struct
 import sys
-import tensorflow as tf
+from .lazy_import import tf
 import pandas as pd
 
 try:
@@ -129,6 +129,18 @@ def to_one_hot(y,k):
     y = list(map(int,y))
     return np.eye(k)[y]
 
+def to_sparse_value(X):
+    """
+    Convert a scipy sparse matrix into a tf.SparseTensorValue, with its
+    entries in row-major order.
+    """
+    X = X.tocsr()
+    X.sort_indices()
+    X = X.tocoo()
+    indices = np.stack([X.row, X.col], 1).astype(np.int64)
+    return tf.SparseTensorValue(indices, X.data.astype(np.float32),
+                                np.asarray(X.shape, dtype = np.int64))
+
 def from_one_hot(y):
     return np.asarray([np.where(r==1)[0][0] for r in y])
 
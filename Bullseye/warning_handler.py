@@ -73,6 +73,14 @@ def err_bad_name(name):
     Please, make sure to use standard characters"""
     err(msg.format(name=name))
 
+def err_unsupported_backend(backend, reason):
+    """
+    Raise a configuration an execution backend does not support.
+    """
+    msg = """
+    Unsupported configuration for the "{backend}" backend : {reason}"""
+    err(msg.format(backend=backend, reason=reason))
+
 def err_not_implemented(f = None):
     """
     Raise the NotImplementedError
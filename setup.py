@@ -17,10 +17,14 @@ setuptools.setup(
     install_requires = [
     "numpy>=1.15",
     "pandas>=0.23",
-    "tensorflow>=1.10",
+    "scipy>=1.1",
     "seaborn>=0.9.0",
     "matplotlib>=2.2.3"
     ],
+    #the "numpy" backend does not need tensorflow
+    extras_require = {
+    "tensorflow" : ["tensorflow>=1.15"]
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: GPL3",